@@ -2,27 +2,33 @@
 
 
 import os
+import sys
 import unittest
-import coverage
+
+# Coverage only traces the `cov` command; starting it at import slowed
+# every other command down.
+COV = None
+if sys.argv[1:2] == ['cov']:
+    import coverage
+    COV = coverage.coverage(
+        branch=True,
+        include='project/*',
+        omit=[
+            'project/tests/*',
+            'project/server/config.py',
+            'project/server/*/__init__.py'
+        ]
+    )
+    COV.start()
 
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
-COV = coverage.coverage(
-    branch=True,
-    include='project/*',
-    omit=[
-        'project/tests/*',
-        'project/server/config.py',
-        'project/server/*/__init__.py'
-    ]
-)
-COV.start()
-
-from project.server import app, db
+from project.server import create_app, db
 from project.server.models import User
 
 
+app = create_app()
 migrate = Migrate(app, db)
 manager = Manager(app)
 
@@ -30,9 +36,15 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
-@manager.command
-def test():
+@manager.option('-p', '--parallel', dest='parallel', type=int, default=1,
+                help='Worker processes, each with its own database.')
+def test(parallel):
     """Runs the unit tests without test coverage."""
+    if parallel > 1:
+        from project.server.config import TestingConfig
+        from project.tests import parallel as runner
+        return 0 if runner.run(
+            parallel, TestingConfig.SQLALCHEMY_DATABASE_URI) else 1
     tests = unittest.TestLoader().discover('project/tests', pattern='test*.py')
     result = unittest.TextTestRunner(verbosity=2).run(tests)
     if result.wasSuccessful():
@@ -84,25 +96,204 @@ def create_data():
     pass
 
 
+@manager.option('-d', '--directory', dest='directory', default='fixtures')
+@manager.option('-c', '--chunk-size', dest='chunk_size', type=int,
+                default=5000)
+@manager.option('-w', '--workers', dest='workers', type=int, default=4)
+@manager.option('-r', '--replace', dest='replace', action='store_true',
+                default=False)
+def load_data(directory, chunk_size, workers, replace):
+    """Bulk loads the CSV fixtures into the database."""
+    from project.server.data.loader import load_directory
+    from project.server.imports.jobs import recommend
+
+    results, skipped = load_directory(
+        directory, chunk_size=chunk_size, workers=workers, replace=replace)
+    # Loads queue a rebuild of the recommendations; run it now rather
+    # than waiting for the import worker.
+    recommend()
+    for result in results:
+        print('{:<20} {:>10} rows {:>8.2f}s {:>12.0f} rows/s'.format(
+            result.table, result.rows, result.seconds, result.rate))
+        if result.ignored:
+            print('    ignored columns: {}'.format(', '.join(result.ignored)))
+    if skipped:
+        print('skipped (no model): {}'.format(', '.join(skipped)))
+
+
+@manager.option('-d', '--directory', dest='directory', default='fixtures')
+@manager.option('-f', '--fetch-size', dest='fetch_size', type=int,
+                default=1000)
+@manager.option('-w', '--workers', dest='workers', type=int, default=4)
+@manager.option('-z', '--gzip', dest='compress', action='store_true',
+                default=False)
+@manager.option('-i', '--incremental', dest='incremental',
+                action='store_true', default=False)
+def dump_data(directory, fetch_size, workers, compress, incremental):
+    """Dumps the database tables to CSV."""
+    from project.server.data.dumper import dump_database
+
+    results = dump_database(
+        directory, fetch_size=fetch_size, workers=workers,
+        compress=compress, incremental=incremental)
+    for result in results:
+        print('{:<20} {:>10} rows {:>8.2f}s {:>12.0f} rows/s'.format(
+            result.table, result.rows, result.seconds, result.rate))
+
+
 @manager.command
-def dump_data():
-    """Creates sample data."""
-    import sqlite3
-    import csv
-
-    cursor = db.engine.execute("SELECT name FROM sqlite_master WHERE type='table';")
-
-    for table in cursor.fetchall():
-        table_name = table[0]
-        print(table_name)
-
-        csvfile = os.path.join('fixtures', '{}.csv'.format(table_name))
-        
-        with open(csvfile, 'w') as outfile:
-            outcsv = csv.writer(outfile)
-            cursor = db.engine.execute('select * from {}'.format(table_name))
-            outcsv.writerow([x for x in cursor.keys()])
-            outcsv.writerows(cursor.fetchall())
+def rebuild_rollups():
+    """Recomputes the inventory and valuation rollups from the cigars and
+    transfers tables."""
+    from project.server.inventory import rollups, valuation
+
+    with db.engine.begin() as connection:
+        rollups.rebuild(connection)
+        valuation.rebuild(connection)
+
+
+@manager.option('-k', '--keep', dest='keep', type=int, default=None)
+def snapshot_transfers(keep):
+    """Compacts the transfer log into a location snapshot."""
+    from project.server.inventory.transfers import take_snapshot
+
+    with db.engine.begin() as connection:
+        snapshot = take_snapshot(
+            connection,
+            app.config['TRANSFER_SNAPSHOT_KEEP'] if keep is None else keep)
+    print('snapshot {}'.format(snapshot) if snapshot else 'nothing to do')
+
+
+@manager.option('-d', '--directory', dest='directory', default=None)
+@manager.option('-k', '--keep', dest='keep', type=int, default=None)
+def snapshot(directory, keep):
+    """Writes a snapshot of the collection for offline clients."""
+    from project.server.sync.snapshot import build
+
+    with db.engine.begin() as connection:
+        path, version = build(
+            directory or app.config['SNAPSHOT_DIR'], connection,
+            app.config['SNAPSHOT_KEEP'] if keep is None else keep)
+    print('{} (version {}, {} bytes)'.format(
+        path, version, os.path.getsize(path)))
+
+
+@manager.option('-f', '--full', dest='full', action='store_true',
+                default=False)
+def recommend(full):
+    """Refreshes the similar products lists from the products queued
+    by rating writes; with --full, every list."""
+    from project.server.analytics.similar import refresh
+
+    written = refresh(db.session.connection(), full)
+    db.session.commit()
+    print('{} lists written'.format(written))
+
+
+@manager.command
+def build_assets():
+    """Fingerprints and gzips the static assets."""
+    from project.server import page_cache
+    from project.server.assets.build import build
+
+    built = build(app.static_folder, app.config['ASSETS_DIST'],
+                  app.config['ASSETS'])
+    for name, fingerprinted in sorted(built.items()):
+        print('{} -> {}'.format(name, fingerprinted))
+    # Cached pages link to the previous build. Running servers on this
+    # host pick up the new manifest and cache generation within a second.
+    page_cache.clear()
+
+
+@manager.command
+def clear_cache():
+    """Empties the page and fragment cache of every process on this
+    host."""
+    from project.server import page_cache
+
+    page_cache.clear()
+
+
+@manager.option('-o', '--once', dest='once', action='store_true',
+                default=False)
+def import_worker(once):
+    """Runs uploaded CSV imports from the job queue."""
+    from project.server.imports.jobs import work
+
+    done = work(once=once)
+    print('{} import(s) run'.format(done))
+
+
+@manager.option('-u', '--url', dest='urls', action='append')
+@manager.option('-s', '--size', dest='sizes', type=int, action='append')
+@manager.option('-n', '--samples', dest='samples', type=int, default=200)
+@manager.option('-o', '--output', dest='output', default=None)
+@manager.option('-b', '--baseline', dest='baseline', default=None)
+@manager.option('-t', '--tolerance', dest='tolerance', type=float,
+                default=0.25)
+@manager.option('-S', '--startup-samples', dest='startup_samples', type=int,
+                default=5)
+def bench(urls, sizes, samples, output, baseline, tolerance,
+          startup_samples):
+    """Benchmarks the hot paths against synthetic collections."""
+    import json
+    import tempfile
+    from project.server import bench as benchmarks
+
+    urls = urls or [
+        'sqlite:///' + os.path.join(tempfile.gettempdir(),
+                                    'cigardb-bench.sqlite'),
+        'postgresql://localhost/cigardb_bench',
+    ]
+    report = benchmarks.bench(urls, sizes or [10000], samples=samples,
+                              startup_samples=startup_samples)
+    if output:
+        with open(output, 'w') as outfile:
+            outfile.write(benchmarks.dumps(report))
+    else:
+        print(benchmarks.dumps(report))
+    if baseline:
+        with open(baseline) as infile:
+            regressions = benchmarks.compare(report, json.load(infile),
+                                             tolerance)
+        for database, size, name, before, after in regressions:
+            print('REGRESSION {} {} {}: p95 {:.3f}ms -> {:.3f}ms'.format(
+                database, size, name, before * 1000, after * 1000))
+        if regressions:
+            return 1
+    return 0
+
+
+@manager.option('-u', '--url', dest='url',
+                default='http://localhost:5000/metrics')
+@manager.option('-i', '--interval', dest='interval', type=float, default=2.0)
+@manager.option('-n', '--iterations', dest='iterations', type=int, default=0)
+@manager.option('-t', '--token', dest='token',
+                default=os.getenv('METRICS_TOKEN'))
+def top(url, interval, iterations, token):
+    """Shows live per-endpoint metrics from a running server."""
+    import time
+    from urllib.request import Request, urlopen
+    from project.server.instrumentation import format_top, parse_metrics, \
+        top_rows
+
+    headers = {'Authorization': 'Bearer ' + token} if token else {}
+
+    def fetch():
+        with urlopen(Request(url, headers=headers),
+                     timeout=interval) as response:
+            return parse_metrics(response.read().decode('utf-8')), \
+                time.time()
+
+    previous, at = fetch()
+    shown = 0
+    while not iterations or shown < iterations:
+        time.sleep(interval)
+        current, now = fetch()
+        print('\033[2J\033[H' + '{}  {}'.format(url, time.ctime(now)))
+        print(format_top(top_rows(previous, current, now - at)))
+        previous, at = current, now
+        shown += 1
 
 
 if __name__ == '__main__':
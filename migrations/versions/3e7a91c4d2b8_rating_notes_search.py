@@ -0,0 +1,92 @@
+"""rating notes search
+
+Revision ID: 3e7a91c4d2b8
+Revises: 5d3c8e61a2f4
+Create Date: 2026-10-17 09:12:40.118305
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e7a91c4d2b8'
+down_revision = '5d3c8e61a2f4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Frozen copies of the DDL in project/server/search/notes.py.
+SQLITE_UPGRADE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS rating_notes USING fts5("
+    "app_notes, smoke_notes, taste_notes, overall_notes, "
+    "content='ratings', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS rating_notes_insert AFTER INSERT ON "
+    "ratings BEGIN INSERT INTO rating_notes (rowid, app_notes, smoke_notes, "
+    "taste_notes, overall_notes) VALUES (new.id, new.app_notes, "
+    "new.smoke_notes, new.taste_notes, new.overall_notes); END",
+    "CREATE TRIGGER IF NOT EXISTS rating_notes_delete AFTER DELETE ON "
+    "ratings BEGIN INSERT INTO rating_notes (rating_notes, rowid, app_notes, "
+    "smoke_notes, taste_notes, overall_notes) VALUES ('delete', old.id, "
+    "old.app_notes, old.smoke_notes, old.taste_notes, old.overall_notes); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS rating_notes_update AFTER UPDATE OF id, "
+    "app_notes, smoke_notes, taste_notes, overall_notes ON ratings BEGIN "
+    "INSERT INTO rating_notes (rating_notes, rowid, app_notes, smoke_notes, "
+    "taste_notes, overall_notes) VALUES ('delete', old.id, old.app_notes, "
+    "old.smoke_notes, old.taste_notes, old.overall_notes); "
+    "INSERT INTO rating_notes (rowid, app_notes, smoke_notes, taste_notes, "
+    "overall_notes) VALUES (new.id, new.app_notes, new.smoke_notes, "
+    "new.taste_notes, new.overall_notes); END",
+    "INSERT INTO rating_notes (rating_notes) VALUES ('rebuild')",
+)
+SQLITE_DOWNGRADE = (
+    'DROP TRIGGER IF EXISTS rating_notes_update',
+    'DROP TRIGGER IF EXISTS rating_notes_delete',
+    'DROP TRIGGER IF EXISTS rating_notes_insert',
+    'DROP TABLE IF EXISTS rating_notes',
+)
+
+POSTGRESQL_UPGRADE = (
+    'ALTER TABLE ratings ADD COLUMN notes_search tsvector',
+    'CREATE INDEX ix_ratings_notes_search ON ratings USING gin '
+    '(notes_search)',
+    "CREATE OR REPLACE FUNCTION ratings_notes_search() RETURNS trigger AS $$ "
+    "BEGIN NEW.notes_search := "
+    "setweight(to_tsvector('english', coalesce(NEW.app_notes, '')), 'D') || "
+    "setweight(to_tsvector('english', coalesce(NEW.smoke_notes, '')), 'C') "
+    "|| "
+    "setweight(to_tsvector('english', coalesce(NEW.taste_notes, '')), 'B') "
+    "|| "
+    "setweight(to_tsvector('english', coalesce(NEW.overall_notes, '')), "
+    "'A'); RETURN NEW; END $$ LANGUAGE plpgsql",
+    'CREATE TRIGGER ratings_notes_search BEFORE INSERT OR UPDATE OF '
+    'app_notes, smoke_notes, taste_notes, overall_notes ON ratings '
+    'FOR EACH ROW EXECUTE PROCEDURE ratings_notes_search()',
+    # Fills the column for the ratings already there.
+    'UPDATE ratings SET app_notes = app_notes',
+)
+POSTGRESQL_DOWNGRADE = (
+    'DROP FUNCTION IF EXISTS ratings_notes_search() CASCADE',
+    'DROP INDEX IF EXISTS ix_ratings_notes_search',
+    'ALTER TABLE ratings DROP COLUMN IF EXISTS notes_search',
+)
+
+UPGRADE = {
+    'sqlite': SQLITE_UPGRADE,
+    'postgresql': POSTGRESQL_UPGRADE,
+}
+DOWNGRADE = {
+    'sqlite': SQLITE_DOWNGRADE,
+    'postgresql': POSTGRESQL_DOWNGRADE,
+}
+
+
+def upgrade():
+    connection = op.get_bind()
+    for statement in UPGRADE.get(connection.dialect.name, ()):
+        op.execute(sa.text(statement))
+
+
+def downgrade():
+    connection = op.get_bind()
+    for statement in DOWNGRADE.get(connection.dialect.name, ()):
+        op.execute(sa.text(statement))
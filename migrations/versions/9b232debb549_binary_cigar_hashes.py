@@ -0,0 +1,180 @@
+"""binary cigar hashes
+
+Revision ID: 9b232debb549
+Revises: 7f935b6ec7ba
+Create Date: 2026-10-17 23:21:40.117302
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9b232debb549'
+down_revision = '7f935b6ec7ba'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# Rows per UPDATE while copying data between columns.
+BATCH = 10000
+
+REFERENCES = ('ratings', 'transfers', 'session_inventory')
+ENTRIES = 'location_snapshot_entries'
+
+# Lower-case hex of a binary column, NULL for NULL.
+HEX = {
+    'postgresql': "encode({}, 'hex')",
+    'sqlite': "nullif(lower(hex({})), '')",
+}
+
+
+def _table(name, *columns):
+    return sa.table(name, sa.column('id', sa.Integer), *columns)
+
+
+def _cigars(hash_type):
+    return _table('cigars', sa.column('hash', hash_type),
+                  sa.column('hash_new', sa.LargeBinary))
+
+
+def _ranges(connection, table):
+    low, high = connection.execute(
+        sa.select([sa.func.min(table.c.id), sa.func.max(table.c.id)])).first()
+    if low is None:
+        return
+    for start in range(low, high + 1, BATCH):
+        yield start, start + BATCH - 1
+
+
+def _copy(connection, table, column, value):
+    """Sets `column` to `value`, a correlated expression, one id range
+    at a time."""
+    for start, stop in _ranges(connection, table):
+        connection.execute(table.update()
+                           .where(table.c.id.between(start, stop))
+                           .values({column: value}))
+
+
+def _check_hashes(connection, cigars):
+    bad = []
+    for start, stop in _ranges(connection, cigars):
+        for id, hash in connection.execute(
+                sa.select([cigars.c.id, cigars.c.hash])
+                .where(cigars.c.id.between(start, stop))):
+            if hash is None:
+                continue
+            try:
+                if len(bytes.fromhex(hash.strip())) > 20:
+                    bad.append(id)
+            except ValueError:
+                bad.append(id)
+    if bad:
+        raise ValueError(
+            'cigars with ids {} have hashes that are not hex digests of at '
+            'most 20 bytes; fix them and run the upgrade again.'.format(
+                ', '.join(str(id) for id in bad[:20])))
+
+
+def _hash_to_binary(connection, cigars):
+    if connection.dialect.name == 'postgresql':
+        _copy(connection, cigars, 'hash_new',
+              sa.func.decode(sa.func.lower(sa.func.trim(cigars.c.hash)),
+                             'hex'))
+        return
+    for start, stop in _ranges(connection, cigars):
+        rows = connection.execute(
+            sa.select([cigars.c.id, cigars.c.hash])
+            .where(cigars.c.id.between(start, stop))
+            .where(cigars.c.hash.isnot(None))).fetchall()
+        if rows:
+            connection.execute(
+                cigars.update().where(cigars.c.id == sa.bindparam('_id'))
+                .values(hash_new=sa.bindparam('_hash')),
+                [{'_id': id, '_hash': bytes.fromhex(hash.strip())}
+                 for id, hash in rows])
+
+
+def _binary_to_hash(connection, cigars):
+    template = HEX.get(connection.dialect.name, HEX['sqlite'])
+    _copy(connection, cigars, 'hash_new',
+          sa.literal_column(template.format('cigars.hash')))
+
+
+def upgrade():
+    connection = op.get_bind()
+    cigars = _cigars(sa.String)
+    _check_hashes(connection, cigars)
+
+    # Dependent tables first: their foreign keys hold on to the text hash.
+    for name in REFERENCES + (ENTRIES,):
+        op.add_column(name, sa.Column('cigar', sa.Integer(), nullable=True))
+        table = _table(name, sa.column('hash'), sa.column('cigar'))
+        _copy(connection, table, 'cigar',
+              sa.select([cigars.c.id]).where(cigars.c.hash == table.c.hash)
+              .as_scalar())
+    entries = _table(ENTRIES, sa.column('cigar'))
+    # Entries for cigars deleted since the snapshot point nowhere.
+    connection.execute(entries.delete().where(entries.c.cigar.is_(None)))
+
+    for name in REFERENCES:
+        with op.batch_alter_table(name) as batch_op:
+            batch_op.drop_index('ix_{}_hash'.format(name))
+            batch_op.drop_column('hash')
+            batch_op.create_index('ix_{}_cigar'.format(name), ['cigar'],
+                                  unique=False)
+            batch_op.create_foreign_key('{}_cigar_fkey'.format(name),
+                                        'cigars', ['cigar'], ['id'])
+    with op.batch_alter_table(ENTRIES) as batch_op:
+        batch_op.drop_index('ix_location_snapshot_entries_snapshot_hash')
+        batch_op.drop_column('hash')
+        batch_op.alter_column('cigar', existing_type=sa.Integer(),
+                              nullable=False)
+        batch_op.create_index('ix_location_snapshot_entries_snapshot_cigar',
+                              ['snapshot', 'cigar'], unique=False)
+
+    op.add_column('cigars', sa.Column('hash_new', sa.LargeBinary(length=20),
+                                      nullable=True))
+    _hash_to_binary(connection, cigars)
+    with op.batch_alter_table('cigars') as batch_op:
+        batch_op.drop_index('ix_cigars_hash')
+        batch_op.drop_column('hash')
+        batch_op.alter_column('hash_new', new_column_name='hash',
+                              existing_type=sa.LargeBinary(length=20))
+    op.create_index('ix_cigars_hash', 'cigars', ['hash'], unique=True)
+
+
+def downgrade():
+    connection = op.get_bind()
+    op.add_column('cigars', sa.Column('hash_new', sa.String(length=64),
+                                      nullable=True))
+    _binary_to_hash(connection, _cigars(sa.LargeBinary))
+    with op.batch_alter_table('cigars') as batch_op:
+        batch_op.drop_index('ix_cigars_hash')
+        batch_op.drop_column('hash')
+        batch_op.alter_column('hash_new', new_column_name='hash',
+                              existing_type=sa.String(length=64))
+    op.create_index('ix_cigars_hash', 'cigars', ['hash'], unique=True)
+
+    cigars = _cigars(sa.String)
+    for name in REFERENCES + (ENTRIES,):
+        op.add_column(name, sa.Column('hash', sa.String(length=64),
+                                      nullable=True))
+        table = _table(name, sa.column('hash'), sa.column('cigar'))
+        _copy(connection, table, 'hash',
+              sa.select([cigars.c.hash]).where(cigars.c.id == table.c.cigar)
+              .as_scalar())
+
+    for name in REFERENCES:
+        with op.batch_alter_table(name) as batch_op:
+            batch_op.drop_index('ix_{}_cigar'.format(name))
+            batch_op.drop_column('cigar')
+            batch_op.create_index('ix_{}_hash'.format(name), ['hash'],
+                                  unique=False)
+            batch_op.create_foreign_key('{}_hash_fkey'.format(name),
+                                        'cigars', ['hash'], ['hash'])
+    with op.batch_alter_table(ENTRIES) as batch_op:
+        batch_op.drop_index('ix_location_snapshot_entries_snapshot_cigar')
+        batch_op.drop_column('cigar')
+        batch_op.alter_column('hash', existing_type=sa.String(length=64),
+                              nullable=False)
+        batch_op.create_index('ix_location_snapshot_entries_snapshot_hash',
+                              ['snapshot', 'hash'], unique=False)
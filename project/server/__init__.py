@@ -12,100 +12,155 @@ import os
 from flask import Flask, render_template
 from flask_login import LoginManager
 from flask_bcrypt import Bcrypt
-from flask_debugtoolbar import DebugToolbarExtension
 from flask_bootstrap import Bootstrap
-from flask_sqlalchemy import SQLAlchemy
 
-################
-#### config ####
-################
-
-app = Flask(
-    __name__,
-    template_folder='../client/templates',
-    static_folder='../client/static'
-)
-
-
-app_settings = os.getenv('APP_SETTINGS', 'project.server.config.DevelopmentConfig')
-app.config.from_object(app_settings)
+from project.server.caching import PageCache
+from project.server.database import RoutingSQLAlchemy
+from project.server.hashing import PasswordHasher
+from project.server.instrumentation import Instrumentation
 
 
 ####################
 #### extensions ####
 ####################
 
+# Created unbound; `create_app` initializes them for each app.
 login_manager = LoginManager()
-login_manager.init_app(app)
-bcrypt = Bcrypt(app)
-toolbar = DebugToolbarExtension(app)
-bootstrap = Bootstrap(app)
-db = SQLAlchemy(app)
-
-###################
-### blueprints ####
-###################
-
-from project.server.user.views import user_blueprint
-from project.server.main.views import main_blueprint
-app.register_blueprint(user_blueprint)
-app.register_blueprint(main_blueprint)
+bcrypt = Bcrypt()
+hasher = PasswordHasher()
+bootstrap = Bootstrap()
+db = RoutingSQLAlchemy()
+instrumentation = Instrumentation()
+page_cache = PageCache()
 
 ###################
 ### flask-login ####
 ###################
 
-from project.server.models import User
+from project.server.user.cache import UserCache
 
 login_manager.login_view = "user.login"
 login_manager.login_message_category = 'danger'
+user_cache = UserCache()
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.filter(User.id == int(user_id)).first()
+    return user_cache.get(int(user_id))
+
+
+#################
+#### factory ####
+#################
+
+def create_app(config=None):
+    """Builds an app configured from `config`, an import path, or else
+    from `$APP_SETTINGS`."""
+    app = Flask(
+        __name__,
+        template_folder='../client/templates',
+        static_folder='../client/static'
+    )
+    app.config.from_object(config or os.getenv(
+        'APP_SETTINGS', 'project.server.config.DevelopmentConfig'))
+
+    login_manager.init_app(app)
+    bcrypt.init_app(app)
+    hasher.init_app(app)
+    bootstrap.init_app(app)
+    db.init_app(app)
+    instrumentation.init_app(app)
+    page_cache.init_app(app)
+    user_cache.init_app(app)
+    if app.config.get('DEBUG_TB_ENABLED'):
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    register_blueprints(app)
+    if app.config.get('ADMIN_ENABLED', True):
+        register_admin(app)
+    register_error_handlers(app)
+    return app
 
 
 ###################
-### admin stuff ####
+### blueprints ####
 ###################
-from project.server.models import Brand
-from project.server.models import Product
-from project.server.models import Size
-from project.server.models import Inventory
-from project.server.models import Location
 
-from flask_admin import Admin
-from flask_admin.contrib.sqla import ModelView
+def register_blueprints(app):
+    from project.server.user.views import user_blueprint
+    from project.server.main.views import main_blueprint
+    from project.server.inventory.views import inventory_blueprint
+    from project.server.search.views import search_blueprint
+    from project.server.api.views import api_blueprint
+    from project.server.metrics.views import metrics_blueprint
+    from project.server.assets.views import assets_blueprint
+    from project.server.imports.views import imports_blueprint
+    from project.server.sync.views import sync_blueprint
+    app.register_blueprint(user_blueprint)
+    app.register_blueprint(main_blueprint)
+    app.register_blueprint(inventory_blueprint)
+    app.register_blueprint(search_blueprint)
+    app.register_blueprint(api_blueprint)
+    app.register_blueprint(metrics_blueprint)
+    app.register_blueprint(assets_blueprint)
+    app.register_blueprint(imports_blueprint)
+    app.register_blueprint(sync_blueprint)
 
 
-admin = Admin(app, template_mode='bootstrap3')
-admin.add_view(ModelView(User, db.session, endpoint='user-admin'))
-admin.add_view(ModelView(Brand, db.session, endpoint='brand-admin'))
-admin.add_view(ModelView(Product, db.session, endpoint='product-admin'))
-admin.add_view(ModelView(Size, db.session, endpoint='size-admin'))
-admin.add_view(ModelView(Inventory, db.session, endpoint='inventory-admin'))
-admin.add_view(ModelView(Location, db.session, endpoint='location-admin'))
+###################
+### admin stuff ####
+###################
+
+def register_admin(app):
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+
+    from project.server.admin_views import BrandAdminView, \
+        InventoryAdminView, ProductAdminView, RatingAdminView
+    from project.server.models import Brand, Inventory, Location, Product, \
+        Rating, Size, User
+
+    admin = Admin(app, template_mode='bootstrap3')
+    admin.add_view(ModelView(User, db.session, endpoint='user-admin'))
+    admin.add_view(BrandAdminView(Brand, db.session, endpoint='brand-admin'))
+    admin.add_view(
+        ProductAdminView(Product, db.session, endpoint='product-admin'))
+    admin.add_view(ModelView(Size, db.session, endpoint='size-admin'))
+    admin.add_view(
+        InventoryAdminView(Inventory, db.session, endpoint='inventory-admin'))
+    admin.add_view(ModelView(Location, db.session, endpoint='location-admin'))
+    admin.add_view(
+        RatingAdminView(Rating, db.session, endpoint='rating-admin'))
+    return admin
+
 
 ########################
 #### error handlers ####
 ########################
 
-@app.errorhandler(401)
-def forbidden_page(error):
+@page_cache.cached('error-401')
+def unauthorized_page(error):
     return render_template("errors/401.html"), 401
 
 
-@app.errorhandler(403)
+@page_cache.cached('error-403')
 def forbidden_page(error):
     return render_template("errors/403.html"), 403
 
 
-@app.errorhandler(404)
+@page_cache.cached('error-404')
 def page_not_found(error):
     return render_template("errors/404.html"), 404
 
 
-@app.errorhandler(500)
+@page_cache.cached('error-500')
 def server_error_page(error):
     return render_template("errors/500.html"), 500
+
+
+def register_error_handlers(app):
+    app.register_error_handler(401, unauthorized_page)
+    app.register_error_handler(403, forbidden_page)
+    app.register_error_handler(404, page_not_found)
+    app.register_error_handler(500, server_error_page)
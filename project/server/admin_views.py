@@ -0,0 +1,249 @@
+# project/server/admin_views.py
+
+
+#################
+#### imports ####
+#################
+
+from flask import flash, g, has_request_context, request
+from flask_admin.actions import action
+from flask_admin.contrib.sqla import ModelView
+from flask_admin.helpers import get_redirect_target
+from sqlalchemy import false, func
+from sqlalchemy.orm import joinedload
+
+from project.server.inventory import bulk
+from project.server.models import Inventory, Location, Size
+from project.server.sqltypes import is_hex
+
+CONFIRM_DELETE = 'Are you sure you want to delete selected records?'
+
+
+###############
+#### views ####
+###############
+
+class LargeTableModelView(ModelView):
+    """A ModelView for tables too big for OFFSET paging and COUNT(*).
+
+    Unsorted, unfiltered list pages seek on the primary key instead of
+    using OFFSET: the link to the next page carries the key that ends this
+    one as `after`, and the link to the previous page the key that starts
+    it as `before`, so each page is one index seek however far in it is,
+    and rows added or removed elsewhere never shift it. As only the
+    neighbouring pages' keys are known, these lists get the previous and
+    next pager, and a page number without a key shows no rows. Counts come
+    from the planner's estimate once a table passes
+    `estimate_count_threshold` rows. Search, filters and column sorts fall
+    back to the stock behaviour.
+    """
+
+    # Relationships (dotted for nested ones) loaded in the list query.
+    eager_load = ()
+    estimate_count_threshold = 10000
+
+    @property
+    def _pk(self):
+        return getattr(self.model, self._primary_key)
+
+    def get_query(self):
+        query = super(LargeTableModelView, self).get_query()
+        for path in self.eager_load:
+            option = None
+            for name in path.split('.'):
+                option = joinedload(name) if option is None \
+                    else option.joinedload(name)
+            query = query.options(option)
+        return query
+
+    def estimated_count(self):
+        table = self.model.__table__
+        dialect = self.session.get_bind().dialect.name
+        if dialect == 'postgresql':
+            estimate = self.session.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = CAST(:name AS regclass)', {'name': table.name}
+            ).scalar()
+        else:
+            # The highest key is an upper bound that costs one index probe.
+            estimate = self.session.query(func.max(self._pk)).scalar()
+        if estimate is not None and estimate >= self.estimate_count_threshold:
+            return int(estimate)
+        return self.get_count_query().scalar()
+
+    def _seek_keys(self):
+        """Returns the `after` and `before` keys of the request, if any."""
+        if not has_request_context():
+            return None, None
+        return (request.args.get('after', type=int),
+                request.args.get('before', type=int))
+
+    def get_list(self, page, sort_column, sort_desc, search, filters,
+                 execute=True, page_size=None):
+        if search or filters or sort_column is not None:
+            return super(LargeTableModelView, self).get_list(
+                page, sort_column, sort_desc, search, filters,
+                execute=execute, page_size=page_size)
+
+        if page_size is None:
+            page_size = self.page_size
+        count = None if self.simple_list_pager else self.estimated_count()
+        query = self.get_query()
+        for relation in self._auto_joins:
+            query = query.options(joinedload(relation))
+
+        after, before = self._seek_keys()
+        backwards = False
+        if page and page_size:
+            if after is not None:
+                query = query.filter(self._pk > after)
+            elif before is not None:
+                query = query.filter(self._pk < before)
+                backwards = True
+            else:
+                query = query.filter(false())
+        query = query.order_by(self._pk.desc() if backwards else self._pk)
+        if page_size:
+            query = query.limit(page_size)
+        if not execute:
+            return count, query
+
+        rows = query.all()
+        if backwards:
+            rows.reverse()
+        if has_request_context():
+            # For the pager links; see `_get_list_url`.
+            g.admin_page_keys = (
+                getattr(rows[0], self._primary_key) if rows else None,
+                getattr(rows[-1], self._primary_key) if rows else None)
+        return count, rows
+
+    def _get_list_url(self, view_args):
+        keys = g.get('admin_page_keys')
+        if keys is not None and view_args.page and not (
+                view_args.search or view_args.filters or
+                view_args.sort is not None):
+            current = request.args.get('page', 0, type=int)
+            view_args = view_args.clone()
+            if view_args.page == current + 1 and keys[1] is not None:
+                view_args.extra_args['after'] = keys[1]
+            elif view_args.page == current - 1 and keys[0] is not None:
+                view_args.extra_args['before'] = keys[0]
+        return super(LargeTableModelView, self)._get_list_url(view_args)
+
+    def render(self, template, **kwargs):
+        if g.get('admin_page_keys') is not None and kwargs.get('num_pages'):
+            # Numbered pages other than the neighbours have no key.
+            kwargs['num_pages'] = None
+        return super(LargeTableModelView, self).render(template, **kwargs)
+
+
+class BulkActionsMixin(object):
+    """Runs actions on the selected rows as set-based statements in
+    batches, rather than loading and saving each one."""
+
+    def _choices(self, model):
+        return self.session.query(model.id, model.name) \
+            .order_by(model.name, model.id).all()
+
+    def run_bulk(self, ids, apply, message, field=None, choices=None):
+        """Commits `apply(ids)` and flashes `message` with the count.
+
+        An action that needs a value names its form `field`; until the
+        form has one (from `choices`, if given), this returns a page that
+        asks for it and posts the selection back.
+        """
+        args = ()
+        if field is not None:
+            value = request.form.get(field, type=int)
+            if value is None or (choices is not None and
+                                 value not in dict(choices)):
+                return self.render(
+                    'admin/bulk_action.html', action=request.form['action'],
+                    ids=ids, field=field, choices=choices,
+                    return_url=get_redirect_target() or
+                    self.get_url('.index_view'))
+            args = (value,)
+        try:
+            count = apply(ids, *args)
+            self.session.commit()
+        except Exception as ex:
+            self.session.rollback()
+            if not self.handle_view_exception(ex):
+                raise
+            flash('Failed to update records. {}'.format(ex), 'error')
+            return None
+        flash(message.format(count=count), 'success')
+        return None
+
+
+class InventoryAdminView(BulkActionsMixin, LargeTableModelView):
+    column_list = ('hash', 'products', 'sizes', 'locations')
+    column_labels = dict(products='Product', sizes='Size',
+                         locations='Location')
+    column_searchable_list = ('hash',)
+    eager_load = ('products', 'sizes', 'locations')
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        # `hash` is binary, so LIKE can't match a hex prefix; each term
+        # becomes a range seek on the unique index instead.
+        digits = 2 * Inventory.hash.type.length
+        for term in search.split():
+            low = term.lower() + '0' * (len(term) % 2)
+            if len(low) > digits or not is_hex(low):
+                condition = false()
+            else:
+                condition = Inventory.hash.between(
+                    low, term.lower().ljust(digits, 'f'))
+            query = query.filter(condition)
+            if count_query is not None:
+                count_query = count_query.filter(condition)
+        return query, count_query, joins, count_joins
+
+    @action('move', 'Move to location')
+    def action_move(self, ids):
+        return self.run_bulk(ids, bulk.move, '{count} cigars were moved.',
+                             'location', self._choices(Location))
+
+    @action('resize', 'Change size')
+    def action_resize(self, ids):
+        return self.run_bulk(ids, bulk.resize,
+                             '{count} cigars were resized.', 'size',
+                             self._choices(Size))
+
+    @action('delete', 'Delete', CONFIRM_DELETE)
+    def action_delete(self, ids):
+        return self.run_bulk(ids, bulk.delete_cigars,
+                             '{count} cigars were deleted.')
+
+
+class ProductAdminView(BulkActionsMixin, LargeTableModelView):
+    column_list = ('name', 'brands')
+    column_labels = dict(brands='Brand')
+    column_searchable_list = ('name',)
+    eager_load = ('brands',)
+
+    @action('delete', 'Delete', CONFIRM_DELETE)
+    def action_delete(self, ids):
+        return self.run_bulk(ids, bulk.delete_products,
+                             '{count} products were deleted.')
+
+
+class BrandAdminView(LargeTableModelView):
+    column_list = ('name',)
+    column_searchable_list = ('name',)
+
+
+class RatingAdminView(BulkActionsMixin, LargeTableModelView):
+    column_list = ('cigar', 'app_score', 'smoke_score', 'taste_score',
+                   'overall_score')
+
+    @action('rerate', 'Change overall score')
+    def action_rerate(self, ids):
+        return self.run_bulk(ids, bulk.rerate, '{count} ratings were changed.',
+                             'score')
+
+    @action('delete', 'Delete', CONFIRM_DELETE)
+    def action_delete(self, ids):
+        return self.run_bulk(ids, bulk.delete_ratings,
+                             '{count} ratings were deleted.')
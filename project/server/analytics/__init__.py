@@ -0,0 +1 @@
+# project/server/analytics/__init__.py
@@ -0,0 +1,162 @@
+# project/server/analytics/changes.py
+
+
+#################
+#### imports ####
+#################
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import and_, event, exists, inspect, literal, or_, \
+    select
+
+from project.server import versioning
+from project.server.models import Inventory, Product, Rating, \
+    SimilarPending
+
+
+################
+#### config ####
+################
+
+# Bumped when cigars change product or size or are deleted, which is all
+# a rating sees of them; moves and price changes leave it alone.
+RATED = 'cigars.rated'
+# Tables whose bulk loads can change what the ratings see.
+TABLES = ('ratings', 'cigars', 'products')
+# What of a rating, cigar or product its product's vector is built from.
+RATING_COLUMNS = ('cigar', 'app_score', 'smoke_score', 'taste_score',
+                  'overall_score')
+CIGAR_COLUMNS = ('product', 'size')
+PRODUCT_COLUMNS = ('brand',)
+
+pending = SimilarPending.__table__
+cigars = Inventory.__table__
+ratings = Rating.__table__
+
+# `session.info` key of what the flush under way touches, for its
+# `after_flush` to queue again.
+TOUCHED = 'similar_touched'
+
+
+#################
+#### helpers ####
+#################
+
+def bulk_counters(name):
+    """The counters a bulk write to table `name` moves: its own, and
+    `RATED` too for cigars, whose products and sizes it may change."""
+    return (name, RATED) if name == 'cigars' else (name,)
+
+
+def queue_products(connection, ids):
+    """Queues the products with `ids` for a recommendation refresh."""
+    ids = sorted(set(ids))
+    if ids:
+        connection.execute(pending.insert(),
+                           [{'product': id} for id in ids])
+
+
+def queue_rated(connection, cigar_where=None, rating_where=None):
+    """Queues the products of the rated cigars matching `cigar_where`,
+    and of the cigars rated by the ratings matching `rating_where`, with
+    one INSERT ... SELECT. Writes that move ratings between products call
+    it before and after, so the products they leave are queued as well as
+    those they join."""
+    matches = []
+    if cigar_where is not None:
+        matches.append(and_(cigar_where, exists().where(
+            ratings.c.cigar == cigars.c.id)))
+    if rating_where is not None:
+        matches.append(cigars.c.id.in_(
+            select([ratings.c.cigar]).where(rating_where)))
+    if not matches:
+        return
+    connection.execute(pending.insert().from_select(
+        ['product'], select([cigars.c.product]).distinct().where(
+            and_(cigars.c.product.isnot(None), or_(*matches)))))
+
+
+def queue_all(connection):
+    """Queues a rebuild of every list, after a load that bypassed the
+    session."""
+    connection.execute(pending.insert().values(product=literal(None)))
+
+
+#####################
+#### maintenance ####
+#####################
+
+# Kept apart from the analytics, which import NumPy on first use; these
+# listeners have to be registered before the first write. Each flush that
+# changes what a vector is built from queues the products concerned,
+# before and after it; `similar.refresh` picks them up later, from the
+# import worker or `manage.py recommend`.
+
+def _changed(target, names):
+    attrs = inspect(target).attrs
+    return any(attrs[name].history.has_changes() for name in names)
+
+
+def _id(target):
+    # From the identity, which an expired instance still has.
+    return inspect(target).identity[0]
+
+
+def _touched(session):
+    """What a flush changes: `(cigars, ratings)` whose products to queue
+    before it and those to queue again after it, as they moved to other
+    products; products to queue; and whether rated cigars changed."""
+    before, after = (set(), set()), (set(), set())
+    products, rated = set(), False
+    for target in session.dirty | session.deleted:
+        deleted = target in session.deleted
+        if isinstance(target, Inventory):
+            if deleted or _changed(target, CIGAR_COLUMNS):
+                before[0].add(_id(target))
+                rated = True
+                if not deleted and _changed(target, ('product',)):
+                    after[0].add(_id(target))
+        elif isinstance(target, Rating):
+            if deleted or _changed(target, RATING_COLUMNS):
+                before[1].add(_id(target))
+                if not deleted and _changed(target, ('cigar',)):
+                    after[1].add(_id(target))
+        elif isinstance(target, Product):
+            if deleted or _changed(target, PRODUCT_COLUMNS):
+                products.add(_id(target))
+    return before, after, products, rated
+
+
+def _queue(connection, cigar_ids, rating_ids):
+    if cigar_ids or rating_ids:
+        queue_rated(
+            connection,
+            cigars.c.id.in_(sorted(cigar_ids)) if cigar_ids else None,
+            ratings.c.id.in_(sorted(rating_ids)) if rating_ids else None)
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def _queue_before(session, flush_context, instances):
+    before, after, products, rated = _touched(session)
+    # New ratings are only known by id once flushed.
+    session.info[TOUCHED] = (
+        after,
+        [target for target in session.new if isinstance(target, Rating)],
+        rated)
+    if any(before) or products:
+        connection = session.connection()
+        _queue(connection, *before)
+        queue_products(connection, products)
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _queue_after(session, flush_context):
+    touched = session.info.pop(TOUCHED, None)
+    if touched is None:
+        return
+    (cigar_ids, rating_ids), new, rated = touched
+    rating_ids = rating_ids | set(target.id for target in new)
+    connection = session.connection()
+    _queue(connection, cigar_ids, rating_ids)
+    if rated:
+        versioning.bump(connection, RATED)
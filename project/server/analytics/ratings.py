@@ -0,0 +1,198 @@
+# project/server/analytics/ratings.py
+
+
+#################
+#### imports ####
+#################
+
+import threading
+
+import numpy as np
+from sqlalchemy.orm import Query
+
+from project.server import db, versioning
+from project.server.analytics.changes import RATED
+from project.server.models import Brand, Inventory, Product, Rating, Size
+
+
+################
+#### config ####
+################
+
+SCORES = ('app_score', 'smoke_score', 'taste_score', 'overall_score')
+GROUPS = {
+    'product': Product,
+    'brand': Brand,
+    'size': Size,
+}
+PERCENTILES = (10, 25, 50, 75, 90)
+FETCH_SIZE = 10000
+# Products per statement when loading some; keeps under SQLite's bind
+# limit.
+BATCH = 500
+
+# A frame is reloaded when any of these counters has moved; `RATED`
+# stands in for the cigars, most of whose changes don't reach a rating.
+SOURCES = ('ratings', RATED, 'products')
+
+
+###############
+#### frame ####
+###############
+
+class RatingFrame(object):
+    """Every rating's scores as a float matrix, one column per score,
+    with the product, brand and size of the rated cigar alongside.
+
+    Missing scores are NaN and missing keys -1, so every aggregate below
+    is a handful of array operations however many ratings there are.
+    """
+
+    def __init__(self, scores, keys):
+        self.scores = scores
+        self.keys = keys
+        # The `SOURCES` versions it was loaded at, set by `frame`.
+        self.key = None
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.scores)
+
+    @classmethod
+    def load(cls, connection, products=None):
+        """Loads every rating on `connection`, or with `products` only
+        the ratings of cigars of those products."""
+        query = Query(
+            [getattr(Rating, name) for name in SCORES] +
+            [Inventory.product, Product.brand, Inventory.size]
+        ).outerjoin(Inventory, Inventory.id == Rating.cigar) \
+            .outerjoin(Product, Product.id == Inventory.product) \
+            .order_by(Rating.id)
+        if products is None:
+            queries = [query]
+        else:
+            products = sorted(set(products))
+            queries = [query.filter(Inventory.product.in_(
+                products[start:start + BATCH]))
+                for start in range(0, len(products), BATCH)]
+        chunks = []
+        for query in queries:
+            result = connection.execute(query.statement)
+            while True:
+                rows = result.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                # None becomes NaN in a float array. Plain tuples convert
+                # far faster than result rows.
+                chunks.append(np.array([tuple(row) for row in rows],
+                                       dtype=float))
+        if chunks:
+            data = np.concatenate(chunks)
+        else:
+            data = np.empty((0, len(SCORES) + len(GROUPS)))
+        keys = data[:, len(SCORES):]
+        keys = np.where(np.isnan(keys), -1, keys).astype(np.int64)
+        return cls(
+            data[:, :len(SCORES)],
+            dict(zip(('product', 'brand', 'size'), keys.T))
+        )
+
+    def memoize(self, key, compute):
+        with self._lock:
+            if key not in self._results:
+                self._results[key] = compute()
+            return self._results[key]
+
+    def column(self, score):
+        return self.scores[:, SCORES.index(score)]
+
+    def summary(self):
+        """Count, mean, spread and percentiles of each score."""
+        def compute():
+            summary = {}
+            for score in SCORES:
+                values = self.column(score)
+                values = values[~np.isnan(values)]
+                if not len(values):
+                    summary[score] = {'count': 0}
+                    continue
+                percentiles = np.percentile(values, PERCENTILES)
+                summary[score] = {
+                    'count': int(len(values)),
+                    'mean': float(values.mean()),
+                    'std': float(values.std()),
+                    'min': float(values.min()),
+                    'max': float(values.max()),
+                    'percentiles': dict(
+                        (str(p), float(v))
+                        for p, v in zip(PERCENTILES, percentiles)),
+                }
+            return summary
+        return self.memoize('summary', compute)
+
+    def distribution(self, score):
+        """How many ratings gave each whole-number value of `score`."""
+        def compute():
+            values = self.column(score)
+            values = values[~np.isnan(values)].astype(np.int64)
+            if not len(values):
+                return []
+            low = values.min()
+            counts = np.bincount(values - low)
+            return [{'score': int(low + i), 'count': int(n)}
+                    for i, n in enumerate(counts) if n]
+        return self.memoize(('distribution', score), compute)
+
+    def leaderboard(self, group, score='overall_score', min_ratings=1,
+                    limit=10):
+        """Mean `score` per product, brand or size, best first; ties go to
+        the group with more ratings."""
+        def compute():
+            keys = self.keys[group]
+            values = self.column(score)
+            valid = (keys >= 0) & ~np.isnan(values)
+            ids, inverse = np.unique(keys[valid], return_inverse=True)
+            counts = np.bincount(inverse)
+            means = np.bincount(inverse, weights=values[valid]) / counts
+            order = np.lexsort((ids, -counts, -means))
+            return ids[order], means[order], counts[order]
+        # The whole ranking is kept once per group and score; the filter
+        # and limit are applied per call, so they don't add entries.
+        ids, means, counts = self.memoize(('leaderboard', group, score),
+                                          compute)
+        kept = np.flatnonzero(counts >= min_ratings)[:max(limit, 0)]
+        return _with_names(group, [
+            (int(ids[i]), float(means[i]), int(counts[i])) for i in kept])
+
+
+def _with_names(group, rows):
+    model = GROUPS[group]
+    ids = [id for id, _, _ in rows]
+    names = dict(db.session.query(model.id, model.name)
+                 .filter(model.id.in_(ids)).all()) if ids else {}
+    return [{'id': id, 'name': names.get(id), 'mean': mean, 'count': count}
+            for id, mean, count in rows]
+
+
+###############
+#### cache ####
+###############
+
+_cache = {'key': None, 'frame': None}
+_cache_lock = threading.Lock()
+
+
+def frame():
+    """Returns the current `RatingFrame`, reloading it only when ratings
+    (or the cigars and products they join through) have changed."""
+    connection = db.session.connection()
+    versions = versioning.counters(connection, SOURCES)
+    key = tuple(versions[name] for name in SOURCES)
+    with _cache_lock:
+        if _cache['key'] != key:
+            _cache['frame'] = RatingFrame.load(connection)
+            _cache['frame'].key = key
+            _cache['key'] = key
+        return _cache['frame']
+
@@ -0,0 +1,426 @@
+# project/server/analytics/similar.py
+
+
+#################
+#### imports ####
+#################
+
+import numpy as np
+from sqlalchemy import func, select
+
+from project.server import db, versioning
+from project.server.analytics import ratings
+from project.server.cache import LRUCache
+from project.server.models import Brand, Product, ProductVector, \
+    SimilarPending, SimilarProduct
+
+
+################
+#### config ####
+################
+
+# Neighbours served per product, and kept so that a refresh can usually
+# patch a list instead of recomputing it.
+TOP_K = 10
+KEEP = 2 * TOP_K
+# Mean scores are scaled to 0-1; a score a product was never given sits
+# in the middle.
+SCORE_SCALE = 25.0
+MISSING_SCORE = 0.5
+# Weights of the one-hot brand and size in a feature vector.
+BRAND_WEIGHT = 0.2
+SIZE_WEIGHT = 0.1
+# Distances are rounded so that near ties rank by id however they were
+# computed.
+DIGITS = 9
+# Distances computed at once; 8MB of floats.
+BLOCK_CELLS = 1000000
+# When more than this share of products changed, every list is rebuilt.
+REBUILD_FRACTION = 0.25
+# Ids per statement; keeps under SQLite's bind limit.
+BATCH = 500
+
+vectors = ProductVector.__table__
+neighbours = SimilarProduct.__table__
+products = Product.__table__
+brands = Brand.__table__
+pending = SimilarPending.__table__
+
+# Lists by `(similar_products version, product)`; a refresh bumps the
+# version, so other processes' entries go stale with it.
+cache = LRUCache(maxsize=10000)
+
+
+##################
+#### features ####
+##################
+
+def _most_rated(products, sizes, count):
+    """The size each of `count` products was rated in most, the lowest id
+    on a tie; -1 for products never rated in a known size."""
+    most = np.full(count, -1, dtype=np.int64)
+    sized = sizes >= 0
+    if not sized.any():
+        return most
+    products, sizes = products[sized], sizes[sized]
+    pairs, counts = np.unique(products * (sizes.max() + 1) + sizes,
+                              return_counts=True)
+    owners, kinds = np.divmod(pairs, sizes.max() + 1)
+    order = np.lexsort((kinds, -counts, owners))
+    first = np.concatenate([[True], owners[order][1:] !=
+                            owners[order][:-1]])
+    most[owners[order][first]] = kinds[order][first]
+    return most
+
+
+class Features(object):
+    """The feature vector of every rated product, in id order.
+
+    A vector is the product's mean scores scaled to 0-1 followed by its
+    weighted one-hot brand and size. The one-hot parts are kept as ids and
+    compared, which gives the same distances without the wide matrix.
+    """
+
+    def __init__(self, ids, means, brands, sizes, counts):
+        self.ids = ids
+        # NaN for scores the product was never given.
+        self.means = means
+        self.brands = brands
+        self.sizes = sizes
+        self.counts = counts
+        self.scores = np.where(np.isnan(means), MISSING_SCORE,
+                               means / SCORE_SCALE)
+        self.norms = (self.scores ** 2).sum(axis=1) + \
+            BRAND_WEIGHT ** 2 * (brands >= 0) + \
+            SIZE_WEIGHT ** 2 * (sizes >= 0)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_frame(cls, frame):
+        keys = frame.keys['product']
+        rated = keys >= 0
+        ids, inverse = np.unique(keys[rated], return_inverse=True)
+        count = len(ids)
+        scores = frame.scores[rated]
+        means = np.empty((count, len(ratings.SCORES)))
+        for column in range(len(ratings.SCORES)):
+            values = scores[:, column]
+            valid = ~np.isnan(values)
+            totals = np.bincount(inverse[valid], weights=values[valid],
+                                 minlength=count)
+            given = np.bincount(inverse[valid], minlength=count)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means[:, column] = totals / given
+        # Every rating of a product carries the product's brand.
+        brands = np.full(count, -1, dtype=np.int64)
+        brands[inverse] = frame.keys['brand'][rated]
+        sizes = _most_rated(inverse, frame.keys['size'][rated], count)
+        return cls(ids, means, brands, sizes,
+                   np.bincount(inverse, minlength=count))
+
+    def distances(self, rows, columns):
+        """The distances between the vectors at positions `rows` and those
+        at `columns`, as a matrix."""
+        # In place, so a block allocates one matrix of floats.
+        squared = self.scores[rows].dot(self.scores[columns].T)
+        squared *= -2
+        squared += self.norms[rows, None]
+        squared += self.norms[None, columns]
+        for keys, weight in ((self.brands, BRAND_WEIGHT),
+                             (self.sizes, SIZE_WEIGHT)):
+            same = keys[rows, None] == keys[None, columns]
+            same &= keys[rows, None] >= 0
+            squared -= 2 * weight ** 2 * same
+        np.maximum(squared, 0, out=squared)
+        np.sqrt(squared, out=squared)
+        return np.round(squared, DIGITS, out=squared)
+
+
+def _blocks(features, rows):
+    """Yields `(rows, distances)` for blocks of `rows` against every
+    product, each row's distance to itself infinite."""
+    columns = np.arange(len(features))
+    size = max(1, BLOCK_CELLS // max(len(features), 1))
+    for start in range(0, len(rows), size):
+        part = rows[start:start + size]
+        distances = features.distances(part, columns)
+        distances[np.arange(len(part)), part] = np.inf
+        yield part, distances
+
+
+def _nearest(part, distances):
+    """Yields `(row, positions, distances)` of the `KEEP` nearest of each
+    row of a block, nearest first and ties to the lower id."""
+    keep = min(KEEP, distances.shape[1] - 1)
+    if keep > 0:
+        bounds = np.partition(distances, keep - 1, axis=1)[:, keep - 1]
+    for n, row in enumerate(part):
+        if keep <= 0:
+            yield row, np.empty(0, dtype=np.int64), np.empty(0)
+            continue
+        near = np.flatnonzero(distances[n] <= bounds[n])
+        near = near[np.lexsort((near, distances[n][near]))][:keep]
+        yield row, near, distances[n][near]
+
+
+#################
+#### refresh ####
+#################
+
+def _stored(connection):
+    rows = connection.execute(
+        select([vectors.c.product, vectors.c.brand, vectors.c.size] +
+               [vectors.c[name] for name in ratings.SCORES] +
+               [vectors.c.ratings, vectors.c.farthest])
+        .order_by(vectors.c.product)).fetchall()
+    # None becomes NaN in a float array.
+    data = np.array([tuple(row) for row in rows], dtype=float).reshape(
+        len(rows), len(ratings.SCORES) + 5)
+    keys = np.where(np.isnan(data[:, :3]), -1, data[:, :3]) \
+        .astype(np.int64)
+    stored = Features(keys[:, 0], data[:, 3:-2], keys[:, 1], keys[:, 2],
+                      data[:, -2].astype(np.int64))
+    stored.farthest = np.where(np.isnan(data[:, -1]), np.inf, data[:, -1])
+    return stored
+
+
+def _diff(features, stored):
+    """The positions in `features` of new or changed products, and the
+    ids of stored products no longer rated."""
+    if not len(stored):
+        return np.arange(len(features)), stored.ids
+    at = np.minimum(np.searchsorted(stored.ids, features.ids),
+                    len(stored) - 1)
+    same = (stored.ids[at] == features.ids) & \
+        (stored.brands[at] == features.brands) & \
+        (stored.sizes[at] == features.sizes) & \
+        (stored.counts[at] == features.counts) & \
+        np.isclose(stored.means[at], features.means,
+                   equal_nan=True).all(axis=1)
+    removed = stored.ids[~np.in1d(stored.ids, features.ids)]
+    return np.flatnonzero(~same), removed
+
+
+def _chunks(ids):
+    ids = sorted(int(id) for id in ids)
+    for start in range(0, len(ids), BATCH):
+        yield ids[start:start + BATCH]
+
+
+def _patch(connection, features, stored, changed, removed):
+    """The new lists of the changed products and of those whose lists
+    they join or leave, as `{row: (positions, distances)}`.
+
+    An unchanged product's stored list, less the changed and removed
+    products, holds its nearest unchanged products up to its farthest;
+    adding the changed products that come within that distance gives its
+    new list whenever that leaves at least `KEEP`. Other lists are
+    recomputed.
+    """
+    gone = set(features.ids[changed].tolist()) | set(removed.tolist())
+    at = np.searchsorted(stored.ids, features.ids)
+    # Stored farthest of each unchanged product; changed ones never count.
+    farthest = np.full(len(features), -np.inf)
+    unchanged = np.ones(len(features), dtype=bool)
+    unchanged[changed] = False
+    farthest[unchanged] = stored.farthest[at[unchanged]]
+
+    lists = {}
+    joined = np.zeros(len(features), dtype=bool)
+    for part, distances in _blocks(features, changed):
+        for row, near, distance in _nearest(part, distances):
+            lists[row] = (near, distance)
+        joined |= (distances <= farthest[None, :]).any(axis=0)
+    affected = set(np.flatnonzero(joined).tolist())
+    for batch in _chunks(gone):
+        for product, in connection.execute(
+                select([neighbours.c.product]).distinct()
+                .where(neighbours.c.similar.in_(batch))):
+            position = int(np.searchsorted(features.ids, product))
+            if position < len(features) and \
+                    features.ids[position] == product and \
+                    unchanged[position]:
+                affected.add(position)
+    affected = np.array(sorted(affected), dtype=np.int64)
+
+    old = {}
+    for batch in _chunks(features.ids[affected]):
+        for product, similar, distance in connection.execute(
+                select([neighbours.c.product, neighbours.c.similar,
+                        neighbours.c.distance])
+                .where(neighbours.c.product.in_(batch))
+                .order_by(neighbours.c.product, neighbours.c.rank)):
+            if similar not in gone:
+                old.setdefault(product, []).append((distance, similar))
+    keep = min(KEEP, len(features) - 1)
+    redo = []
+    size = max(1, BLOCK_CELLS // max(len(changed), 1))
+    for start in range(0, len(affected), size):
+        part = affected[start:start + size]
+        distances = features.distances(part, changed)
+        for n, row in enumerate(part):
+            bound = farthest[row]
+            merged = old.get(int(features.ids[row]), []) + [
+                (distance, int(features.ids[column]))
+                for distance, column in zip(distances[n], changed)
+                if distance <= bound]
+            if len(merged) < keep:
+                redo.append(row)
+                continue
+            merged.sort()
+            merged = merged[:keep]
+            lists[row] = (
+                np.searchsorted(features.ids, [id for _, id in merged]),
+                np.array([distance for distance, _ in merged]))
+    for part, distances in _blocks(features, np.array(redo, dtype=np.int64)):
+        for row, near, distance in _nearest(part, distances):
+            lists[row] = (near, distance)
+    return lists
+
+
+def _write(connection, features, lists):
+    rows = sorted(lists)
+    for start in range(0, len(rows), BATCH):
+        part = rows[start:start + BATCH]
+        found, described = [], []
+        for row in part:
+            near, distances = lists[row]
+            product = int(features.ids[row])
+            found.extend({'product': product, 'rank': rank,
+                          'similar': int(features.ids[column]),
+                          'distance': float(distance)}
+                         for rank, (column, distance) in
+                         enumerate(zip(near, distances)))
+            means = features.means[row]
+            described.append(dict(
+                [('product', product),
+                 ('brand', _key(features.brands[row])),
+                 ('size', _key(features.sizes[row])),
+                 ('ratings', int(features.counts[row])),
+                 ('farthest', float(distances[-1])
+                  if len(distances) == KEEP else None)] +
+                [(name, None if np.isnan(mean) else float(mean))
+                 for name, mean in zip(ratings.SCORES, means)]))
+        if found:
+            connection.execute(neighbours.insert(), found)
+        connection.execute(vectors.insert(), described)
+
+
+def _key(value):
+    return None if value < 0 else int(value)
+
+
+def _queued(connection):
+    """The last queued id, the products queued up to it, and whether
+    every product was."""
+    last = connection.execute(select([func.max(pending.c.id)])).scalar()
+    if last is None:
+        return None, set(), False
+    products = set(product for product, in connection.execute(
+        select([pending.c.product]).distinct()
+        .where(pending.c.id <= last)))
+    return last, products - set([None]), None in products
+
+
+def _merge(stored, fresh, products):
+    """`stored` with the vectors of `products` replaced by `fresh`."""
+    kept = ~np.in1d(stored.ids, sorted(products))
+    ids = np.concatenate([stored.ids[kept], fresh.ids])
+    order = np.argsort(ids, kind='mergesort')
+
+    def merged(old, new):
+        return np.concatenate([old[kept], new])[order]
+    return Features(ids[order], merged(stored.means, fresh.means),
+                    merged(stored.brands, fresh.brands),
+                    merged(stored.sizes, fresh.sizes),
+                    merged(stored.counts, fresh.counts))
+
+
+def refresh(connection, full=False):
+    """Brings the stored neighbour lists up to date with the products
+    queued in `similar_pending`, and dequeues them. Returns the number of
+    lists written.
+
+    Only the queued products' ratings are read; the other vectors are the
+    stored ones. Only the lists a change can reach are rewritten, from
+    distances between the changed products and the rest. With `full`,
+    after a bulk load, or when more than `REBUILD_FRACTION` of products
+    changed, every list is, in blocks of `BLOCK_CELLS` distances.
+
+    Runs in the import worker and `manage.py recommend`, never in a
+    request.
+    """
+    if not full and _queued(connection)[0] is None:
+        return 0
+    # Taking the counter's row lock first runs refreshes one at a time,
+    # and the queue is read again behind it; the bump also retires
+    # cached lists.
+    versioning.bump(connection, neighbours.name)
+    last, products, everything = _queued(connection)
+    stored = _stored(connection)
+    if full or everything or not len(stored):
+        features = Features.from_frame(ratings.RatingFrame.load(connection))
+    else:
+        fresh = Features.from_frame(
+            ratings.RatingFrame.load(connection, products))
+        features = _merge(stored, fresh, products)
+    changed, removed = _diff(features, stored)
+    if full or everything or not len(stored) or \
+            len(changed) + len(removed) > REBUILD_FRACTION * len(features):
+        connection.execute(neighbours.delete())
+        connection.execute(vectors.delete())
+        lists = dict(
+            (row, (near, distance))
+            for part, distances in _blocks(features,
+                                           np.arange(len(features)))
+            for row, near, distance in _nearest(part, distances))
+    else:
+        lists = _patch(connection, features, stored, changed, removed)
+        rewritten = set(features.ids[sorted(lists)].tolist()) | \
+            set(removed.tolist())
+        for batch in _chunks(rewritten):
+            connection.execute(neighbours.delete()
+                               .where(neighbours.c.product.in_(batch)))
+            connection.execute(vectors.delete()
+                               .where(vectors.c.product.in_(batch)))
+    _write(connection, features, lists)
+    if last is not None:
+        connection.execute(pending.delete().where(pending.c.id <= last))
+    return len(lists)
+
+
+##############
+#### read ####
+##############
+
+def _read(product):
+    rows = db.session.execute(
+        select([neighbours.c.similar, neighbours.c.distance, products.c.name,
+                brands.c.id, brands.c.name])
+        .select_from(neighbours
+                     .join(products, products.c.id == neighbours.c.similar)
+                     .outerjoin(brands, brands.c.id == products.c.brand))
+        .where(neighbours.c.product == product)
+        .where(neighbours.c.rank < TOP_K)
+        .order_by(neighbours.c.rank)).fetchall()
+    return [{'id': similar, 'name': name, 'distance': distance,
+             'brand': {'id': brand, 'name': brand_name}
+             if brand is not None else None}
+            for similar, distance, name, brand, brand_name in rows]
+
+
+def similar_to(product, limit=TOP_K):
+    """The rated products most like `product`, nearest first, each with
+    its brand and distance; empty for products never rated.
+
+    Reads the lists' version and one stored list, or only the version
+    when the list is cached. Never refreshes; see `refresh`.
+    """
+    key = (versioning.current(neighbours.name), product)
+    found = cache.get(key)
+    if found is None:
+        found = _read(product)
+        cache.set(key, found)
+    return found[:limit]
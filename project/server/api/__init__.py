@@ -0,0 +1 @@
+# project/server/api/__init__.py
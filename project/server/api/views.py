@@ -0,0 +1,226 @@
+# project/server/api/views.py
+
+
+#################
+#### imports ####
+#################
+
+import base64
+import datetime
+import decimal
+import hashlib
+import json
+
+from flask import Blueprint, Response, jsonify, request, \
+    stream_with_context
+
+from project.server import db, versioning
+from project.server.analytics import changes  # noqa: registers its listeners
+from project.server.models import Brand, Inventory, Location, Product, \
+    Rating, Size
+
+
+################
+#### config ####
+################
+
+api_blueprint = Blueprint('api', __name__, url_prefix='/api')
+
+RESOURCES = {
+    'inventory': Inventory,
+    'products': Product,
+    'brands': Brand,
+    'sizes': Size,
+    'locations': Location,
+    'ratings': Rating,
+}
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+YIELD_PER = 200
+
+
+#################
+#### helpers ####
+#################
+
+class BadRequest(Exception):
+    pass
+
+
+def _default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    raise TypeError(repr(value))
+
+
+def dumps(value):
+    return json.dumps(value, default=_default, separators=(',', ':'))
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(str(key).encode('ascii')) \
+        .decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (TypeError, ValueError):
+        raise BadRequest('Invalid cursor.')
+
+
+def selected_columns(model):
+    """The columns named by `fields=`, or all of them."""
+    columns = versioning.columns(model.__table__)
+    fields = request.args.get('fields')
+    if not fields:
+        return columns
+    columns = dict((column.name, column) for column in columns)
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in columns]
+    if unknown:
+        raise BadRequest('Unknown fields: {}.'.format(', '.join(unknown)))
+    return [columns[name] for name in names]
+
+
+def etag_for(resource, *parts):
+    """A strong ETag derived from the table's change counter, so it can be
+    checked before any row is read."""
+    version = versioning.current(RESOURCES[resource].__table__.name)
+    digest = hashlib.sha1(dumps([resource, request.path] + list(parts))
+                          .encode('utf-8')).hexdigest()[:16]
+    return '{}-{}'.format(version, digest)
+
+
+def not_modified(etag):
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def error(message, status=400):
+    return jsonify(error=message), status
+
+
+################
+#### routes ####
+################
+
+@api_blueprint.errorhandler(BadRequest)
+def bad_request(exception):
+    return error(str(exception))
+
+
+# The analytics import NumPy, so they load on first use rather than with
+# the app.
+
+@api_blueprint.route('/ratings/summary')
+def ratings_summary():
+    from project.server.analytics import ratings
+    frame = ratings.frame()
+    return jsonify(ratings=len(frame), scores=frame.summary())
+
+
+@api_blueprint.route('/ratings/distribution/<score>')
+def ratings_distribution(score):
+    from project.server.analytics import ratings
+    if score not in ratings.SCORES:
+        return error('Unknown score.', 404)
+    return jsonify(score=score, counts=ratings.frame().distribution(score))
+
+
+@api_blueprint.route('/ratings/leaderboard/<group>')
+def ratings_leaderboard(group):
+    from project.server.analytics import ratings
+    score = request.args.get('score', 'overall_score')
+    if group not in ratings.GROUPS or score not in ratings.SCORES:
+        return error('Unknown group or score.', 404)
+    rows = ratings.frame().leaderboard(
+        group, score,
+        min_ratings=max(request.args.get('min', 1, type=int), 1),
+        limit=max(1, min(request.args.get('limit', 10, type=int),
+                         MAX_LIMIT)))
+    return jsonify(group=group, score=score, rows=rows)
+
+
+@api_blueprint.route('/products/<int:product>/similar')
+def similar_products(product):
+    from project.server.analytics import similar
+    limit = max(1, min(request.args.get('limit', similar.TOP_K, type=int),
+                       similar.TOP_K))
+    return jsonify(product=product,
+                   similar=similar.similar_to(product, limit))
+
+
+@api_blueprint.route('/<resource>')
+def list_resource(resource):
+    model = RESOURCES.get(resource)
+    if model is None:
+        return error('Unknown resource.', 404)
+    table = model.__table__
+    columns = selected_columns(model)
+    limit = max(1, min(request.args.get('limit', DEFAULT_LIMIT, type=int),
+                       MAX_LIMIT))
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+
+    etag = etag_for(resource, [c.name for c in columns], limit, after)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    names = [column.name for column in columns]
+    query = db.session.query(table.c.id, *columns).order_by(table.c.id)
+    if after is not None:
+        query = query.filter(table.c.id > after)
+    # One extra row tells us whether there is a next page.
+    query = query.limit(limit + 1).yield_per(YIELD_PER)
+
+    def generate():
+        yield '{"data":['
+        last, sent, more = None, 0, False
+        for row in query:
+            if sent == limit:
+                more = True
+                break
+            yield (',' if sent else '') + dumps(dict(zip(names, row[1:])))
+            last, sent = row[0], sent + 1
+        yield '],"next":{}}}'.format(dumps(encode_cursor(last))
+                                     if more else 'null')
+
+    response = Response(stream_with_context(generate()),
+                        mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@api_blueprint.route('/<resource>/<int:id>')
+def get_resource(resource, id):
+    model = RESOURCES.get(resource)
+    if model is None:
+        return error('Unknown resource.', 404)
+    table = model.__table__
+    columns = selected_columns(model)
+
+    etag = etag_for(resource, [c.name for c in columns], id)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    row = db.session.query(*columns).filter(table.c.id == id).first()
+    if row is None:
+        return error('Not found.', 404)
+    response = Response(dumps(dict(zip([c.name for c in columns], row))),
+                        mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
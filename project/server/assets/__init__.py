@@ -0,0 +1 @@
+# project/server/assets/__init__.py
@@ -0,0 +1,102 @@
+# project/server/assets/build.py
+
+
+#################
+#### imports ####
+#################
+
+import gzip
+import hashlib
+import json
+import os
+import time
+
+
+################
+#### config ####
+################
+
+MANIFEST = 'manifest.json'
+DIGEST_LENGTH = 12
+
+# Seconds between checks for a newer build by another process.
+CHECK_INTERVAL = 1.0
+
+# `(checked at, file version, manifest)` by directory; `build` refreshes
+# its own.
+_manifests = {}
+
+
+###############
+#### build ####
+###############
+
+def fingerprint(name, data):
+    """`main.css` becomes `main.<first hex digits of its sha256>.css`."""
+    root, extension = os.path.splitext(name)
+    digest = hashlib.sha256(data).hexdigest()[:DIGEST_LENGTH]
+    return '{}.{}{}'.format(root, digest, extension)
+
+
+def build(source, destination, names):
+    """Copies each of `names` from `source` into `destination` under its
+    fingerprinted name, with a gzip variant alongside, and writes the
+    manifest mapping one to the other. Returns the manifest.
+
+    Earlier builds are left in place, so pages cached before a deploy
+    still find their files.
+    """
+    if not os.path.isdir(destination):
+        os.makedirs(destination)
+    manifest = {}
+    for name in names:
+        with open(os.path.join(source, name), 'rb') as infile:
+            data = infile.read()
+        built = fingerprint(name, data)
+        path = os.path.join(destination, built)
+        with open(path, 'wb') as outfile:
+            outfile.write(data)
+        # mtime=0 keeps the .gz byte-identical between builds.
+        with open(path + '.gz', 'wb') as raw, \
+                gzip.GzipFile(built, 'wb', 9, raw, mtime=0) as outfile:
+            outfile.write(data)
+        manifest[name] = built
+    temporary = os.path.join(destination, MANIFEST + '.tmp')
+    with open(temporary, 'w') as outfile:
+        json.dump(manifest, outfile, indent=2, sort_keys=True)
+    path = os.path.join(destination, MANIFEST)
+    os.replace(temporary, path)
+    _manifests[destination] = (time.time(), _version(path), manifest)
+    return manifest
+
+
+def _version(path):
+    # A build replaces the file, so its inode changes even when the
+    # mtime doesn't.
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime, stat.st_size
+
+
+def manifest(destination):
+    """The manifest in `destination`; empty before a build. Re-read once
+    another process has built, checked at most every `CHECK_INTERVAL`
+    seconds."""
+    now = time.time()
+    checked, version, found = _manifests.get(destination, (0, None, {}))
+    if now - checked < CHECK_INTERVAL:
+        return found
+    path = os.path.join(destination, MANIFEST)
+    current = _version(path)
+    if current is None:
+        found = {}
+    elif current != version:
+        try:
+            with open(path) as infile:
+                found = json.load(infile)
+        except (OSError, ValueError):
+            current, found = None, {}
+    _manifests[destination] = (now, current, found)
+    return found
@@ -0,0 +1,60 @@
+# project/server/assets/views.py
+
+
+#################
+#### imports ####
+#################
+
+import mimetypes
+import os
+
+from flask import Blueprint, current_app, request, send_from_directory, \
+    url_for
+from werkzeug.security import safe_join
+
+from project.server.assets.build import manifest
+
+
+################
+#### config ####
+################
+
+assets_blueprint = Blueprint('assets', __name__,)
+
+
+#################
+#### helpers ####
+#################
+
+@assets_blueprint.app_template_global()
+def asset_url(name):
+    """URL of the fingerprinted build of static file `name`, or of the
+    file itself if it hasn't been built."""
+    built = manifest(current_app.config['ASSETS_DIST']).get(name)
+    if built is None:
+        return url_for('static', filename=name)
+    return url_for('assets.asset', filename=built)
+
+
+################
+#### routes ####
+################
+
+@assets_blueprint.route('/assets/<path:filename>')
+def asset(filename):
+    directory = current_app.config['ASSETS_DIST']
+    max_age = current_app.config['ASSETS_MAX_AGE']
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    compressed = safe_join(directory, filename + '.gz')
+    gzipped = 'gzip' in request.accept_encodings and \
+        compressed is not None and os.path.isfile(compressed)
+    response = send_from_directory(
+        directory, filename + '.gz' if gzipped else filename,
+        mimetype=mimetype, cache_timeout=max_age, conditional=True)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    # The name changes with the content, so it never needs revalidating.
+    response.headers['Cache-Control'] = \
+        'public, max-age={}, immutable'.format(max_age)
+    return response
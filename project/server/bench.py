@@ -0,0 +1,538 @@
+# project/server/bench.py
+
+
+#################
+#### imports ####
+#################
+
+import contextlib
+import csv
+import datetime
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import bcrypt
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from project.server import db, user_cache
+from project.server.analytics import similar
+from project.server.data.dumper import dump_database
+from project.server.data.loader import load_directory
+from project.server.instrumentation import measure_overhead
+from project.server.inventory import lookup, rollups, valuation
+from project.server.models import Rating
+from project.server.search import notes
+from project.server.sync import snapshot
+
+
+################
+#### config ####
+################
+
+SIZES = (10000, 100000, 1000000)
+SAMPLES = 200
+PERCENTILES = (50, 95, 99)
+# A p95 this much slower than the baseline's is a regression.
+TOLERANCE = 0.25
+
+LOCATIONS = ('Smoked', 'Tupperdor', 'Humidor', 'Travel case', 'Gifted')
+# Words rating notes are made of, and the queries timed against them.
+NOTE_WORDS = ('pepper', 'peppery', 'cedar', 'leather', 'earth', 'earthy',
+              'cocoa', 'coffee', 'cream', 'nutty', 'sweet', 'spice', 'hay',
+              'toast', 'tight', 'draw', 'burn', 'even', 'ash', 'wrapper',
+              'oily', 'smooth', 'harsh', 'finish', 'long', 'short', 'with',
+              'and', 'some', 'a', 'bit', 'of', 'the', 'on')
+NOTE_QUERIES = ('pepper', 'cedar leather', 'earthy cocoa finish')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+STARTUP_SAMPLES = 5
+# Each runs in a fresh interpreter, the way a worker or CLI call starts.
+STARTUP_COMMANDS = {
+    'startup.import': ['-c', 'import project.server'],
+    'startup.create_app': [
+        '-c', 'from project.server import create_app; create_app()'],
+    'startup.cli': ['manage.py', '--help'],
+}
+
+# Tables that referenced cigars by their hex hash before `cigars.id`.
+HASH_TABLES = ('ratings', 'transfers', 'session_inventory')
+HEX = {
+    'sqlite': 'lower(hex({}))',
+    'postgresql': "encode({}, 'hex')",
+}
+INDEX_BYTES = {
+    'sqlite': 'SELECT sum(pgsize) FROM dbstat WHERE name = :name',
+    'postgresql': 'SELECT pg_relation_size(CAST(:name AS regclass))',
+}
+JOIN = ('SELECT c.location, count(*) FROM {cigars} c '
+        'JOIN {transfers} t ON t.{reference} = c.{key} GROUP BY c.location')
+
+
+###################
+#### synthetic ####
+###################
+
+def cigar_hash(n):
+    return hashlib.sha1(str(n).encode('ascii')).hexdigest()
+
+
+def _write(directory, table, header, rows):
+    with open(os.path.join(directory, table + '.csv'), 'w',
+              newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def generate(directory, size, seed=0):
+    """Writes a synthetic collection of `size` cigars to `directory` as
+    CSV fixtures, with ratings, transfers and sessions in proportion.
+
+    The same `size` and `seed` always give the same files.
+    """
+    rng = random.Random(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    brands = max(20, size // 200)
+    products = max(50, size // 20)
+    sizes = 20
+    users = 100
+    ratings = size // 5
+    sessions = max(1, ratings // 2)
+    transfers = size // 2
+    start = datetime.datetime(2015, 1, 1)
+
+    def when(n, total):
+        return start + datetime.timedelta(days=600.0 * n / max(total, 1))
+
+    _write(directory, 'brands', ('id', 'name'),
+           ((n, 'Brand {}'.format(n)) for n in range(1, brands + 1)))
+    _write(directory, 'products', ('id', 'name', 'brand'),
+           ((n, 'Product {}'.format(n), rng.randint(1, brands))
+            for n in range(1, products + 1)))
+    _write(directory, 'sizes', ('id', 'name'),
+           ((n, 'Size {}'.format(n)) for n in range(1, sizes + 1)))
+    _write(directory, 'locations', ('id', 'name'),
+           enumerate(LOCATIONS, 1))
+    password = bcrypt.hashpw(b'bench', bcrypt.gensalt(4)).decode('utf-8')
+    _write(directory, 'users',
+           ('id', 'email', 'password', 'registered_on', 'admin'),
+           ((n, 'user{}@example.com'.format(n), password,
+             start.isoformat(' '), 'false') for n in range(1, users + 1)))
+    _write(directory, 'cigars',
+           ('id', 'hash', 'product', 'size', 'purchase_date',
+            'purchase_price', 'location'),
+           ((n, cigar_hash(n), rng.randint(1, products),
+             rng.randint(1, sizes), when(n, size).isoformat(' '),
+             '{:.2f}'.format(rng.randint(300, 2500) / 100.0),
+             rng.randint(1, len(LOCATIONS)))
+            for n in range(1, size + 1)))
+    _write(directory, 'transfers', ('id', 'cigar', 'from', 'to', 'moved_on'),
+           ((n, rng.randint(1, size),
+             rng.randint(1, len(LOCATIONS)), rng.randint(1, len(LOCATIONS)),
+             when(n, transfers).isoformat(' '))
+            for n in range(1, transfers + 1)))
+    _write(directory, 'sessions', ('id', 'date'),
+           ((n, when(n, sessions).isoformat(' '))
+            for n in range(1, sessions + 1)))
+    rated = [(n, rng.randint(1, size), rng.randint(1, sessions))
+             for n in range(1, ratings + 1)]
+    _write(directory, 'session_inventory', ('id', 'session', 'cigar'),
+           ((n, session, cigar) for n, cigar, session in rated))
+
+    def note():
+        return ' '.join(rng.choice(NOTE_WORDS)
+                        for _ in range(rng.randint(4, 12))).capitalize()
+
+    _write(directory, 'ratings',
+           ('id', 'cigar', 'session', 'app_score', 'smoke_score',
+            'taste_score', 'overall_score', 'taste_notes', 'overall_notes'),
+           ((n, cigar, session) + tuple(rng.randint(5, 25) for _ in range(4)) +
+            (note(), note())
+            for n, cigar, session in rated))
+    return {'cigars': size, 'users': users}
+
+
+################
+#### timing ####
+################
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    rank = max(1, int(math.ceil(p / 100.0 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def summarize(samples, rows=None):
+    ordered = sorted(samples)
+    summary = {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+    }
+    for p in PERCENTILES:
+        summary['p{}'.format(p)] = percentile(ordered, p)
+    if rows is not None:
+        summary['rows'] = rows
+        summary['rows_per_second'] = rows / sum(ordered) if sum(ordered) \
+            else None
+    return summary
+
+
+def measure(function, arguments, before=None, warm=False):
+    """Times `function` once per item of `arguments`; with `warm`, only
+    after a first untimed pass over them."""
+    if warm:
+        for argument in arguments:
+            function(argument)
+    samples = []
+    for argument in arguments:
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        function(argument)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+##################
+#### database ####
+##################
+
+@contextlib.contextmanager
+def use_database(url):
+    """Points the app's session and engine at `url` for the duration.
+
+    Process-wide caches are emptied on the way in and out so no result
+    leaks between databases.
+    """
+    config = current_app.config
+    if url == config['SQLALCHEMY_DATABASE_URI']:
+        raise ValueError('Refusing to benchmark the configured database.')
+    previous = config['SQLALCHEMY_DATABASE_URI']
+
+    def reset():
+        db.session.remove()
+        lookup.cache.clear()
+        user_cache.clear()
+
+    reset()
+    config['SQLALCHEMY_DATABASE_URI'] = url
+    engine = None
+    try:
+        engine = db.engine
+        yield engine
+    finally:
+        db.session.remove()
+        if engine is not None:
+            engine.dispose()
+        config['SQLALCHEMY_DATABASE_URI'] = previous
+        reset()
+
+
+def _mask(url):
+    # Keep passwords out of the report.
+    head, at, tail = url.rpartition('@')
+    if not at:
+        return url
+    scheme, _, credentials = head.partition('://')
+    return '{}://{}:***@{}'.format(scheme, credentials.split(':')[0], tail)
+
+
+#################
+#### storage ####
+#################
+
+def _legacy_tables(connection):
+    """Copies the loaded hashes into the old layout: hex text in `cigars`
+    and in every table that references a cigar."""
+    connection.execute('CREATE TABLE legacy_cigars (id INTEGER PRIMARY KEY, '
+                       'hash VARCHAR(64), location INTEGER)')
+    connection.execute('INSERT INTO legacy_cigars SELECT id, {}, location '
+                       'FROM cigars'.format(
+                           HEX[connection.dialect.name].format('hash')))
+    connection.execute('CREATE UNIQUE INDEX ix_legacy_cigars_hash '
+                       'ON legacy_cigars (hash)')
+    for name in HASH_TABLES:
+        connection.execute('CREATE TABLE legacy_{} '
+                           '(id INTEGER PRIMARY KEY, hash VARCHAR(64))'
+                           .format(name))
+        connection.execute('INSERT INTO legacy_{0} SELECT t.id, c.hash '
+                           'FROM {0} t JOIN legacy_cigars c '
+                           'ON c.id = t.cigar'.format(name))
+        connection.execute('CREATE INDEX ix_legacy_{0}_hash '
+                           'ON legacy_{0} (hash)'.format(name))
+
+
+def storage(engine, samples=SAMPLES):
+    """Compares the indexes and a join on the binary hash and integer
+    keys with the hex text layout they replaced.
+
+    Returns `(sizes, results)`: the bytes of each index that identifies a
+    cigar, per layout, and the join timings.
+    """
+    if engine.dialect.name not in HEX:
+        return {}, {}
+    query = INDEX_BYTES[engine.dialect.name]
+    with engine.begin() as connection:
+        _legacy_tables(connection)
+    try:
+        indexes = {
+            'text': ['ix_legacy_cigars_hash'] + [
+                'ix_legacy_{}_hash'.format(name) for name in HASH_TABLES],
+            'binary': ['ix_cigars_hash'] + [
+                'ix_{}_cigar'.format(name) for name in HASH_TABLES],
+        }
+        sizes = {}
+        with engine.connect() as connection:
+            for layout, names in sorted(indexes.items()):
+                sizes[layout] = dict(
+                    (name, connection.scalar(text(query), name=name))
+                    for name in names)
+        joins = {
+            'join.hash_text': JOIN.format(
+                cigars='legacy_cigars', transfers='legacy_transfers',
+                reference='hash', key='hash'),
+            'join.cigar_id': JOIN.format(
+                cigars='cigars', transfers='transfers',
+                reference='cigar', key='id'),
+        }
+        results = {}
+        with engine.connect() as connection:
+            for name, statement in sorted(joins.items()):
+                results[name] = summarize(measure(
+                    lambda _: connection.execute(statement).fetchall(),
+                    range(max(1, samples // 20)), warm=True))
+    finally:
+        with engine.begin() as connection:
+            for name in ('cigars',) + HASH_TABLES:
+                connection.execute('DROP TABLE legacy_{}'.format(name))
+    return sizes, results
+
+
+####################
+#### benchmarks ####
+####################
+
+def run(url, size, samples=SAMPLES, seed=0, workdir=None):
+    """Loads a synthetic collection of `size` cigars into `url` and times
+    the hot paths against it. Returns one run of the report."""
+    workdir = workdir or tempfile.mkdtemp(prefix='cigardb-bench-')
+    fixtures = os.path.join(workdir, 'fixtures-{}'.format(size))
+    dumps = os.path.join(workdir, 'dump-{}'.format(size))
+    if not os.path.isdir(fixtures):
+        generate(fixtures, size, seed)
+    rng = random.Random(seed)
+    results = {}
+
+    with use_database(url) as engine:
+        db.drop_all()
+        db.create_all()
+
+        started = time.perf_counter()
+        loaded, _ = load_directory(fixtures, engine=engine, replace=True)
+        results['load_data'] = summarize(
+            [time.perf_counter() - started],
+            rows=sum(result.rows for result in loaded))
+
+        shutil.rmtree(dumps, ignore_errors=True)
+        started = time.perf_counter()
+        dumped = dump_database(dumps, engine=engine)
+        results['dump_data'] = summarize(
+            [time.perf_counter() - started],
+            rows=sum(result.rows for result in dumped))
+
+        user_ids = [rng.randint(1, 100) for _ in range(samples)]
+        results['load_user.cold'] = summarize(
+            measure(user_cache.get, user_ids, before=user_cache.clear))
+        results['load_user.warm'] = summarize(
+            measure(user_cache.get, user_ids, warm=True))
+
+        hashes = [cigar_hash(rng.randint(1, size)) for _ in range(samples)]
+        results['lookup.cold'] = summarize(
+            measure(lookup.find_cigar, hashes, before=lookup.cache.clear))
+        results['lookup.warm'] = summarize(
+            measure(lookup.find_cigar, hashes, warm=True))
+
+        sizes, joins = storage(engine, samples)
+        results.update(joins)
+
+        for dimension in sorted(rollups.DIMENSIONS):
+            results['rollups.' + dimension] = summarize(
+                measure(rollups.counts, [dimension] * samples))
+
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            valuation.rebuild(connection)
+        results['valuation.rebuild'] = summarize(
+            [time.perf_counter() - started])
+        for name in valuation.MEASURES:
+            for dimension in sorted(valuation.DIMENSIONS):
+                results['valuation.{}.{}'.format(name, dimension)] = \
+                    summarize(measure(
+                        lambda period: valuation.series(
+                            name, dimension, period,
+                            datetime.date(2015, 1, 1),
+                            datetime.date(2016, 12, 31)),
+                        ['year'] * samples))
+
+        started = time.perf_counter()
+        similar.refresh(db.session.connection(), full=True)
+        db.session.commit()
+        results['similar.rebuild'] = summarize(
+            [time.perf_counter() - started])
+        # A handful of new ratings, as between two refreshes by the
+        # worker.
+        db.session.add_all([Rating(cigar=rng.randint(1, size),
+                                   overall_score=25) for _ in range(5)])
+        db.session.commit()
+        started = time.perf_counter()
+        similar.refresh(db.session.connection())
+        db.session.commit()
+        results['similar.refresh'] = summarize(
+            [time.perf_counter() - started])
+        product_ids = [rng.randint(1, max(50, size // 20))
+                       for _ in range(samples)]
+        results['similar.lookup.cold'] = summarize(measure(
+            similar.similar_to, product_ids, before=similar.cache.clear))
+        results['similar.lookup.warm'] = summarize(measure(
+            similar.similar_to, product_ids, warm=True))
+
+        # Against a LIKE scan, which has to read every match to rank them.
+        queries = [rng.choice(NOTE_QUERIES) for _ in range(samples)]
+        results['search.notes'] = summarize(measure(notes.search, queries))
+        results['search.notes_like'] = summarize(measure(
+            lambda query: db.session.execute(
+                text('SELECT id, taste_notes, overall_notes FROM ratings '
+                     'WHERE ' + ' AND '.join(
+                         '(taste_notes LIKE :w{0} OR overall_notes LIKE '
+                         ':w{0})'.format(n) for n in range(len(query.split())))),
+                dict(('w{}'.format(n), '%{}%'.format(word))
+                     for n, word in enumerate(query.split()))).fetchall(),
+            queries))
+
+        path = os.path.join(workdir, 'snapshot-{}.bin'.format(size))
+        started = time.perf_counter()
+        with engine.connect() as connection:
+            snapshot.write(path, connection)
+        results['sync.snapshot'] = summarize(
+            [time.perf_counter() - started])
+        results['sync.snapshot']['bytes'] = os.path.getsize(path)
+        loaded = snapshot.Snapshot(path)
+        try:
+            results['sync.find_cigar'] = summarize(
+                measure(loaded.find_cigar, hashes))
+        finally:
+            loaded.close()
+
+        client = current_app.test_client()
+        last_page = max(0, size // 20 - 1)
+        pages = [rng.choice((0, 1, last_page // 2, last_page))
+                 for _ in range(max(1, samples // 10))]
+        results['admin.inventory_list'] = summarize(measure(
+            lambda page: client.get(
+                '/admin/inventory-admin/?page={}'.format(page)),
+            pages))
+
+        db.drop_all()
+        dialect = engine.dialect.name
+
+    return {
+        'database': dialect,
+        'url': _mask(url),
+        'size': size,
+        'results': results,
+        'index_bytes': sizes,
+    }
+
+
+def startup(samples=STARTUP_SAMPLES):
+    """Times interpreter start-up to an imported package, a built app and
+    a CLI command."""
+    results = {}
+    with open(os.devnull, 'w') as devnull:
+        for name, arguments in sorted(STARTUP_COMMANDS.items()):
+            results[name] = summarize(measure(
+                lambda _: subprocess.check_call(
+                    [sys.executable] + arguments, cwd=ROOT,
+                    stdout=devnull, stderr=devnull),
+                range(samples)))
+    return results
+
+
+def _sections(report):
+    for run in report.get('runs', []):
+        yield (run['database'], run['size']), run['results']
+    if report.get('startup'):
+        yield ('startup', None), report['startup']
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """Returns the benchmarks whose p95 regressed against `baseline`, as
+    `(database, size, name, baseline p95, p95)`."""
+    previous = dict(_sections(baseline))
+    regressions = []
+    for (database, size), results in _sections(report):
+        old = previous.get((database, size), {})
+        for name, summary in sorted(results.items()):
+            before = old.get(name, {}).get('p95')
+            if before and summary['p95'] > before * (1 + tolerance):
+                regressions.append((database, size, name, before,
+                                    summary['p95']))
+    return regressions
+
+
+def bench(urls, sizes, samples=SAMPLES, seed=0,
+          startup_samples=STARTUP_SAMPLES):
+    """Runs every size against every database in `urls`, then times
+    start-up. Databases that can't be reached are listed under `skipped`
+    instead."""
+    workdir = tempfile.mkdtemp(prefix='cigardb-bench-')
+    report = {
+        'meta': {
+            'started': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'samples': samples,
+            'seed': seed,
+            'instrumentation_overhead': measure_overhead(
+                current_app._get_current_object()),
+        },
+        'runs': [],
+        'skipped': [],
+    }
+    try:
+        for url in urls:
+            for size in sizes:
+                try:
+                    report['runs'].append(
+                        run(url, size, samples, seed, workdir))
+                except (ImportError, OperationalError) as e:
+                    # No driver installed, or no server listening.
+                    report['skipped'].append({
+                        'url': _mask(url),
+                        'error': str(getattr(e, 'orig', e)),
+                    })
+                    break
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if startup_samples:
+        report['startup'] = startup(startup_samples)
+    return report
+
+
+def dumps(report):
+    return json.dumps(report, indent=2, sort_keys=True)
@@ -0,0 +1,271 @@
+# project/server/caching.py
+
+
+#################
+#### imports ####
+#################
+
+import binascii
+import functools
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+
+from flask import has_request_context, make_response, request, session
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from project.server.cache import LRUCache
+
+
+################
+#### config ####
+################
+
+HEADER = 'X-Cache'
+
+# A file under CACHE_DIR naming the current generation of cached pages;
+# `clear` replaces it, and every process on the host reads it at most
+# once per CHECK_INTERVAL seconds.
+GENERATION = 'generation'
+CHECK_INTERVAL = 1.0
+
+
+##################
+#### backends ####
+##################
+
+class NullBackend(object):
+    """Caches nothing; `CACHE_BACKEND = 'null'`."""
+
+    hits = 0
+    misses = 0
+
+    def get(self, key, default=None):
+        return default
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class FileBackend(object):
+    """One pickle per key under `directory`, shared by every process on
+    the host and kept across restarts. Entries expire after `ttl`
+    seconds."""
+
+    def __init__(self, directory, ttl=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(
+            key.encode('utf-8')).hexdigest() + '.cache')
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as infile:
+                expires, value = pickle.load(infile)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        if expires is not None and expires < time.time():
+            self.delete(key)
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl if self.ttl else None
+        # Written aside and renamed into place, so readers never see half
+        # an entry.
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(descriptor, 'wb') as outfile:
+            pickle.dump((expires, value), outfile, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.cache'):
+                os.remove(os.path.join(self.directory, name))
+
+
+def make_backend(config):
+    kind = config['CACHE_BACKEND']
+    if kind == 'memory':
+        return LRUCache(maxsize=config['CACHE_SIZE'],
+                        ttl=config['CACHE_TIMEOUT'])
+    if kind == 'file':
+        return FileBackend(config['CACHE_DIR'], ttl=config['CACHE_TIMEOUT'])
+    if kind == 'null':
+        return NullBackend()
+    raise ValueError('Unknown CACHE_BACKEND {!r}.'.format(kind))
+
+
+#################
+#### helpers ####
+#################
+
+def _authenticated():
+    if not has_request_context():
+        return False
+    # `UserSnapshot` has the Flask-Login 0.2 method, the anonymous user
+    # the 0.3 property.
+    authenticated = current_user.is_authenticated
+    return authenticated() if callable(authenticated) else authenticated
+
+
+###################
+#### fragments ####
+###################
+
+class FragmentCacheExtension(Extension):
+    """`{% cache 'name', var, ... %}...{% endcache %}` renders the body
+    once per login state and values of the expressions."""
+
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render', [nodes.List(parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        cache = getattr(self.environment, 'page_cache', None)
+        if cache is None:
+            return caller()
+        key = cache.key('fragment', *parts)
+        fragment = cache.backend.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.backend.set(key, fragment)
+        return Markup(fragment)
+
+
+###############
+#### pages ####
+###############
+
+class PageCache(object):
+    """Whole-response and template fragment caching.
+
+    Keys vary by login state, never by user, so only pages that look the
+    same to every anonymous or every logged in visitor may be cached.
+    Requests with flashed messages pending, or that change the session,
+    are neither served from nor stored in the cache.
+
+    Keys also carry the generation in `CACHE_DIR`, so `clear` reaches the
+    other processes on the host, whatever the backend, within
+    `CHECK_INTERVAL` seconds.
+    """
+
+    def __init__(self, app=None):
+        self.backend = NullBackend()
+        self.prefix = ''
+        self.stamp = None
+        self.generation = ''
+        self._checked = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'memory')
+        app.config.setdefault('CACHE_SIZE', 1000)
+        app.config.setdefault('CACHE_TIMEOUT', 300)
+        app.config.setdefault('CACHE_KEY_PREFIX', 'cigardb')
+        self.backend = make_backend(app.config)
+        self.prefix = app.config['CACHE_KEY_PREFIX']
+        if app.config['CACHE_BACKEND'] != 'null' and \
+                app.config.get('CACHE_DIR'):
+            self.stamp = os.path.join(app.config['CACHE_DIR'], GENERATION)
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.page_cache = self
+        app.extensions['page_cache'] = self
+
+    def _generation(self):
+        now = time.time()
+        if self.stamp is not None and now - self._checked >= CHECK_INTERVAL:
+            try:
+                with open(self.stamp) as infile:
+                    self.generation = infile.read().strip()
+            except OSError:
+                self.generation = ''
+            self._checked = now
+        return self.generation
+
+    def key(self, kind, *parts):
+        """Builds a key for the current request's login state."""
+        return ':'.join([self.prefix, self._generation(), kind,
+                         'user' if _authenticated() else 'anonymous'] +
+                        [str(part) for part in parts])
+
+    def clear(self):
+        """Empties this process's backend and starts a new generation, so
+        every process on the host stops serving what it has."""
+        self.backend.clear()
+        if self.stamp is None:
+            return
+        directory = os.path.dirname(self.stamp)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        generation = binascii.hexlify(os.urandom(8)).decode('ascii')
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(descriptor, 'w') as outfile:
+            outfile.write(generation)
+        os.replace(temporary, self.stamp)
+        self.generation, self._checked = generation, time.time()
+
+    def cached(self, key=None):
+        """Caches the response of a view or error handler; `key` names
+        it, the request's path otherwise. The query string is left out
+        so that made-up ones can't add entries."""
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET' or session.get('_flashes'):
+                    return f(*args, **kwargs)
+                name = self.key('page', key or request.path)
+                hit = self.backend.get(name)
+                if hit is not None:
+                    body, status, mimetype = hit
+                    response = make_response(body, status)
+                    response.mimetype = mimetype
+                    response.headers[HEADER] = 'HIT'
+                    return response
+                response = make_response(f(*args, **kwargs))
+                # A modified session means flashes were shown or cookies
+                # are about to change; neither belongs in a shared copy.
+                if not response.direct_passthrough and not session.modified:
+                    self.backend.set(name, (response.get_data(),
+                                            response.status_code,
+                                            response.mimetype))
+                response.headers[HEADER] = 'MISS'
+                return response
+            return wrapper
+        return decorator
@@ -9,19 +9,71 @@ class BaseConfig(object):
     SECRET_KEY = SECRET_KEY = os.getenv('SECRET_KEY', 'default')
     DEBUG = False
     BCRYPT_LOG_ROUNDS = 13
+    BCRYPT_POOL_SIZE = 2
+    BCRYPT_QUEUE_DEPTH = 16
+    BCRYPT_TIMEOUT = 10
     WTF_CSRF_ENABLED = True
     DEBUG_TB_ENABLED = False
     DEBUG_TB_INTERCEPT_REDIRECTS = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_POOL_PRE_PING = False
+    # Read-only copies of the database; plain SELECTs are spread over them.
+    SQLALCHEMY_REPLICA_URIS = []
+    REPLICA_MAX_LAG = 5.0
+    REPLICA_CHECK_INTERVAL = 5.0
+    CIGAR_LOOKUP_CACHE_SIZE = 10000
+    CIGAR_LOOKUP_CACHE_TTL = 60
+    SEARCH_INDEX_MAX_AGE = 300
+    ADMIN_ENABLED = True
+    # 'memory' per process, 'file' shared on the host under CACHE_DIR, or
+    # 'null' for none.
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+    CACHE_DIR = os.path.join(basedir, '..', '..', 'tmp', 'cache')
+    CACHE_SIZE = 1000
+    CACHE_TIMEOUT = 300
+    CACHE_KEY_PREFIX = 'cigardb'
+    ASSETS = ('main.css', 'main.js')
+    ASSETS_DIST = os.path.join(basedir, '..', 'client', 'static', 'dist')
+    ASSETS_MAX_AGE = 365 * 24 * 60 * 60
+    # Location snapshots kept by `manage.py snapshot_transfers`.
+    TRANSFER_SNAPSHOT_KEEP = 3
+    IMPORT_DIR = os.path.join(basedir, '..', '..', 'tmp', 'imports')
+    IMPORT_TABLES = ('brands', 'products', 'sizes', 'locations', 'cigars',
+                     'ratings', 'transfers')
+    IMPORT_CHUNK_SIZE = 5000
+    IMPORT_POLL_INTERVAL = 1.0
+    # A running job whose worker hasn't committed a chunk for this long is
+    # taken over by another worker.
+    IMPORT_STALE_AFTER = 300
+    # A job that has crashed its worker, or been abandoned, this many
+    # times is failed rather than claimed again.
+    IMPORT_MAX_ATTEMPTS = 3
+    SMOKED_LOCATION = 'Smoked'
+    # Written by `manage.py snapshot`, served by `/sync`.
+    SNAPSHOT_DIR = os.path.join(basedir, '..', '..', 'tmp', 'snapshots')
+    SNAPSHOT_KEEP = 2
+    # Who may read /metrics besides admins: these client addresses, and
+    # scrapers sending the token as a bearer token.
+    METRICS_ALLOW = ()
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    SLOW_QUERY_THRESHOLD = 0.1
+    SLOW_QUERY_SAMPLE_RATE = 1.0
+    SLOW_QUERY_LOG_SIZE = 100
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 300
+    # Optional; needs the `redis` package. Shares the cache between workers.
+    USER_CACHE_REDIS_URL = os.getenv('USER_CACHE_REDIS_URL')
 
 
 class DevelopmentConfig(BaseConfig):
     """Development configuration."""
     DEBUG = True
     BCRYPT_LOG_ROUNDS = 4
+    BCRYPT_POOL_SIZE = 0
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'dev.sqlite')
     DEBUG_TB_ENABLED = True
+    METRICS_ALLOW = ('127.0.0.1', '::1')
 
 
 class TestingConfig(BaseConfig):
@@ -29,10 +81,12 @@ class TestingConfig(BaseConfig):
     DEBUG = True
     TESTING = True
     BCRYPT_LOG_ROUNDS = 4
+    BCRYPT_POOL_SIZE = 0
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = os.getenv('CIGARDB_URL', 'postgresql://localhost')
     DEBUG_TB_ENABLED = False
     PRESERVE_CONTEXT_ON_EXCEPTION = False
+    METRICS_ALLOW = ('127.0.0.1',)
 
 
 class ProductionConfig(BaseConfig):
@@ -40,4 +94,12 @@ class ProductionConfig(BaseConfig):
     SECRET_KEY = os.getenv('SECRET_KEY')
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.getenv('CIGARDB_URL', 'postgresql://localhost')
+    SQLALCHEMY_REPLICA_URIS = [
+        url for url in os.getenv('CIGARDB_REPLICA_URLS', '').split(',') if url]
+    # Workers x (pool size + overflow) must fit the server's max_connections.
+    SQLALCHEMY_POOL_SIZE = int(os.getenv('CIGARDB_POOL_SIZE', 5))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.getenv('CIGARDB_MAX_OVERFLOW', 10))
+    SQLALCHEMY_POOL_TIMEOUT = 10
+    SQLALCHEMY_POOL_RECYCLE = 1800
+    SQLALCHEMY_POOL_PRE_PING = True
     DEBUG_TB_ENABLED = False
@@ -0,0 +1 @@
+# project/server/data/__init__.py
@@ -0,0 +1,163 @@
+# project/server/data/dumper.py
+
+
+#################
+#### imports ####
+#################
+
+import csv
+import json
+import os
+import time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from sqlalchemy import MetaData, Table, inspect, select
+
+from project.server import db, versioning
+from project.server.data.loader import open_csv
+from project.server.search.notes import is_search_object
+
+
+################
+#### config ####
+################
+
+FETCH_SIZE = 1000
+WORKERS = 4
+STATE_FILE = '.dump_state.json'
+
+
+class DumpResult(namedtuple('DumpResult', 'table rows seconds path mark')):
+
+    @property
+    def rate(self):
+        if not self.seconds:
+            return float(self.rows)
+        return self.rows / self.seconds
+
+
+#################
+#### helpers ####
+#################
+
+def read_state(directory):
+    """Returns the recorded high-water mark of every table."""
+    path = os.path.join(directory, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as infile:
+        return json.load(infile)
+
+
+def write_state(directory, state):
+    path = os.path.join(directory, STATE_FILE)
+    with open(path + '.tmp', 'w') as outfile:
+        json.dump(state, outfile, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def _cell(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def output_path(directory, table_name, compress=False, since=None):
+    name = table_name
+    if since is not None:
+        name += '.since-{}'.format(since)
+    name += '.csv.gz' if compress else '.csv'
+    return os.path.join(directory, name)
+
+
+#################
+#### dumping ####
+#################
+
+def dump_table(engine, table_name, directory, fetch_size=FETCH_SIZE,
+               compress=False, since=None):
+    """Streams `table_name` into a CSV through a server-side cursor.
+
+    At most `fetch_size` rows are held in memory. With `since`, only rows
+    whose id is above it are written. Returns a `DumpResult` whose `mark`
+    is the highest id written (or `since` when nothing was).
+    """
+    started = time.time()
+    # The model's table where there is one, so custom types such as
+    # `cigars.hash` are written the way the loader reads them back.
+    table = db.metadata.tables.get(table_name)
+    if table is None:
+        table = Table(table_name, MetaData(), autoload=True,
+                      autoload_with=engine)
+    query = select(versioning.columns(table))
+    has_id = 'id' in table.c
+    if has_id:
+        query = query.order_by(table.c.id)
+        if since is not None:
+            query = query.where(table.c.id > since)
+    else:
+        since = None
+
+    path = output_path(directory, table_name, compress, since)
+    rows, mark = 0, since
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True) \
+            .execute(query)
+        id_index = list(result.keys()).index('id') if has_id else None
+        with open_csv(path, 'w') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(result.keys())
+            while True:
+                batch = result.fetchmany(fetch_size)
+                if not batch:
+                    break
+                writer.writerows([_cell(v) for v in row] for row in batch)
+                rows += len(batch)
+                if has_id:
+                    mark = batch[-1][id_index]
+        result.close()
+
+    if since is not None and not rows:
+        os.remove(path)
+        path = None
+    return DumpResult(table_name, rows, time.time() - started, path, mark)
+
+
+def dump_database(directory, engine=None, fetch_size=FETCH_SIZE,
+                  workers=WORKERS, compress=False, incremental=False,
+                  only=None):
+    """Dumps every table to `directory`, several tables at a time.
+
+    In incremental mode only rows above each table's recorded high-water
+    mark are exported, into `<table>.since-<mark>.csv`.
+    """
+    engine = engine or db.engine
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # The notes search index is rebuilt from `ratings`, not dumped.
+    table_names = [name for name in inspect(engine).get_table_names()
+                   if not is_search_object(name)]
+    if only:
+        table_names = [name for name in table_names if name in only]
+
+    state = read_state(directory) if incremental else {}
+    jobs = [
+        (engine, name, directory, fetch_size, compress, state.get(name))
+        for name in table_names
+    ]
+    if workers > 1 and len(jobs) > 1:
+        pool = ThreadPool(min(workers, len(jobs)))
+        try:
+            results = pool.starmap(dump_table, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [dump_table(*job) for job in jobs]
+
+    for result in results:
+        if result.mark is not None:
+            state[result.table] = result.mark
+    write_state(directory, state)
+    return results
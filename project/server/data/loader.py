@@ -0,0 +1,394 @@
+# project/server/data/loader.py
+
+
+#################
+#### imports ####
+#################
+
+import csv
+import datetime
+import decimal
+import glob
+import gzip
+import io
+import os
+import time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from sqlalchemy import select, types
+
+from project.server import db
+from project.server import models  # noqa: registers the tables on db.metadata
+from project.server import versioning
+from project.server.analytics import changes
+from project.server.inventory import rollups, valuation
+from project.server.sqltypes import HexBinary, is_hex
+
+
+################
+#### config ####
+################
+
+CHUNK_SIZE = 5000
+# Hashes resolved to ids per statement; keeps under SQLite's bind limit.
+RESOLVE_BATCH = 500
+WORKERS = 4
+REBUILDS_ROLLUPS = set(['cigars', 'products', 'transfers'])
+DATETIME_FORMATS = (
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d',
+)
+
+
+cigars = models.Inventory.__table__
+
+
+class CigarHash(str):
+    """A cell of a `hash` column in a table that now references cigars by
+    id; `write_chunk` swaps it for the id."""
+
+
+class LoadResult(namedtuple('LoadResult', 'table rows seconds ignored')):
+
+    @property
+    def rate(self):
+        if not self.seconds:
+            return float(self.rows)
+        return self.rows / self.seconds
+
+
+#################
+#### helpers ####
+#################
+
+def normalize_header(header):
+    """Maps a CSV header such as `Purchase Price` onto `purchase_price`."""
+    return header.strip().lower().replace(' ', '_')
+
+
+def table_name_for(path):
+    """`cigars.csv`, `cigars.csv.gz` and `cigars.since-10.csv` all load
+    into `cigars`."""
+    return os.path.basename(path).split('.')[0]
+
+
+def open_csv(path, mode='r'):
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(
+            gzip.open(path, mode + 'b'), encoding='utf-8', newline='')
+    return io.open(path, mode, encoding='utf-8', newline='')
+
+
+def _parse_datetime(value):
+    for fmt in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError('unrecognised datetime {!r}'.format(value))
+
+
+def _parse_date(value):
+    return _parse_datetime(value).date()
+
+
+def _parse_boolean(value):
+    return value.strip().lower() in ('1', 't', 'true', 'y', 'yes')
+
+
+def _parse_integer(value):
+    return int(float(value)) if '.' in value else int(value)
+
+
+def _parse_string(value):
+    # Older dumps wrote bcrypt hashes as their Python 3 bytes repr.
+    if len(value) > 3 and value[:2] in ("b'", 'b"') and value[-1] == value[1]:
+        return value[2:-1]
+    return value
+
+
+def _hex_parser(length):
+    def parse(value):
+        value = value.strip().lower()
+        if not is_hex(value, length):
+            raise ValueError('invalid hex digest {!r}'.format(value))
+        return value
+    return parse
+
+
+def _parse_cigar_hash(value):
+    value = value.strip().lower()
+    if not is_hex(value, cigars.c.hash.type.length):
+        raise ValueError('invalid cigar hash {!r}'.format(value))
+    return CigarHash(value)
+
+
+def converter_for(column):
+    """Returns a callable turning a CSV cell into a value for `column`."""
+    column_type = column.type
+    if isinstance(column_type, HexBinary):
+        parse = _hex_parser(column_type.length)
+    elif isinstance(column_type, types.Boolean):
+        parse = _parse_boolean
+    elif isinstance(column_type, types.Integer):
+        parse = _parse_integer
+    elif isinstance(column_type, types.Numeric):
+        parse = decimal.Decimal if column_type.asdecimal else float
+    elif isinstance(column_type, types.DateTime):
+        parse = _parse_datetime
+    elif isinstance(column_type, types.Date):
+        parse = _parse_date
+    elif isinstance(column_type, types.String):
+        parse = _parse_string
+    else:
+        parse = None
+
+    def convert(value):
+        if value == '':
+            return None
+        return parse(value) if parse else value
+    return convert
+
+
+def map_columns(table, headers):
+    """Pairs each CSV header with a column of `table`.
+
+    Returns `(mapping, ignored)`, where `mapping` is a list of
+    `(position, column, converter)` and `ignored` lists the normalized
+    headers that have no matching column. A `hash` header fills the
+    `cigar` column of tables that reference cigars by id.
+    """
+    columns = dict((normalize_header(c.name), c) for c in table.columns)
+    mapping, ignored = [], []
+    for position, header in enumerate(headers):
+        name = normalize_header(header)
+        column = columns.get(name)
+        if column is None and name == 'hash' and 'cigar' in columns:
+            mapping.append((position, columns['cigar'], _parse_cigar_hash))
+        elif column is None:
+            ignored.append(name)
+        else:
+            mapping.append((position, column, converter_for(column)))
+    return mapping, ignored
+
+
+def read_chunks(path, table, chunk_size=CHUNK_SIZE):
+    """Streams `path` as lists of at most `chunk_size` converted rows.
+
+    Yields `(columns, ignored, rows)`; only one chunk is held in memory.
+    """
+    with open_csv(path) as infile:
+        reader = csv.reader(infile)
+        try:
+            headers = next(reader)
+        except StopIteration:
+            return
+        mapping, ignored = map_columns(table, headers)
+        columns = [column for _, column, _ in mapping]
+        chunk = []
+        for record in reader:
+            if not record:
+                continue
+            try:
+                chunk.append(tuple(
+                    convert(record[position])
+                    if position < len(record) else None
+                    for position, _, convert in mapping
+                ))
+            except (ValueError, decimal.InvalidOperation) as error:
+                raise ValueError('{}:{}: {}'.format(
+                    path, reader.line_num, error))
+            if len(chunk) >= chunk_size:
+                yield columns, ignored, chunk
+                chunk = []
+        if chunk:
+            yield columns, ignored, chunk
+
+
+def dependency_levels(tables):
+    """Groups `tables` so that every table only references tables that are
+    outside the load or in an earlier group; each group can load in parallel.
+    """
+    names = set(table.name for table in tables)
+    remaining = list(tables)
+    done, levels = set(), []
+    while remaining:
+        level = []
+        for table in remaining:
+            parents = set(
+                fk.column.table.name for fk in table.foreign_keys
+            ) & names
+            parents.discard(table.name)
+            if parents <= done:
+                level.append(table)
+        if not level:
+            # A reference cycle; load whatever is left one at a time.
+            level = remaining[:1]
+        levels.append(level)
+        done.update(table.name for table in level)
+        remaining = [table for table in remaining if table not in level]
+    return levels
+
+
+#################
+#### inserts ####
+#################
+
+def _copy_cell(column):
+    if isinstance(column.type, HexBinary):
+        # bytea's hex input format.
+        return lambda value: None if value is None else '\\x' + value
+    return lambda value: \
+        value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _copy_chunk(connection, table, columns, rows):
+    """Streams a chunk through PostgreSQL's COPY."""
+    preparer = connection.dialect.identifier_preparer
+    cells = [_copy_cell(column) for column in columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([cell(value) for cell, value in zip(cells, row)])
+    buffer.seek(0)
+    statement = 'COPY {} ({}) FROM STDIN WITH CSV'.format(
+        preparer.format_table(table),
+        ', '.join(preparer.quote(column.name) for column in columns)
+    )
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    finally:
+        cursor.close()
+
+
+def _insert_chunk(connection, table, columns, rows):
+    """Sends a chunk as a single executemany."""
+    keys = [column.key for column in columns]
+    connection.execute(
+        table.insert(), [dict(zip(keys, row)) for row in rows]
+    )
+
+
+def resolve_cigars(connection, rows):
+    """Replaces `CigarHash` cells with the ids of their cigars; raises
+    ValueError for hashes that aren't in `cigars`."""
+    hashes = sorted(set(value for row in rows for value in row
+                        if isinstance(value, CigarHash)))
+    if not hashes:
+        return rows
+    ids = {}
+    for start in range(0, len(hashes), RESOLVE_BATCH):
+        batch = hashes[start:start + RESOLVE_BATCH]
+        ids.update((hash, id) for id, hash in connection.execute(
+            select([cigars.c.id, cigars.c.hash])
+            .where(cigars.c.hash.in_(batch))))
+    unknown = sorted(set(hashes) - set(ids))
+    if unknown:
+        raise ValueError('Unknown cigars: {}.'.format(', '.join(unknown)))
+    return [tuple(ids[value] if isinstance(value, CigarHash) else value
+                  for value in row) for row in rows]
+
+
+def write_chunk(connection, table, columns, rows):
+    """Writes converted rows with COPY on PostgreSQL, else executemany."""
+    rows = resolve_cigars(connection, rows)
+    if connection.dialect.name == 'postgresql':
+        _copy_chunk(connection, table, columns, rows)
+    else:
+        _insert_chunk(connection, table, columns, rows)
+
+
+def reset_sequence(connection, table):
+    """Moves the id sequence past rows written with explicit ids; only
+    PostgreSQL needs it."""
+    if 'id' not in table.c or connection.dialect.name != 'postgresql':
+        return
+    preparer = connection.dialect.identifier_preparer
+    connection.execute(
+        "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+        "coalesce(max(id), 1)) FROM {1}".format(
+            table.name, preparer.format_table(table))
+    )
+
+
+def load_table(engine, table, paths, chunk_size=CHUNK_SIZE):
+    """Loads every file in `paths` into `table` in one transaction."""
+    started = time.time()
+    rows, ignored = 0, set()
+    with engine.begin() as connection:
+        for path in paths:
+            for columns, skipped, chunk in read_chunks(path, table, chunk_size):
+                write_chunk(connection, table, columns, chunk)
+                rows += len(chunk)
+                ignored.update(skipped)
+        reset_sequence(connection, table)
+        versioning.bump(connection, *changes.bulk_counters(table.name))
+        if table.name in changes.TABLES:
+            changes.queue_all(connection)
+    return LoadResult(table.name, rows, time.time() - started, sorted(ignored))
+
+
+#################
+#### loading ####
+#################
+
+def find_fixtures(directory):
+    """Maps table names onto their CSV files in `directory`."""
+    found = {}
+    patterns = ('*.csv', '*.csv.gz')
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(directory, pattern)):
+            found.setdefault(table_name_for(path), []).append(path)
+    for paths in found.values():
+        paths.sort()
+    return found
+
+
+def load_directory(directory, engine=None, chunk_size=CHUNK_SIZE,
+                   workers=WORKERS, replace=False, only=None):
+    """Bulk loads the CSV files in `directory` in foreign-key order.
+
+    Tables without a model are skipped. Returns `(results, skipped)`.
+    """
+    engine = engine or db.engine
+    fixtures = find_fixtures(directory)
+    if only:
+        fixtures = dict((k, v) for k, v in fixtures.items() if k in only)
+    tables = [t for t in db.metadata.sorted_tables if t.name in fixtures]
+    skipped = sorted(set(fixtures) - set(t.name for t in tables))
+
+    db.metadata.create_all(bind=engine, tables=tables)
+    if replace:
+        with engine.begin() as connection:
+            for table in reversed(tables):
+                connection.execute(table.delete())
+            if set(t.name for t in tables) & set(versioning.SYNCED):
+                versioning.reset_sync(connection)
+
+    if engine.dialect.name == 'sqlite':
+        # SQLite allows a single writer at a time.
+        workers = 1
+
+    results = []
+    pool = ThreadPool(workers) if workers > 1 else None
+    try:
+        for level in dependency_levels(tables):
+            jobs = [(engine, t, fixtures[t.name], chunk_size) for t in level]
+            if pool and len(jobs) > 1:
+                results.extend(pool.starmap(load_table, jobs))
+            else:
+                results.extend(load_table(*job) for job in jobs)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if set(t.name for t in tables) & REBUILDS_ROLLUPS:
+        # Bulk inserts bypass the session events that keep rollups current.
+        with engine.begin() as connection:
+            rollups.rebuild(connection)
+            valuation.rebuild(connection)
+    return results, skipped
@@ -0,0 +1,333 @@
+# project/server/database.py
+
+
+#################
+#### imports ####
+#################
+
+import itertools
+import threading
+import time
+import weakref
+
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, exc, select, text
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import Select
+
+from project.server.instrumentation import Histogram
+
+
+################
+#### config ####
+################
+
+PRIMARY = 'primary'
+# `session.info` keys; the session, and so these, last one request.
+PINNED = 'routing_pinned'
+REPLICA = 'routing_replica'
+SAVEPOINT = 'in_savepoint'
+
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0,
+                5.0, 30.0)
+
+# Seconds a replica is behind its primary. The replay timestamp stops
+# moving while the primary is idle, which overstates the lag then; that
+# only sends reads to the primary when it has nothing else to do.
+LAG_QUERIES = {
+    'postgresql': 'SELECT CASE WHEN pg_is_in_recovery() THEN COALESCE('
+                  'EXTRACT(EPOCH FROM now() - '
+                  'pg_last_xact_replay_timestamp()), 0) ELSE 0 END',
+}
+
+
+###############
+#### pools ####
+###############
+
+class PoolStats(object):
+    """Checkouts and the time spent waiting for them, for one named
+    engine. Kept across engine re-creation."""
+
+    def __init__(self, name):
+        self.name = name
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait = Histogram(WAIT_BUCKETS)
+        self._lock = threading.Lock()
+
+    def checked_out(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait.observe(seconds)
+
+    def timed_out(self):
+        with self._lock:
+            self.timeouts += 1
+
+
+class TimedQueuePool(QueuePool):
+    """`QueuePool` that reports how long each checkout waited, opening a
+    new connection included, to its `stats`."""
+
+    stats = None
+
+    def connect(self):
+        return self._timed(super(TimedQueuePool, self).connect)
+
+    def unique_connection(self):
+        # What `Engine.connect()` uses.
+        return self._timed(super(TimedQueuePool, self).unique_connection)
+
+    def _timed(self, checkout):
+        started = time.perf_counter()
+        try:
+            connection = checkout()
+        except exc.TimeoutError:
+            if self.stats is not None:
+                self.stats.timed_out()
+            raise
+        if self.stats is not None:
+            self.stats.checked_out(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        # `engine.dispose()` swaps in a fresh pool.
+        pool = super(TimedQueuePool, self).recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def _ping(connection, branch):
+    """Checks a connection is alive before it's used; a dead one is
+    replaced, once. SQLAlchemy's pessimistic disconnect handling."""
+    if branch:
+        return
+    should_close = connection.should_close_with_result
+    connection.should_close_with_result = False
+    try:
+        connection.scalar(select([1]))
+    except exc.DBAPIError as e:
+        if not e.connection_invalidated:
+            raise
+        connection.scalar(select([1]))
+    finally:
+        connection.should_close_with_result = should_close
+
+
+##################
+#### replicas ####
+##################
+
+class Replica(object):
+    """A read-only copy of the primary and what is known of its lag."""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.engine = None
+        self.lag = None
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def healthy(self):
+        return self.lag is not None
+
+    def check(self, router):
+        """Measures the lag, at most every `check_interval` seconds. Only
+        one thread measures; the others use the last result."""
+        now = time.monotonic()
+        if self.checked_at is not None and \
+                now - self.checked_at < router.check_interval:
+            return
+        if not self._lock.acquire(False):
+            return
+        try:
+            if self.engine is None:
+                self.engine = router.create_engine(self.name, self.url)
+                event.listen(self.engine, 'handle_error', self._failed)
+            query = LAG_QUERIES.get(self.engine.dialect.name)
+            with self.engine.connect() as connection:
+                lag = float(connection.scalar(text(query))) if query else 0.0
+            self.lag = lag
+        except exc.DBAPIError:
+            self.lag = None
+        finally:
+            self.checked_at = time.monotonic()
+            self._lock.release()
+
+    def _failed(self, context):
+        # Stop routing here until the next check finds it back.
+        if context.is_disconnect:
+            self.lag = None
+
+    def usable(self, router):
+        self.check(router)
+        return self.healthy and self.lag <= router.max_lag
+
+
+class Router(object):
+    """Replicas, pool statistics and routing decisions for one app."""
+
+    def __init__(self, db, app):
+        self.db = db
+        self.app = app
+        self.max_lag = app.config['REPLICA_MAX_LAG']
+        self.check_interval = app.config['REPLICA_CHECK_INTERVAL']
+        self.pre_ping = app.config['SQLALCHEMY_POOL_PRE_PING']
+        self.replicas = [
+            Replica('replica_{}'.format(n), url)
+            for n, url in enumerate(app.config['SQLALCHEMY_REPLICA_URIS'])]
+        self.pools = {}
+        self.routed = dict((name, 0) for name in
+                           [PRIMARY] + [r.name for r in self.replicas])
+        self._watched = weakref.WeakSet()
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+    def pool_stats(self, name):
+        stats = self.pools.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self.pools.setdefault(name, PoolStats(name))
+        return stats
+
+    def watch(self, engine, name):
+        """Attaches pool statistics and, if configured, pre-ping."""
+        if engine in self._watched:
+            return
+        with self._lock:
+            if engine in self._watched:
+                return
+            self._watched.add(engine)
+        if isinstance(engine.pool, TimedQueuePool):
+            engine.pool.stats = self.pool_stats(name)
+        if self.pre_ping:
+            event.listen(engine, 'engine_connect', _ping)
+
+    def create_engine(self, name, url):
+        """Creates an engine for `url` with the same options as the
+        primary's."""
+        info = make_url(url)
+        options = {'convert_unicode': True}
+        self.db.apply_pool_defaults(self.app, options)
+        self.db.apply_driver_hacks(self.app, info, options)
+        engine = create_engine(info, **options)
+        self.watch(engine, name)
+        return engine
+
+    def engines(self):
+        """Yields `(name, engine)` for every engine created so far."""
+        yield PRIMARY, self.db.get_engine(self.app)
+        for replica in self.replicas:
+            if replica.engine is not None:
+                yield replica.name, replica.engine
+
+    def choose(self):
+        """Returns the replica a session should read from, round robin
+        over the usable ones, or None to read from the primary."""
+        count = len(self.replicas)
+        start = next(self._next)
+        for n in range(count):
+            replica = self.replicas[(start + n) % count]
+            if replica.usable(self):
+                self._routed(replica.name)
+                return replica
+        self._routed(PRIMARY)
+        return None
+
+    def _routed(self, name):
+        with self._lock:
+            self.routed[name] += 1
+
+
+#################
+#### session ####
+#################
+
+def _is_read(clause):
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+class RoutingSession(SignallingSession):
+    """Sends plain SELECTs to a replica and everything else to the primary.
+
+    The replica is chosen once per session. The first statement that goes
+    to the primary for any other reason - a flush, a `connection()`, a
+    locking read - pins the session there, so reads after a write in the
+    same request see it, committed or not.
+    """
+
+    def __init__(self, db, **options):
+        super(RoutingSession, self).__init__(db, **options)
+        self.router = self.app.extensions.get('router')
+
+    def get_bind(self, mapper=None, clause=None):
+        bind = super(RoutingSession, self).get_bind(mapper, clause)
+        router, info = self.router, self.info
+        if router is None or not router.replicas or bind is not self.bind \
+                or info.get(PINNED):
+            return bind
+        if self._flushing or not _is_read(clause):
+            info[PINNED] = True
+            return bind
+        if REPLICA not in info:
+            info[REPLICA] = router.choose()
+        replica = info[REPLICA]
+        return replica.engine if replica is not None else bind
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def _reopen_savepoint(session, transaction):
+    # A commit or rollback only ends the SAVEPOINT; open the next one so
+    # the outer transaction is never touched.
+    if session.info.get(SAVEPOINT) and transaction.nested and \
+            not transaction._parent.nested:
+        session.expire_all()
+        session.begin_nested()
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """`SQLAlchemy` with config-driven pool options, read replicas and
+    pool statistics.
+
+    While `savepoint_connection` is set, every new session is bound to
+    that connection and works inside a SAVEPOINT, so nothing it commits
+    outlives the connection's own transaction; the test suite rolls that
+    back after each test.
+    """
+
+    savepoint_connection = None
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_POOL_PRE_PING', False)
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_MAX_LAG', 5.0)
+        app.config.setdefault('REPLICA_CHECK_INTERVAL', 5.0)
+        super(RoutingSQLAlchemy, self).init_app(app)
+        app.extensions['router'] = Router(self, app)
+
+    def create_session(self, options):
+        connection = self.savepoint_connection
+        if connection is None:
+            return RoutingSession(self, **options)
+        binds = {table: connection for table in self.get_binds()}
+        session = RoutingSession(
+            self, **dict(options, bind=connection, binds=binds))
+        session.info[SAVEPOINT] = True
+        session.begin_nested()
+        return session
+
+    def apply_driver_hacks(self, app, info, options):
+        super(RoutingSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        # Where a queue would be used anyway, or is asked for on SQLite.
+        options.setdefault('poolclass', TimedQueuePool)
+
+    def get_engine(self, app, bind=None):
+        engine = super(RoutingSQLAlchemy, self).get_engine(app, bind)
+        router = app.extensions.get('router')
+        if router is not None:
+            router.watch(engine, PRIMARY if bind is None else bind)
+        return engine
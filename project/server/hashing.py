@@ -0,0 +1,205 @@
+# project/server/hashing.py
+
+
+#################
+#### imports ####
+#################
+
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+from flask import current_app
+from flask.signals import Namespace
+
+
+################
+#### config ####
+################
+
+signals = Namespace()
+
+# Sent with `kind` and `seconds`, the time the caller spent blocked.
+password_hashed = signals.signal('password-hashed')
+
+
+################
+#### errors ####
+################
+
+class HashingOverloaded(Exception):
+    """Raised instead of queueing when too many hashes are in flight, or
+    when a hash takes longer than `BCRYPT_TIMEOUT`."""
+
+
+#################
+#### workers ####
+#################
+
+def _to_bytes(value):
+    return value.encode('utf-8') if not isinstance(value, bytes) else value
+
+
+def _hash(password, rounds):
+    started = time.time()
+    pw_hash = bcrypt.hashpw(_to_bytes(password), bcrypt.gensalt(rounds))
+    return pw_hash.decode('utf-8'), started, time.time()
+
+
+def _check(pw_hash, password):
+    started = time.time()
+    pw_hash = _to_bytes(pw_hash)
+    matches = hmac.compare_digest(
+        bcrypt.hashpw(_to_bytes(password), pw_hash), pw_hash)
+    return matches, started, time.time()
+
+
+#################
+#### metrics ####
+#################
+
+class Summary(object):
+    """Count, sum and maximum of observed durations, in seconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class HashingMetrics(object):
+
+    def __init__(self):
+        self.latency = {'hash': Summary(), 'check': Summary()}
+        self.queue_wait = Summary()
+        self.rejected = 0
+        self.timed_out = 0
+        self.rehashed = 0
+        self.in_flight = 0
+
+
+################
+#### hasher ####
+################
+
+class PasswordHasher(object):
+    """Runs bcrypt in a size-limited process pool, off the request thread.
+
+    `BCRYPT_POOL_SIZE` worker processes do the hashing; with 0 it runs
+    inline. Once `BCRYPT_QUEUE_DEPTH` calls are in flight further calls
+    raise `HashingOverloaded` straight away instead of piling up behind
+    the pool. A call that gives up waiting keeps its slot until its hash
+    finishes, so abandoned hashes still count against the depth.
+    """
+
+    def __init__(self, app=None):
+        self.metrics = HashingMetrics()
+        self._executor = None
+        self._executor_pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_POOL_SIZE', 0)
+        app.config.setdefault('BCRYPT_QUEUE_DEPTH', 16)
+        app.config.setdefault('BCRYPT_TIMEOUT', 10)
+        app.extensions['password_hasher'] = self
+
+    @property
+    def rounds(self):
+        return current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+
+    def _pool(self, size):
+        # Pools don't survive a fork, so each worker process gets its own.
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=size)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _reset(self):
+        with self._lock:
+            self._executor = None
+
+    def _acquire(self):
+        if self._slots is None:
+            with self._lock:
+                if self._slots is None:
+                    self._slots = threading.BoundedSemaphore(
+                        current_app.config['BCRYPT_QUEUE_DEPTH'])
+        if not self._slots.acquire(False):
+            with self._lock:
+                self.metrics.rejected += 1
+            raise HashingOverloaded()
+        with self._lock:
+            self.metrics.in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self.metrics.in_flight -= 1
+        self._slots.release()
+
+    def _run(self, kind, function, *args):
+        self._acquire()
+        submitted = time.time()
+        size = current_app.config['BCRYPT_POOL_SIZE']
+        if not size:
+            try:
+                result, started, finished = function(*args)
+            finally:
+                self._release()
+        else:
+            try:
+                future = self._pool(size).submit(function, *args)
+            except BrokenProcessPool:
+                self._release()
+                self._reset()
+                raise
+            future.add_done_callback(lambda future: self._release())
+            try:
+                result, started, finished = future.result(
+                    current_app.config['BCRYPT_TIMEOUT'])
+            except TimeoutError:
+                with self._lock:
+                    self.metrics.timed_out += 1
+                raise HashingOverloaded()
+            except BrokenProcessPool:
+                # A worker died; start a fresh pool for the next call.
+                self._reset()
+                raise
+        self.metrics.queue_wait.observe(max(started - submitted, 0.0))
+        self.metrics.latency[kind].observe(finished - started)
+        password_hashed.send(self, kind=kind, seconds=time.time() - submitted)
+        return result
+
+    def hash_password(self, password):
+        return self._run('hash', _hash, password, self.rounds)
+
+    def check_password(self, pw_hash, password):
+        return self._run('check', _check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """True when `pw_hash` was made with a cost other than the
+        configured `BCRYPT_LOG_ROUNDS`."""
+        try:
+            cost = int(_to_bytes(pw_hash).split(b'$')[2])
+        except (IndexError, ValueError):
+            return True
+        return cost != self.rounds
@@ -0,0 +1 @@
+# project/server/imports/__init__.py
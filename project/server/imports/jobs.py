@@ -0,0 +1,287 @@
+# project/server/imports/jobs.py
+
+
+#################
+#### imports ####
+#################
+
+import datetime
+import logging
+import os
+import socket
+import time
+import uuid
+
+from flask import current_app
+from sqlalchemy import and_, case, exc, func, or_, select
+from werkzeug.utils import secure_filename
+
+from project.server import db, versioning
+from project.server.analytics import changes
+from project.server.data.loader import REBUILDS_ROLLUPS, read_chunks, \
+    reset_sequence, write_chunk
+from project.server.inventory import rollups, valuation
+from project.server.models import ImportJob
+
+
+################
+#### config ####
+################
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+jobs = ImportJob.__table__
+
+logger = logging.getLogger('cigardb.imports')
+
+
+################
+#### errors ####
+################
+
+class JobLost(Exception):
+    """Raised when another worker has taken over a job, which happens
+    after this one stopped heartbeating for `IMPORT_STALE_AFTER`."""
+
+
+#################
+#### enqueue ####
+#################
+
+def enqueue(upload, table, user=None):
+    """Saves `upload`, a werkzeug `FileStorage`, and queues its import
+    into `table` in the current transaction. The caller commits."""
+    if table not in current_app.config['IMPORT_TABLES']:
+        raise ValueError('Cannot import into {!r}.'.format(table))
+    filename = secure_filename(upload.filename or '')
+    if not filename.endswith(('.csv', '.csv.gz')):
+        raise ValueError('Expected a .csv or .csv.gz file.')
+    directory = current_app.config['IMPORT_DIR']
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, '{}.{}'.format(
+        uuid.uuid4().hex, filename.split('.', 1)[1]))
+    upload.save(path)
+    job = ImportJob(table=table, path=path, filename=filename, user=user,
+                    status=QUEUED,
+                    chunk_size=current_app.config['IMPORT_CHUNK_SIZE'])
+    db.session.add(job)
+    return job
+
+
+def progress(job):
+    """What the polling endpoint reports for `job`."""
+    def iso(value):
+        return value.isoformat() if value is not None else None
+
+    return {
+        'id': job.id,
+        'table': job.table,
+        'filename': job.filename,
+        'status': job.status,
+        'rows': job.rows,
+        'total': job.total,
+        'percent': round(100.0 * job.rows / job.total, 1)
+        if job.total else (100.0 if job.status == DONE else 0.0),
+        'ignored': job.ignored.split(',') if job.ignored else [],
+        'error': job.error,
+        'created_on': iso(job.created_on),
+        'started_on': iso(job.started_on),
+        'finished_on': iso(job.finished_on),
+    }
+
+
+################
+#### worker ####
+################
+
+def claim(connection, worker, now=None):
+    """Marks the oldest queued job, or one whose worker went quiet, as
+    running for `worker` and returns its id, or None.
+
+    The UPDATE only matches while the row is as it was read, so of two
+    workers claiming at once exactly one wins. A job already claimed
+    `IMPORT_MAX_ATTEMPTS` times is failed instead.
+    """
+    now = now or datetime.datetime.now()
+    stale = now - datetime.timedelta(
+        seconds=current_app.config['IMPORT_STALE_AFTER'])
+    limit = current_app.config['IMPORT_MAX_ATTEMPTS']
+    candidates = connection.execute(
+        select([jobs.c.id, jobs.c.status, jobs.c.heartbeat,
+                jobs.c.attempts])
+        .where(or_(jobs.c.status == QUEUED,
+                   and_(jobs.c.status == RUNNING, jobs.c.heartbeat < stale)))
+        .order_by(jobs.c.id).limit(10)).fetchall()
+    for id, status, heartbeat, attempts in candidates:
+        unchanged = jobs.c.heartbeat.is_(None) if heartbeat is None \
+            else jobs.c.heartbeat == heartbeat
+        match = and_(jobs.c.id == id, jobs.c.status == status, unchanged)
+        if attempts >= limit:
+            # Its workers keep dying on it.
+            connection.execute(jobs.update().where(match).values(
+                status=FAILED, finished_on=now,
+                error='Gave up after {} attempts.'.format(attempts)))
+            continue
+        claimed = connection.execute(
+            jobs.update().where(match)
+            .values(status=RUNNING, worker=worker, heartbeat=now,
+                    attempts=jobs.c.attempts + 1,
+                    started_on=func.coalesce(jobs.c.started_on, now)))
+        if claimed.rowcount == 1:
+            return id
+    return None
+
+
+def _finish(job_id, status, error=None):
+    with db.engine.begin() as connection:
+        connection.execute(jobs.update().where(jobs.c.id == job_id).values(
+            status=status, error=error,
+            finished_on=datetime.datetime.now()))
+
+
+def _release(job_id, worker, error):
+    """Puts a job that hit an unexpected error back in the queue, or fails
+    it once it has had `IMPORT_MAX_ATTEMPTS`."""
+    spent = jobs.c.attempts >= current_app.config['IMPORT_MAX_ATTEMPTS']
+    with db.engine.begin() as connection:
+        connection.execute(
+            jobs.update()
+            .where(and_(jobs.c.id == job_id, jobs.c.worker == worker,
+                        jobs.c.status == RUNNING))
+            .values(status=case([(spent, FAILED)], else_=QUEUED),
+                    finished_on=case([(spent, datetime.datetime.now())]),
+                    worker=None, heartbeat=None, error=error))
+
+
+def _beat(connection, job_id, worker, **values):
+    """Records that `worker` is still on the job, along with `values`;
+    raises `JobLost` if it no longer holds it."""
+    mine = connection.execute(
+        jobs.update()
+        .where(and_(jobs.c.id == job_id, jobs.c.worker == worker,
+                    jobs.c.status == RUNNING))
+        .values(heartbeat=datetime.datetime.now(), **values))
+    if mine.rowcount != 1:
+        raise JobLost(job_id)
+
+
+def validate(path, table, chunk_size, beat=None):
+    """Converts every row without writing any; returns `(rows, ignored)`
+    or raises ValueError with the first bad line. `beat` is called after
+    each chunk."""
+    total, ignored, matched = 0, [], False
+    for columns, ignored, rows in read_chunks(path, table, chunk_size):
+        matched = matched or bool(columns)
+        total += len(rows)
+        if beat is not None:
+            beat()
+    if total and not matched:
+        raise ValueError('No column of {} in the file.'.format(table.name))
+    return total, ignored
+
+
+def run(job_id, worker):
+    """Imports a claimed job one committed chunk at a time, picking up
+    after the last committed chunk if it was interrupted."""
+    engine = db.engine
+    job = engine.execute(jobs.select().where(jobs.c.id == job_id)).first()
+    table = db.metadata.tables[job.table]
+    def beat():
+        # Validating a large file takes a while; without this another
+        # worker would think the job abandoned.
+        with engine.begin() as connection:
+            _beat(connection, job_id, worker)
+
+    try:
+        if job.total is None:
+            total, ignored = validate(job.path, table, job.chunk_size, beat)
+            engine.execute(jobs.update().where(jobs.c.id == job_id).values(
+                total=total, ignored=','.join(ignored) or None))
+        chunk = 0
+        for columns, _, rows in read_chunks(job.path, table, job.chunk_size):
+            chunk += 1
+            if chunk <= job.chunks:
+                continue
+            with engine.begin() as connection:
+                # Progress first: if the job is no longer ours, nothing of
+                # this chunk is written.
+                _beat(connection, job_id, worker, chunks=chunk,
+                      rows=jobs.c.rows + len(rows))
+                write_chunk(connection, table, columns, rows)
+                versioning.bump(connection,
+                                *changes.bulk_counters(table.name))
+        with engine.begin() as connection:
+            reset_sequence(connection, table)
+            if table.name in REBUILDS_ROLLUPS:
+                # Chunks bypass the session events that keep rollups current.
+                rollups.rebuild(connection)
+                valuation.rebuild(connection)
+            if table.name in changes.TABLES:
+                # And those that queue products for the recommendations.
+                changes.queue_all(connection)
+    except (ValueError, exc.IntegrityError, exc.DataError) as e:
+        # Bad data won't get better on a retry.
+        logger.warning('import %s failed: %s', job_id, e)
+        _finish(job_id, FAILED, str(getattr(e, 'orig', e)))
+        return FAILED
+    _finish(job_id, DONE)
+    os.remove(job.path)
+    return DONE
+
+
+def recommend():
+    """Refreshes the similar products lists from the products queued
+    since the last refresh, logging rather than raising on failure.
+    Returns the number of lists written."""
+    # The analytics import NumPy, so they load on first use.
+    from project.server.analytics import similar
+    try:
+        with db.engine.begin() as connection:
+            return similar.refresh(connection)
+    except Exception:
+        # Left queued for the next try.
+        logger.exception('refreshing the similar products failed')
+        return 0
+
+
+def work(once=False, worker=None):
+    """Runs queued jobs until stopped, polling every
+    `IMPORT_POLL_INTERVAL` seconds when idle; with `once`, returns when
+    the queue is empty. Returns the number of jobs run.
+
+    While idle it also keeps the recommendations current, so rating
+    writes never refresh them in a request.
+    """
+    worker = worker or '{}@{}'.format(os.getpid(), socket.gethostname())
+    interval = current_app.config['IMPORT_POLL_INTERVAL']
+    done = 0
+    while True:
+        with db.engine.begin() as connection:
+            job_id = claim(connection, worker)
+        if job_id is None:
+            recommend()
+            if once:
+                return done
+            time.sleep(interval)
+            continue
+        try:
+            run(job_id, worker)
+        except JobLost:
+            logger.warning('import %s was taken over by another worker',
+                           job_id)
+        except Exception as e:
+            # A missing file, a dropped connection: keep the worker going,
+            # and try the job again later.
+            logger.exception('import %s failed unexpectedly', job_id)
+            try:
+                _release(job_id, worker,
+                         '{}: {}'.format(type(e).__name__, e))
+            except exc.SQLAlchemyError:
+                # Left running; it is taken over once stale, and counts
+                # as an attempt then.
+                logger.exception('could not release import %s', job_id)
+        done += 1
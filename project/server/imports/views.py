@@ -0,0 +1,50 @@
+# project/server/imports/views.py
+
+
+#################
+#### imports ####
+#################
+
+from flask import Blueprint, jsonify, request, url_for
+from flask_login import current_user, login_required
+
+from project.server import db
+from project.server.imports import jobs
+from project.server.models import ImportJob
+
+
+################
+#### config ####
+################
+
+imports_blueprint = Blueprint('imports', __name__,)
+
+
+################
+#### routes ####
+################
+
+@imports_blueprint.route('/imports', methods=['POST'])
+@login_required
+def upload():
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify(error='No file uploaded.'), 400
+    try:
+        job = jobs.enqueue(upload, request.form.get('table', 'cigars'),
+                           user=current_user.id)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    db.session.commit()
+    # Parsing and inserting happen in `manage.py import_worker`.
+    return jsonify(jobs.progress(job)), 202, {
+        'Location': url_for('imports.status', job_id=job.id)}
+
+
+@imports_blueprint.route('/imports/<int:job_id>')
+@login_required
+def status(job_id):
+    job = ImportJob.query.get(job_id)
+    if job is None or (job.user != current_user.id and not current_user.admin):
+        return jsonify(error='Unknown import.', id=job_id), 404
+    return jsonify(jobs.progress(job))
@@ -0,0 +1,415 @@
+# project/server/instrumentation.py
+
+
+#################
+#### imports ####
+#################
+
+import bisect
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+
+from flask import _request_ctx_stack, before_render_template, \
+    request_finished, request_started, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from project.server.hashing import password_hashed
+
+
+################
+#### config ####
+################
+
+HEADER = 'X-Statement-Count'
+PREFIX = 'cigardb_'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+PHASES = ('db', 'bcrypt', 'template')
+
+logger = logging.getLogger('cigardb.slow_query')
+
+
+###############
+#### types ####
+###############
+
+class Histogram(object):
+    """Prometheus-style histogram with fixed upper bounds. Not locked; the
+    owner serializes `observe`."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Yields `(upper bound, observations at or below it)`."""
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class EndpointMetrics(object):
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.phases = dict((phase, 0.0) for phase in PHASES)
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed, stats):
+        with self._lock:
+            self.latency.observe(elapsed)
+            self.queries.observe(stats.queries)
+            self.phases['db'] += stats.db
+            self.phases['bcrypt'] += stats.bcrypt
+            self.phases['template'] += stats.template
+
+
+class RequestStats(object):
+
+    __slots__ = ('started', 'queries', 'db', 'bcrypt', 'template',
+                 'template_started')
+
+    def __init__(self, started):
+        self.started = started
+        self.queries = 0
+        self.db = 0.0
+        self.bcrypt = 0.0
+        self.template = 0.0
+        self.template_started = None
+
+
+#################
+#### helpers ####
+#################
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_params = re.compile(r'%\(\w+\)s|:\w+|\$\d+|\?')
+_lists = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_spaces = re.compile(r'\s+')
+
+
+def normalize_sql(statement):
+    """Reduces `statement` to its shape: literals and parameters become
+    `?` and IN lists of any length become `(...)`."""
+    statement = _literals.sub('?', statement)
+    statement = _params.sub('?', statement)
+    statement = _lists.sub('(...)', statement)
+    return _spaces.sub(' ', statement).strip()
+
+
+def _stats():
+    # The request context itself, not `g`, to skip the proxy lookups.
+    context = _request_ctx_stack.top
+    return getattr(context, 'request_stats', None)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+#########################
+#### instrumentation ####
+#########################
+
+class Instrumentation(object):
+    """Always-on request and query metrics, cheap enough for production.
+
+    Per endpoint it keeps a latency histogram, a queries-per-request
+    histogram and the time spent in the database, in bcrypt and rendering
+    templates. Queries slower than `SLOW_QUERY_THRESHOLD` seconds are
+    sampled at `SLOW_QUERY_SAMPLE_RATE` into a bounded log of normalized
+    SQL.
+    """
+
+    def __init__(self, app=None, listen=True):
+        self.endpoints = {}
+        self.slow_queries = deque()
+        self.slow_query_count = 0
+        self.threshold = 0.1
+        self.sample_rate = 1.0
+        self._lock = threading.Lock()
+        if listen:
+            # Process-wide hooks, so they are attached once, not per app.
+            password_hashed.connect(self._hashed, weak=False)
+            event.listen(Engine, 'before_cursor_execute', self._query_started)
+            event.listen(Engine, 'after_cursor_execute',
+                         self._query_finished)
+            event.listen(Engine, 'handle_error', self._query_failed)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_THRESHOLD', 0.1)
+        app.config.setdefault('SLOW_QUERY_SAMPLE_RATE', 1.0)
+        app.config.setdefault('SLOW_QUERY_LOG_SIZE', 100)
+        self.threshold = app.config['SLOW_QUERY_THRESHOLD']
+        self.sample_rate = app.config['SLOW_QUERY_SAMPLE_RATE']
+        self.slow_queries = deque(maxlen=app.config['SLOW_QUERY_LOG_SIZE'])
+        request_started.connect(self._request_started, app, weak=False)
+        request_finished.connect(self._request_finished, app, weak=False)
+        before_render_template.connect(self._render_started, app,
+                                       weak=False)
+        template_rendered.connect(self._render_finished, app, weak=False)
+        app.extensions['instrumentation'] = self
+
+    def reset(self):
+        with self._lock:
+            self.endpoints.clear()
+            self.slow_queries.clear()
+            self.slow_query_count = 0
+
+    # requests
+
+    def _request_started(self, sender, **extra):
+        _request_ctx_stack.top.request_stats = \
+            RequestStats(time.perf_counter())
+
+    def _request_finished(self, sender, response, **extra):
+        context = _request_ctx_stack.top
+        stats = getattr(context, 'request_stats', None)
+        if stats is None:
+            return
+        endpoint = context.request.endpoint or '<unmatched>'
+        if response.is_streamed:
+            # The body, and its queries, are produced after this; they
+            # are recorded once it has been sent. Its headers are gone by
+            # then, so streamed responses carry no statement count.
+            response.call_on_close(lambda: self._observe(endpoint, stats))
+            return
+        self._observe(endpoint, stats)
+        response.headers[HEADER] = str(stats.queries)
+
+    def _observe(self, endpoint, stats):
+        elapsed = time.perf_counter() - stats.started
+        metrics = self.endpoints.get(endpoint)
+        if metrics is None:
+            with self._lock:
+                metrics = self.endpoints.setdefault(endpoint,
+                                                    EndpointMetrics())
+        metrics.observe(elapsed, stats)
+
+    def _render_started(self, sender, template, context, **extra):
+        stats = _stats()
+        if stats is not None:
+            stats.template_started = time.perf_counter()
+
+    def _render_finished(self, sender, template, context, **extra):
+        stats = _stats()
+        if stats is not None and stats.template_started is not None:
+            stats.template += time.perf_counter() - stats.template_started
+            stats.template_started = None
+
+    def _hashed(self, sender, seconds, **extra):
+        stats = _stats()
+        if stats is not None:
+            stats.bcrypt += seconds
+
+    # queries
+
+    def _query_started(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _query_finished(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        stats = _stats()
+        if stats is not None:
+            # An executemany is one round trip, and counts as one.
+            stats.queries += 1
+            stats.db += elapsed
+        if elapsed >= self.threshold and random.random() < self.sample_rate:
+            self._log_slow_query(statement, elapsed)
+
+    def _query_failed(self, context):
+        if context.connection is not None and context.cursor is not None:
+            started = context.connection.info.get('query_started')
+            if started:
+                started.pop()
+
+    def _log_slow_query(self, statement, elapsed):
+        sql = normalize_sql(statement)
+        context = _request_ctx_stack.top
+        endpoint = context.request.endpoint if context is not None else None
+        with self._lock:
+            self.slow_query_count += 1
+            self.slow_queries.append({
+                'sql': sql,
+                'seconds': elapsed,
+                'endpoint': endpoint,
+                'at': time.time(),
+            })
+        logger.warning('slow query (%.3fs, %s): %s', elapsed, endpoint, sql)
+
+    # exposition
+
+    def render(self):
+        """Returns the metrics in the Prometheus text format."""
+        lines = []
+        endpoints = sorted(self.endpoints.items())
+        name = PREFIX + 'request_duration_seconds'
+        lines.append('# HELP {} Request latency by endpoint.'.format(name))
+        lines.append('# TYPE {} histogram'.format(name))
+        for endpoint, metrics in endpoints:
+            lines.extend(_histogram(name, endpoint, metrics.latency))
+        name = PREFIX + 'request_queries'
+        lines.append('# HELP {} SQL statements per request.'.format(name))
+        lines.append('# TYPE {} histogram'.format(name))
+        for endpoint, metrics in endpoints:
+            lines.extend(_histogram(name, endpoint, metrics.queries))
+        name = PREFIX + 'request_phase_seconds_total'
+        lines.append('# HELP {} Request time spent in the database, bcrypt '
+                     'and template rendering.'.format(name))
+        lines.append('# TYPE {} counter'.format(name))
+        for endpoint, metrics in endpoints:
+            for phase in PHASES:
+                lines.append('{}{{endpoint="{}",phase="{}"}} {}'.format(
+                    name, _label(endpoint), phase,
+                    _format(metrics.phases[phase])))
+        name = PREFIX + 'slow_queries_total'
+        lines.append('# HELP {} Queries slower than the slow query '
+                     'threshold.'.format(name))
+        lines.append('# TYPE {} counter'.format(name))
+        lines.append('{} {}'.format(name, self.slow_query_count))
+        return lines
+
+
+def _histogram(name, endpoint, histogram):
+    endpoint = _label(endpoint)
+    for bound, count in histogram.cumulative():
+        yield '{}_bucket{{endpoint="{}",le="{}"}} {}'.format(
+            name, endpoint, _format(bound), count)
+    yield '{}_sum{{endpoint="{}"}} {}'.format(
+        name, endpoint, _format(histogram.sum))
+    yield '{}_count{{endpoint="{}"}} {}'.format(
+        name, endpoint, histogram.count)
+
+
+##################
+#### overhead ####
+##################
+
+def measure_overhead(app, requests=10000):
+    """Returns the seconds the hooks add to a request that runs one query,
+    averaged over `requests` calls on a private `Instrumentation`."""
+    instrumentation = Instrumentation(listen=False)
+
+    class Response(object):
+        headers = {}
+        is_streamed = False
+
+    class Connection(object):
+        info = {}
+
+    response, connection = Response(), Connection()
+    with app.test_request_context('/'):
+        started = time.perf_counter()
+        for _ in range(requests):
+            instrumentation._request_started(app)
+            instrumentation._query_started(connection, None, '', (), None,
+                                           False)
+            instrumentation._query_finished(connection, None, '', (), None,
+                                            False)
+            instrumentation._request_finished(app, response)
+        return (time.perf_counter() - started) / requests
+
+
+#############
+#### top ####
+#############
+
+_sample = re.compile(r'^(\w+)(?:\{(.*)\})?\s+(\S+)$')
+_label_pair = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_metrics(text):
+    """Parses Prometheus text into `{(name, labels): value}`, with
+    `labels` a sorted tuple of pairs."""
+    samples = {}
+    for line in text.splitlines():
+        match = _sample.match(line.strip())
+        if match is None:
+            continue
+        name, labels, value = match.groups()
+        labels = tuple(sorted(_label_pair.findall(labels or '')))
+        samples[name, labels] = float(value)
+    return samples
+
+
+def top_rows(before, after, seconds):
+    """Per-endpoint request rate, mean and p95 latency, queries per request
+    and phase shares between two `parse_metrics` results."""
+    def delta(name, **labels):
+        key = (PREFIX + name, tuple(sorted(labels.items())))
+        return after.get(key, 0.0) - before.get(key, 0.0)
+
+    endpoints = set(dict(labels)['endpoint'] for name, labels in after
+                    if name == PREFIX + 'request_duration_seconds_count')
+    rows = []
+    for endpoint in endpoints:
+        count = delta('request_duration_seconds_count', endpoint=endpoint)
+        if not count:
+            continue
+        total = delta('request_duration_seconds_sum', endpoint=endpoint)
+        buckets = sorted(
+            (float(dict(labels)['le']), after[name, labels] -
+             before.get((name, labels), 0.0))
+            for name, labels in after
+            if name == PREFIX + 'request_duration_seconds_bucket' and
+            dict(labels)['endpoint'] == endpoint)
+        p95 = next((bound for bound, seen in buckets
+                    if seen >= 0.95 * count), float('inf'))
+        row = {
+            'endpoint': endpoint,
+            'rate': count / seconds,
+            'mean': total / count,
+            'p95': p95,
+            'queries': delta('request_queries_sum',
+                             endpoint=endpoint) / count,
+        }
+        for phase in PHASES:
+            spent = delta('request_phase_seconds_total', endpoint=endpoint,
+                          phase=phase)
+            row[phase] = spent / total if total else 0.0
+        rows.append(row)
+    rows.sort(key=lambda row: (-row['rate'], row['endpoint']))
+    return rows
+
+
+def format_top(rows):
+    lines = ['{:<32} {:>8} {:>9} {:>9} {:>8} {:>5} {:>7} {:>9}'.format(
+        'endpoint', 'req/s', 'mean ms', 'p95 ms', 'queries', 'db%',
+        'bcrypt%', 'template%')]
+    for row in rows:
+        lines.append(
+            '{:<32} {:>8.1f} {:>9.2f} {:>9} {:>8.1f} {:>5.0f} {:>7.0f} '
+            '{:>9.0f}'.format(
+                row['endpoint'][:32], row['rate'], row['mean'] * 1000,
+                '>10000' if row['p95'] == float('inf')
+                else '{:.1f}'.format(row['p95'] * 1000),
+                row['queries'], row['db'] * 100, row['bcrypt'] * 100,
+                row['template'] * 100))
+    return '\n'.join(lines)
@@ -0,0 +1 @@
+# project/server/inventory/__init__.py
@@ -0,0 +1,290 @@
+# project/server/inventory/bulk.py
+
+
+#################
+#### imports ####
+#################
+
+from collections import Counter
+
+from sqlalchemy import and_, func, inspect, select
+
+from project.server import db, versioning
+from project.server.analytics import changes
+from project.server.inventory import lookup, rollups, transfers, valuation
+from project.server.models import Inventory, Product, Rating, \
+    SessionInventory, Transfer
+from project.server.search.index import mark_removed
+
+
+################
+#### config ####
+################
+
+# Ids per statement; keeps under SQLite's bind limit.
+BATCH = transfers.MOVE_BATCH
+
+cigars = Inventory.__table__
+products = Product.__table__
+ratings = Rating.__table__
+moves = Transfer.__table__
+smoked = SessionInventory.__table__
+
+
+#################
+#### helpers ####
+#################
+
+def _chunks(ids):
+    ordered = sorted(set(int(id) for id in ids))
+    for start in range(0, len(ordered), BATCH):
+        yield ordered[start:start + BATCH]
+
+
+def _loaded(session, model, column, ids):
+    """The objects of `model` in `session` whose `column` is one of `ids`,
+    judged by what is loaded so nothing is fetched."""
+    for target in list(session.identity_map.values()):
+        if not isinstance(target, model):
+            continue
+        state = inspect(target)
+        if column == 'id':
+            value = state.identity[0]
+        else:
+            value = state.dict.get(column)
+        if value in ids:
+            yield target
+
+
+################
+#### cigars ####
+################
+
+def move(ids, location, when=None):
+    """Moves the cigars with `ids` to `location`; see
+    `transfers.move_cigar_ids`."""
+    return transfers.move_cigar_ids(ids, location, when)
+
+
+def resize(ids, size):
+    """Sets the size of the cigars with `ids` in the current session.
+
+    Each batch is one SELECT for the rollup counts, one INSERT queueing
+    the rated products for the recommendations and one UPDATE; cigars
+    already that size are left alone. Returns the number changed.
+    """
+    session = db.session()
+    connection = session.connection()
+    deltas = Counter()
+    worths = Counter()
+    hashes = set()
+    ids = list(_chunks(ids))
+    for batch in ids:
+        other = and_(cigars.c.id.in_(batch),
+                     func.coalesce(cigars.c.size, -1) != size)
+        for hash, old, price in connection.execute(
+                select([cigars.c.hash, cigars.c.size,
+                        cigars.c.purchase_price]).where(other)):
+            deltas['size', old] -= 1
+            deltas['size', size] += 1
+            worths['size', old] -= rollups.price(price)
+            worths['size', size] += rollups.price(price)
+            hashes.add(hash)
+        changes.queue_rated(connection, other)
+        connection.execute(cigars.update().where(other)
+                           .values(size=size, change=None))
+    if not hashes:
+        return 0
+
+    rollups.apply_deltas(connection, deltas, worths)
+    versioning.bump(connection, 'cigars', changes.RATED)
+    lookup.mark_stale(session, hashes)
+    changed = set(id for batch in ids for id in batch)
+    for target in _loaded(session, Inventory, 'id', changed):
+        session.expire(target, ['size', 'change'])
+    return len(hashes)
+
+
+def delete_cigars(ids):
+    """Deletes the cigars with `ids` in the current session.
+
+    Like a session delete, their ratings, transfers and smoking sessions
+    are kept with the cigar unset, and the rollups and valuations lose
+    what the cigars contributed. Each batch is a fixed eight statements.
+    Returns the number deleted.
+    """
+    session = db.session()
+    connection = session.connection()
+    deltas = Counter()
+    worths = Counter()
+    values = {}
+    hashes = set()
+    deleted = set()
+    for batch in _chunks(ids):
+        rows = connection.execute(
+            select([cigars.c.id, cigars.c.hash, cigars.c.location,
+                    cigars.c.size, products.c.brand,
+                    cigars.c.purchase_date, cigars.c.purchase_price])
+            .select_from(cigars.outerjoin(
+                products, products.c.id == cigars.c.product))
+            .where(cigars.c.id.in_(batch))).fetchall()
+        if not rows:
+            continue
+        history = {}
+        for cigar, when, source, target in connection.execute(
+                select([moves.c.cigar, moves.c.moved_on, moves.c['from'],
+                        moves.c.to])
+                .where(moves.c.cigar.in_(batch))
+                .order_by(moves.c.cigar, moves.c.moved_on, moves.c.id)):
+            history.setdefault(cigar, []).append((when, source, target))
+        for id, hash, location, size, brand, purchased, price in rows:
+            for key in (('location', location), ('brand', brand),
+                        ('size', size)):
+                deltas[key] -= 1
+                worths[key] -= rollups.price(price)
+            valuation.add_cigar(values, -1, brand, location, purchased,
+                                price, history.get(id, ()))
+            hashes.add(hash)
+            deleted.add(id)
+
+        changes.queue_rated(connection, cigars.c.id.in_(batch))
+        connection.execute(ratings.update()
+                           .where(ratings.c.cigar.in_(batch))
+                           .values(cigar=None, change=None))
+        connection.execute(moves.update().where(moves.c.cigar.in_(batch))
+                           .values(cigar=None))
+        connection.execute(smoked.update().where(smoked.c.cigar.in_(batch))
+                           .values(cigar=None))
+        versioning.record_deletes(connection, cigars,
+                                  cigars.c.id.in_(batch))
+        connection.execute(cigars.delete().where(cigars.c.id.in_(batch)))
+    if not deleted:
+        return 0
+
+    rollups.apply_deltas(connection, deltas, worths)
+    valuation.apply_deltas(connection, values)
+    versioning.bump(connection, 'cigars', changes.RATED, 'ratings',
+                    'transfers', 'session_inventory',
+                    versioning.deletes.name)
+    lookup.mark_stale(session, hashes)
+    for target in _loaded(session, Inventory, 'id', deleted):
+        session.expunge(target)
+    for model in (Rating, Transfer, SessionInventory):
+        for target in _loaded(session, model, 'cigar', deleted):
+            session.expire(target)
+    return len(deleted)
+
+
+##################
+#### products ####
+##################
+
+def delete_products(ids):
+    """Deletes the products with `ids` in the current session.
+
+    Their cigars are kept with the product unset, so their brand counts
+    and valuations move to no brand. Each batch is a fixed four
+    statements. Returns the number deleted.
+    """
+    session = db.session()
+    connection = session.connection()
+    deltas = Counter()
+    worths = Counter()
+    values = {}
+    hashes = set()
+    deleted = 0
+    removed = set()
+    for batch in _chunks(ids):
+        for brand, hash, purchased, price in connection.execute(
+                select([products.c.brand, cigars.c.hash,
+                        cigars.c.purchase_date, cigars.c.purchase_price])
+                .select_from(cigars.join(
+                    products, products.c.id == cigars.c.product))
+                .where(cigars.c.product.in_(batch))):
+            deltas['brand', brand] -= 1
+            deltas['brand', None] += 1
+            worths['brand', brand] -= rollups.price(price)
+            worths['brand', None] += rollups.price(price)
+            if purchased is not None and price is not None:
+                valuation.add(values, 'brand', brand, purchased, -price, -1,
+                              -price)
+                valuation.add(values, 'brand', None, purchased, price, 1,
+                              price)
+            hashes.add(hash)
+        connection.execute(cigars.update()
+                           .where(cigars.c.product.in_(batch))
+                           .values(product=None, change=None))
+        versioning.record_deletes(connection, products,
+                                  products.c.id.in_(batch))
+        deleted += connection.execute(
+            products.delete().where(products.c.id.in_(batch))).rowcount
+        removed.update(batch)
+    if not deleted:
+        return 0
+
+    rollups.apply_deltas(connection, deltas, worths)
+    valuation.apply_deltas(connection, values)
+    versioning.bump(connection, 'cigars', changes.RATED, 'products',
+                    versioning.deletes.name)
+    changes.queue_products(connection, removed)
+    lookup.mark_stale(session, hashes)
+    # Ids that matched nothing aren't in the index; removing them is a
+    # no-op.
+    mark_removed(session, Product, removed)
+    for target in _loaded(session, Product, 'id', removed):
+        session.expunge(target)
+    for target in _loaded(session, Inventory, 'product', removed):
+        session.expire(target, ['product', 'change'])
+    return deleted
+
+
+#################
+#### ratings ####
+#################
+
+def rerate(ids, score):
+    """Sets the overall score of the ratings with `ids`, one INSERT
+    queueing their products for the recommendations and one UPDATE per
+    batch. Returns the number changed."""
+    session = db.session()
+    connection = session.connection()
+    changed = 0
+    ids = list(_chunks(ids))
+    for batch in ids:
+        other = and_(ratings.c.id.in_(batch),
+                     func.coalesce(ratings.c.overall_score, -1) != score)
+        changes.queue_rated(connection, rating_where=other)
+        changed += connection.execute(
+            ratings.update().where(other)
+            .values(overall_score=score, change=None)).rowcount
+    if not changed:
+        return 0
+
+    versioning.bump(connection, 'ratings')
+    rated = set(id for batch in ids for id in batch)
+    for target in _loaded(session, Rating, 'id', rated):
+        session.expire(target, ['overall_score', 'change'])
+    return changed
+
+
+def delete_ratings(ids):
+    """Deletes the ratings with `ids`, three statements per batch.
+    Returns the number deleted."""
+    session = db.session()
+    connection = session.connection()
+    deleted = 0
+    removed = set()
+    for batch in _chunks(ids):
+        changes.queue_rated(connection, rating_where=ratings.c.id.in_(batch))
+        versioning.record_deletes(connection, ratings,
+                                  ratings.c.id.in_(batch))
+        deleted += connection.execute(
+            ratings.delete().where(ratings.c.id.in_(batch))).rowcount
+        removed.update(batch)
+    if not deleted:
+        return 0
+
+    versioning.bump(connection, 'ratings', versioning.deletes.name)
+    for target in _loaded(session, Rating, 'id', removed):
+        session.expunge(target)
+    return deleted
@@ -0,0 +1,160 @@
+# project/server/inventory/lookup.py
+
+
+#################
+#### imports ####
+#################
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import object_session
+
+from project.server import db
+from project.server.cache import LRUCache
+from project.server.models import Brand, Inventory, Location, Product, Size
+from project.server.sqltypes import is_hex
+
+
+################
+#### config ####
+################
+
+# Cached in place of a record for hashes that are not in the collection,
+# so repeated scans of an unknown barcode don't reach the database either.
+MISSING = object()
+
+# Sized by `configure` when the inventory blueprint is registered.
+cache = LRUCache(maxsize=10000)
+
+cigars = Inventory.__table__
+
+
+def configure(app):
+    cache.maxsize = app.config.get('CIGAR_LOOKUP_CACHE_SIZE', 10000)
+    cache.ttl = app.config.get('CIGAR_LOOKUP_CACHE_TTL')
+
+
+################
+#### lookup ####
+################
+
+def normalize_hash(value):
+    return value.strip().lower()
+
+
+def is_hash(value):
+    """True if `value`, normalized, fits `cigars.hash`."""
+    return is_hex(value, Inventory.hash.type.length)
+
+
+def _query(hash):
+    row = db.session.query(
+        Inventory.id, Inventory.hash,
+        Product.id, Product.name,
+        Brand.id, Brand.name,
+        Size.id, Size.name,
+        Location.id, Location.name,
+    ).outerjoin(Product, Product.id == Inventory.product) \
+        .outerjoin(Brand, Brand.id == Product.brand) \
+        .outerjoin(Size, Size.id == Inventory.size) \
+        .outerjoin(Location, Location.id == Inventory.location) \
+        .filter(Inventory.hash == hash) \
+        .first()
+    if row is None:
+        return None
+
+    def named(id, name):
+        return None if id is None else {'id': id, 'name': name}
+
+    return {
+        'id': row[0],
+        'hash': row[1],
+        'product': named(row[2], row[3]),
+        'brand': named(row[4], row[5]),
+        'size': named(row[6], row[7]),
+        'location': named(row[8], row[9]),
+    }
+
+
+def find_cigar(hash):
+    """Returns the denormalized record for `hash`, or None if unknown.
+
+    Hits are served from the in-process LRU; misses cost one joined query
+    on the unique `cigars.hash` index. Strings that can't be a hash are
+    answered without either.
+    """
+    hash = normalize_hash(hash)
+    if not is_hash(hash):
+        return None
+    record = cache.get(hash)
+    if record is None:
+        record = _query(hash) or MISSING
+        cache.set(hash, record)
+    return None if record is MISSING else record
+
+
+######################
+#### invalidation ####
+######################
+
+def mark_stale(session, hashes):
+    """Evicts `hashes` once `session` commits; for writes that bypass the
+    ORM events below."""
+    session.info.setdefault('stale_cigar_hashes', set()) \
+        .update(normalize_hash(hash) for hash in hashes)
+
+
+def _stale(target):
+    session = object_session(target)
+    if session is not None:
+        return session.info.setdefault('stale_cigar_hashes', set())
+    return set()
+
+
+@event.listens_for(Inventory, 'after_insert')
+@event.listens_for(Inventory, 'before_update')
+@event.listens_for(Inventory, 'before_delete')
+def _inventory_changed(mapper, connection, target):
+    stale = _stale(target)
+    state = inspect(target)
+    history = state.attrs.hash.history
+    hashes = list(history.sum())
+    if state.key is not None and not (history.deleted or history.unchanged):
+        # `hash` was never loaded, or set without loading it; the row,
+        # not yet written, still has the one cached.
+        hashes.append(connection.execute(
+            select([cigars.c.hash])
+            .where(cigars.c.id == state.identity[0])).scalar())
+    for value in hashes:
+        if value:
+            stale.add(normalize_hash(value))
+
+
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Brand, 'after_update')
+@event.listens_for(Size, 'after_update')
+@event.listens_for(Location, 'after_update')
+@event.listens_for(Product, 'after_delete')
+@event.listens_for(Brand, 'after_delete')
+@event.listens_for(Size, 'after_delete')
+@event.listens_for(Location, 'after_delete')
+def _names_changed(mapper, connection, target):
+    # Renames touch every cached record that embeds them.
+    _stale(target).add(None)
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _evict(session):
+    stale = session.info.pop('stale_cigar_hashes', None)
+    if not stale:
+        return
+    if None in stale:
+        cache.clear()
+        return
+    for hash in stale:
+        cache.delete(hash)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _forget(session):
+    session.info.pop('stale_cigar_hashes', None)
@@ -0,0 +1,202 @@
+# project/server/inventory/rollups.py
+
+
+#################
+#### imports ####
+#################
+
+import decimal
+from collections import Counter
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import and_, event, func, inspect, literal, select
+
+from project.server import db
+from project.server.models import Brand, Inventory, InventoryRollup, \
+    Location, Product, Size
+
+
+################
+#### config ####
+################
+
+DIMENSIONS = {
+    'location': Location,
+    'brand': Brand,
+    'size': Size,
+}
+
+ZERO = decimal.Decimal('0.00')
+
+rollups = InventoryRollup.__table__
+cigars = Inventory.__table__
+products = Product.__table__
+
+
+#################
+#### updates ####
+#################
+
+def price(value):
+    """A purchase price as a `Decimal`; 0 for unpriced cigars."""
+    return decimal.Decimal(str(value)) if value is not None else ZERO
+
+
+def apply_deltas(connection, deltas, values=None):
+    """Adds `deltas` and `values`, mappings of `(dimension, key)` to a
+    count and a value change, to the rollup rows; one UPDATE per key,
+    plus an INSERT for new keys."""
+    values = values or {}
+    for dimension, key in sorted(set(deltas) | set(values), key=str):
+        delta = deltas.get((dimension, key), 0)
+        worth = values.get((dimension, key), ZERO)
+        if not delta and not worth:
+            continue
+        if key is None:
+            matches_key = rollups.c.key.is_(None)
+        else:
+            matches_key = rollups.c.key == key
+        where = and_(rollups.c.dimension == dimension, matches_key)
+        result = connection.execute(
+            rollups.update().where(where)
+            .values(count=rollups.c.count + delta,
+                    value=rollups.c.value + worth)
+        )
+        if not result.rowcount:
+            connection.execute(
+                rollups.insert().values(dimension=dimension, key=key,
+                                        count=delta, value=worth)
+            )
+
+
+def brands_of(session, product_ids):
+    """Maps each of `product_ids` to its brand, without flushing."""
+    product_ids = set(p for p in product_ids if p is not None)
+    if not product_ids:
+        return {}
+    with session.no_autoflush:
+        return dict(session.query(Product.id, Product.brand)
+                    .filter(Product.id.in_(product_ids)).all())
+
+
+def column_values(session, target, current,
+                  names=('location', 'product', 'size', 'purchase_price')):
+    """Returns the `names` attributes of `target` as it is about to be
+    flushed (`current`) or as it was last committed."""
+    state = inspect(target)
+    values = []
+    for name in names:
+        history = state.attrs[name].history
+        if current and history.added:
+            value = history.added[0]
+        elif not current and history.deleted:
+            value = history.deleted[0]
+        elif history.unchanged:
+            value = history.unchanged[0]
+        elif state.key is not None:
+            # Never loaded, so the database still holds the old value.
+            with session.no_autoflush:
+                value = session.query(getattr(Inventory, name)) \
+                    .filter(Inventory.id == state.identity[0]).scalar()
+        else:
+            value = None
+        values.append(value)
+    return values
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def _collect(session, flush_context, instances):
+    changes = []
+    for target in session.new:
+        if isinstance(target, Inventory):
+            changes.append((column_values(session, target, True), 1))
+    for target in session.deleted:
+        if isinstance(target, Inventory):
+            changes.append((column_values(session, target, False), -1))
+    moved_products = []
+    for target in session.dirty:
+        if isinstance(target, Inventory) and session.is_modified(target):
+            old = column_values(session, target, False)
+            new = column_values(session, target, True)
+            if old != new:
+                changes.append((old, -1))
+                changes.append((new, 1))
+        elif isinstance(target, Product) and \
+                inspect(target).attrs.brand.history.has_changes():
+            moved_products.append(target)
+    if not changes and not moved_products:
+        return
+
+    brands = brands_of(session, [values[1] for values, _ in changes])
+    deltas = session.info.setdefault('rollup_deltas', Counter())
+    values = session.info.setdefault('rollup_values', Counter())
+    for (location, product, size, cost), sign in changes:
+        for key in (('location', location),
+                    ('brand', brands.get(product)), ('size', size)):
+            deltas[key] += sign
+            values[key] += sign * price(cost)
+
+    for target in moved_products:
+        history = inspect(target).attrs.brand.history
+        with session.no_autoflush:
+            count, worth = session.query(
+                func.count(Inventory.id),
+                func.sum(Inventory.purchase_price)) \
+                .filter(Inventory.product == target.id).one()
+        for brand in history.deleted or ():
+            deltas['brand', brand] -= count
+            values['brand', brand] -= price(worth)
+        for brand in history.added or ():
+            deltas['brand', brand] += count
+            values['brand', brand] += price(worth)
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _apply(session, flush_context):
+    deltas = session.info.pop('rollup_deltas', None)
+    values = session.info.pop('rollup_values', None)
+    if deltas or values:
+        apply_deltas(session.connection(), deltas or {}, values)
+
+
+###################
+#### recompute ####
+###################
+
+def rebuild(connection):
+    """Recomputes every rollup row from `cigars` with set-based
+    INSERT ... SELECTs."""
+    connection.execute(rollups.delete())
+    sources = (
+        ('location', cigars.c.location, cigars),
+        ('brand', products.c.brand,
+         cigars.outerjoin(products, products.c.id == cigars.c.product)),
+        ('size', cigars.c.size, cigars),
+    )
+    for dimension, key, source in sources:
+        connection.execute(rollups.insert().from_select(
+            ['dimension', 'key', 'count', 'value'],
+            select([literal(dimension), key, func.count(cigars.c.id),
+                    func.coalesce(func.sum(cigars.c.purchase_price), 0)])
+            .select_from(source)
+            .group_by(key)
+        ))
+
+
+##############
+#### read ####
+##############
+
+def counts(dimension):
+    """Returns the cigar count and their total purchase value per key of
+    `dimension`, read straight from the rollups."""
+    model = DIMENSIONS[dimension]
+    rows = db.session.query(InventoryRollup.key, model.name,
+                            InventoryRollup.count, InventoryRollup.value) \
+        .outerjoin(model, model.id == InventoryRollup.key) \
+        .filter(InventoryRollup.dimension == dimension) \
+        .filter(InventoryRollup.count != 0) \
+        .order_by(InventoryRollup.count.desc(), InventoryRollup.key) \
+        .all()
+    return [{'id': key, 'name': name, 'count': count, 'value': float(value)}
+            for key, name, count, value in rows]
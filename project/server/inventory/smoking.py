@@ -0,0 +1,133 @@
+# project/server/inventory/smoking.py
+
+
+#################
+#### imports ####
+#################
+
+import datetime
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import literal, select
+
+from project.server import db, versioning
+from project.server.inventory import lookup, transfers
+from project.server.models import Inventory, Location, Rating, \
+    SessionInventory, SmokingSession
+
+
+################
+#### config ####
+################
+
+RATING_FIELDS = (
+    'app_notes', 'app_score', 'smoke_notes', 'smoke_score',
+    'taste_notes', 'taste_score', 'overall_notes', 'overall_score',
+)
+
+cigars = Inventory.__table__
+locations = Location.__table__
+sessions = SmokingSession.__table__
+session_inventory = SessionInventory.__table__
+ratings_table = Rating.__table__
+
+SessionResult = namedtuple('SessionResult', 'session cigars ratings')
+
+
+################
+#### errors ####
+################
+
+class UnknownCigars(Exception):
+    """Raised, before anything is written, for hashes not in `cigars`."""
+
+    def __init__(self, hashes):
+        super(UnknownCigars, self).__init__(
+            'Unknown cigars: {}.'.format(', '.join(hashes)))
+        self.hashes = hashes
+
+
+#################
+#### helpers ####
+#################
+
+def _batches(values):
+    for start in range(0, len(values), transfers.MOVE_BATCH):
+        yield values[start:start + transfers.MOVE_BATCH]
+
+
+def _smoked_location(connection):
+    name = current_app.config.get('SMOKED_LOCATION', 'Smoked')
+    location = connection.execute(
+        select([locations.c.id]).where(locations.c.name == name)
+        .order_by(locations.c.id).limit(1)).scalar()
+    if location is None:
+        location = connection.execute(locations.insert().values(name=name)) \
+            .inserted_primary_key[0]
+        versioning.bump(connection, 'locations')
+    return location
+
+
+def _rating_rows(ratings, ids):
+    rows = []
+    for hash, fields in sorted(ratings.items()):
+        unknown = set(fields) - set(RATING_FIELDS)
+        if unknown:
+            raise ValueError('Unknown rating fields: {}.'.format(
+                ', '.join(sorted(unknown))))
+        row = dict((name, fields.get(name)) for name in RATING_FIELDS)
+        row['cigar'] = ids[hash]
+        rows.append(row)
+    return rows
+
+
+###############
+#### write ####
+###############
+
+def record_session(hashes, date=None, ratings=None):
+    """Records a smoking session in the current transaction.
+
+    Creates the session, links the cigars in `hashes` to it, moves them to
+    the smoked location and inserts `ratings`, a mapping of hash to rating
+    fields; rated cigars are part of the session too. Every step is one
+    set-based statement per `transfers.MOVE_BATCH` hashes, so the round
+    trips don't grow with the size of the session. The caller commits.
+    """
+    ratings = dict((lookup.normalize_hash(hash), fields)
+                   for hash, fields in (ratings or {}).items())
+    hashes = sorted(set(lookup.normalize_hash(hash) for hash in hashes)
+                    .union(ratings))
+    if not hashes:
+        raise ValueError('A session needs at least one cigar.')
+    date = date or datetime.datetime.now()
+    connection = db.session.connection()
+
+    ids = {}
+    for batch in _batches([hash for hash in hashes if lookup.is_hash(hash)]):
+        ids.update((hash, id) for id, hash in connection.execute(
+            select([cigars.c.id, cigars.c.hash])
+            .where(cigars.c.hash.in_(batch))))
+    unknown = sorted(set(hashes) - set(ids))
+    if unknown:
+        raise UnknownCigars(unknown)
+    rows = _rating_rows(ratings, ids)
+
+    session = connection.execute(sessions.insert().values(date=date)) \
+        .inserted_primary_key[0]
+    for batch in _batches(sorted(ids.values())):
+        connection.execute(session_inventory.insert().from_select(
+            ['session', 'cigar'],
+            select([literal(session, type_=session_inventory.c.session.type),
+                    cigars.c.id])
+            .where(cigars.c.id.in_(batch))
+        ))
+    transfers.move_cigars(hashes, _smoked_location(connection), when=date)
+    if rows:
+        for row in rows:
+            row['session'] = session
+        connection.execute(ratings_table.insert(), rows)
+    versioning.bump(connection, 'sessions', 'session_inventory',
+                    *(['ratings'] if rows else []))
+    return SessionResult(session, len(hashes), len(rows))
@@ -0,0 +1,380 @@
+# project/server/inventory/transfers.py
+
+
+#################
+#### imports ####
+#################
+
+import datetime
+from collections import Counter
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import and_, case, event, exists, func, inspect, literal, \
+    or_, select
+
+from project.server import db, versioning
+from project.server.inventory import lookup, rollups, valuation
+from project.server.models import Inventory, LocationSnapshot, \
+    LocationSnapshotEntry, Transfer
+
+
+################
+#### config ####
+################
+
+# Hashes per statement in a bulk move; keeps under SQLite's bind limit.
+MOVE_BATCH = 500
+
+cigars = Inventory.__table__
+transfers = Transfer.__table__
+snapshots = LocationSnapshot.__table__
+entries = LocationSnapshotEntry.__table__
+
+
+##############
+#### move ####
+##############
+
+def move_cigars(hashes, location, when=None):
+    """Moves the cigars in `hashes` to `location` in the current session.
+
+    Each batch is two SELECTs of what moves, one INSERT ... SELECT into
+    the transfer log and one UPDATE of `cigars`; cigars already there are
+    left alone. Returns the number of cigars moved.
+    """
+    hashes = set(lookup.normalize_hash(hash) for hash in hashes)
+    # Strings that can't be a hash match no cigar.
+    hashes = set(hash for hash in hashes if lookup.is_hash(hash))
+    return _move(cigars.c.hash, sorted(hashes), hashes, location, when)
+
+
+def move_cigar_ids(ids, location, when=None):
+    """Moves the cigars with `ids` to `location`, as `move_cigars`."""
+    return _move(cigars.c.id, sorted(set(int(id) for id in ids)), set(),
+                 location, when)
+
+
+def _move(key, ordered, hashes, location, when):
+    # `hashes` collects the hashes of the cigars moved when `key` isn't
+    # the hash itself; `ids` their ids either way.
+    when = when or datetime.datetime.now()
+    session = db.session()
+    connection = session.connection()
+    moved = 0
+    ids = set()
+    deltas = Counter()
+    worths = Counter()
+    values = {}
+    # What the moving cigars were bought for, if they're valued at all.
+    value = func.sum(case([(cigars.c.purchase_date.isnot(None),
+                            cigars.c.purchase_price)]))
+    for start in range(0, len(ordered), MOVE_BATCH):
+        batch = ordered[start:start + MOVE_BATCH]
+        elsewhere = and_(
+            key.in_(batch),
+            func.coalesce(cigars.c.location, -1) != location,
+        )
+        for source, count, worth, priced in connection.execute(
+                select([cigars.c.location, func.count(cigars.c.id), value,
+                        func.sum(cigars.c.purchase_price)])
+                .where(elsewhere).group_by(cigars.c.location)):
+            deltas['location', source] -= count
+            deltas['location', location] += count
+            worths['location', source] -= rollups.price(priced)
+            worths['location', location] += rollups.price(priced)
+            moved += count
+            if worth is not None:
+                valuation.add(values, 'location', source, when, value=-worth)
+                valuation.add(values, 'location', location, when,
+                              value=worth)
+        for id, hash in connection.execute(
+                select([cigars.c.id, cigars.c.hash]).where(elsewhere)):
+            ids.add(id)
+            if hash:
+                hashes.add(hash)
+        connection.execute(transfers.insert().from_select(
+            ['cigar', 'from', 'to', 'moved_on'],
+            select([cigars.c.id, cigars.c.location,
+                    literal(location, type_=transfers.c.to.type),
+                    literal(when, type_=transfers.c.moved_on.type)])
+            .where(elsewhere)
+        ))
+        connection.execute(cigars.update().where(elsewhere)
+                           .values(location=location, change=None))
+    if not moved:
+        return 0
+
+    rollups.apply_deltas(connection, deltas, worths)
+    valuation.apply_deltas(connection, values)
+    versioning.bump(connection, 'cigars', 'transfers')
+    lookup.mark_stale(session, hashes)
+    # Matched by identity, which reading an expired attribute would load.
+    for target in list(session.identity_map.values()):
+        if isinstance(target, Inventory) and \
+                inspect(target).identity[0] in ids:
+            session.expire(target, ['location', 'change'])
+    return moved
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def _log_moves(session, flush_context, instances):
+    # Keeps the log complete when a location is edited through the ORM,
+    # e.g. in the admin.
+    for target in list(session.dirty):
+        if not isinstance(target, Inventory):
+            continue
+        state = inspect(target)
+        history = state.attrs.location.history
+        if not history.added:
+            continue
+        if history.deleted:
+            source = history.deleted[0]
+        else:
+            with session.no_autoflush:
+                source = session.query(Inventory.location) \
+                    .filter(Inventory.id == state.identity[0]).scalar()
+        if source != history.added[0]:
+            session.add(Transfer(cigar=state.identity[0],
+                                 from_location=source,
+                                 to_location=history.added[0]))
+
+
+###################
+#### snapshots ####
+###################
+
+def _since_snapshot(connection):
+    last = connection.execute(select([func.max(snapshots.c.transfer)])) \
+        .scalar() or 0
+    return connection.execute(
+        select([func.count(transfers.c.id)])
+        .where(transfers.c.id > last)).scalar()
+
+
+def _last(log, covered):
+    """Whether a row of `log` is its cigar's last among those matching
+    `covered(alias)`, by `moved_on` and then id."""
+    newer = transfers.alias('newer')
+    return ~exists().where(and_(
+        newer.c.cigar == log.c.cigar,
+        covered(newer),
+        or_(newer.c.moved_on > log.c.moved_on,
+            and_(newer.c.moved_on == log.c.moved_on,
+                 newer.c.id > log.c.id))))
+
+
+def take_snapshot(connection, keep=None):
+    """Compacts the log so far into a snapshot of where each cigar that
+    has moved ended up, then drops all but the newest `keep` snapshots.
+
+    An entry is the destination of the cigar's last transfer by
+    `moved_on`, and the snapshot is dated by the latest `moved_on` it
+    covers, so backdated moves land where they belong. Returns the new
+    snapshot id, or None if nothing has moved since the last one.
+    """
+    last, taken_on = connection.execute(
+        select([func.max(transfers.c.id), func.max(transfers.c.moved_on)])
+    ).first()
+    if last is None or not _since_snapshot(connection):
+        return None
+    snapshot = connection.execute(snapshots.insert().values(
+        transfer=last, taken_on=taken_on)).inserted_primary_key[0]
+
+    def covered(log):
+        return and_(log.c.id <= last, log.c.cigar.isnot(None))
+    connection.execute(entries.insert().from_select(
+        ['snapshot', 'cigar', 'location'],
+        select([literal(snapshot, type_=entries.c.snapshot.type),
+                transfers.c.cigar, transfers.c.to])
+        .where(covered(transfers))
+        .where(_last(transfers, covered))
+    ))
+    if keep:
+        old = [id for id, in connection.execute(
+            select([snapshots.c.id]).order_by(snapshots.c.id.desc())
+            .offset(keep))]
+        if old:
+            connection.execute(
+                entries.delete().where(entries.c.snapshot.in_(old)))
+            connection.execute(
+                snapshots.delete().where(snapshots.c.id.in_(old)))
+    versioning.bump(connection, 'location_snapshots')
+    return snapshot
+
+
+##############
+#### read ####
+##############
+
+def _held_at(when):
+    """Cigars that may have been held at `when`: those bought by then, or
+    whose purchase date is unknown."""
+    return or_(cigars.c.purchase_date.is_(None),
+               cigars.c.purchase_date <= when)
+
+
+def _snapshot_before(when):
+    """Returns the id, last transfer and date of the newest snapshot dated
+    at or before `when`, or `(None, 0, None)` if there is none."""
+    snapshot = db.session.query(LocationSnapshot.id,
+                                LocationSnapshot.transfer,
+                                LocationSnapshot.taken_on) \
+        .filter(LocationSnapshot.taken_on <= when) \
+        .order_by(LocationSnapshot.transfer.desc()).first()
+    return tuple(snapshot) if snapshot is not None else (None, 0, None)
+
+
+def _uncovered(snapshot_id, after, when):
+    """Returns the join of the cigars the snapshot doesn't cover, and
+    where each was at `when`: where it is now, or where its first
+    transfer after `when` took it from."""
+    first_later = transfers.alias('first_later')
+
+    def later(log):
+        return and_(log.c.moved_on > when, log.c.id > after)
+    source = cigars \
+        .outerjoin(entries, and_(entries.c.snapshot == snapshot_id,
+                                 entries.c.cigar == cigars.c.id)) \
+        .outerjoin(first_later, and_(
+            first_later.c.cigar == cigars.c.id,
+            later(first_later),
+            ~exists().where(and_(
+                transfers.c.cigar == first_later.c.cigar,
+                later(transfers),
+                or_(transfers.c.moved_on < first_later.c.moved_on,
+                    and_(transfers.c.moved_on == first_later.c.moved_on,
+                         transfers.c.id < first_later.c.id))))))
+    location = case([(first_later.c.id.is_(None), cigars.c.location)],
+                    else_=first_later.c['from'])
+    return source, location
+
+
+def _moved_since(after, when):
+    """Whether a cigar has a transfer logged after the snapshot and dated
+    by `when`."""
+    tail = transfers.alias('tail')
+    return exists().where(and_(tail.c.cigar == cigars.c.id,
+                               tail.c.id > after, tail.c.moved_on <= when))
+
+
+def locations_at(when):
+    """Returns `{hash: location}` for every cigar held as of `when`.
+
+    Starts from the newest snapshot dated at or before `when` and replays
+    only the transfers logged after it, in `moved_on` order.
+    """
+    snapshot_id, after, taken_on = _snapshot_before(when)
+
+    source, at = _uncovered(snapshot_id, after, when)
+    # Everything below is keyed by `cigars.id`; hashes are only put back
+    # on the way out.
+    hashes, state = {}, {}
+    for id, hash, current in db.session.execute(
+            select([cigars.c.id, cigars.c.hash, at])
+            .select_from(source)
+            .where(entries.c.id.is_(None))
+            .where(_held_at(when))):
+        hashes[id] = hash
+        state[id] = current
+
+    if snapshot_id is not None:
+        for id, hash, location in db.session.query(
+                LocationSnapshotEntry.cigar, Inventory.hash,
+                LocationSnapshotEntry.location) \
+                .join(Inventory, Inventory.id == LocationSnapshotEntry.cigar) \
+                .filter(LocationSnapshotEntry.snapshot == snapshot_id) \
+                .filter(_held_at(when)):
+            hashes[id] = hash
+            state[id] = location
+
+    # A transfer logged after the snapshot but dated before it may be
+    # older than the one its entry came from; those cigars are settled
+    # from their own log below.
+    backdated = set()
+    tail = db.session.query(Transfer.cigar, Transfer.to_location,
+                            Transfer.moved_on) \
+        .filter(Transfer.id > after) \
+        .filter(Transfer.moved_on <= when) \
+        .order_by(Transfer.moved_on, Transfer.id)
+    for id, location, moved_on in tail:
+        state[id] = location
+        if taken_on is not None and moved_on < taken_on:
+            backdated.add(id)
+    backdated = sorted(id for id in backdated if id is not None)
+    for start in range(0, len(backdated), MOVE_BATCH):
+        for id, location in db.session.query(
+                Transfer.cigar, Transfer.to_location) \
+                .filter(Transfer.cigar.in_(backdated[start:start +
+                                                     MOVE_BATCH])) \
+                .filter(Transfer.moved_on <= when) \
+                .order_by(Transfer.moved_on, Transfer.id):
+            state[id] = location
+    return dict((hashes[id], location) for id, location in state.items()
+                if id in hashes)
+
+
+def cigars_at(location, when):
+    """Returns the sorted hashes of the cigars in `location` at `when`.
+
+    Answers as `locations_at` would, but each select is filtered on
+    `location`, so only the cigars that may be there are read.
+    """
+    snapshot_id, after = _snapshot_before(when)[:2]
+    moved = _moved_since(after, when)
+
+    # Cigars that haven't moved since the snapshot are where it, or their
+    # current location, puts them.
+    source, at = _uncovered(snapshot_id, after, when)
+    found = [select([cigars.c.hash]).select_from(source)
+             .where(entries.c.id.is_(None))
+             .where(at == location)]
+    if snapshot_id is not None:
+        found.append(
+            select([cigars.c.hash])
+            .select_from(entries.join(cigars, cigars.c.id == entries.c.cigar))
+            .where(entries.c.snapshot == snapshot_id)
+            .where(entries.c.location == location))
+    found = [query.where(_held_at(when)).where(~moved) for query in found]
+
+    # The others are where their last transfer dated by `when` took them;
+    # for a backdated one that may be a transfer the snapshot covers.
+    def dated(log):
+        return and_(log.c.cigar.isnot(None), log.c.moved_on <= when)
+    found.append(
+        select([cigars.c.hash])
+        .select_from(transfers.join(cigars,
+                                    cigars.c.id == transfers.c.cigar))
+        .where(transfers.c.to == location)
+        .where(dated(transfers))
+        .where(_last(transfers, dated))
+        .where(moved)
+        .where(_held_at(when)))
+
+    hashes = set()
+    for query in found:
+        hashes.update(hash for hash, in db.session.execute(query))
+    return sorted(hashes)
+
+
+def location_of(hash, when):
+    """Returns where the cigar `hash` was at `when`, or None if there is
+    no such cigar or it was bought later."""
+    hash = lookup.normalize_hash(hash)
+    if not lookup.is_hash(hash):
+        return None
+    cigar = db.session.query(Inventory.id, Inventory.location) \
+        .filter(Inventory.hash == hash) \
+        .filter(_held_at(when)).first()
+    if cigar is None:
+        return None
+    before = db.session.query(Transfer.to_location) \
+        .filter(Transfer.cigar == cigar.id, Transfer.moved_on <= when) \
+        .order_by(Transfer.moved_on.desc(), Transfer.id.desc()).first()
+    if before is not None:
+        return before[0]
+    after = db.session.query(Transfer.from_location) \
+        .filter(Transfer.cigar == cigar.id, Transfer.moved_on > when) \
+        .order_by(Transfer.moved_on, Transfer.id).first()
+    if after is not None:
+        return after[0]
+    return cigar.location
@@ -0,0 +1,414 @@
+# project/server/inventory/valuation.py
+
+
+#################
+#### imports ####
+#################
+
+import datetime
+import decimal
+
+import numpy as np
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import and_, event, func, inspect, select
+
+from project.server import db
+from project.server.inventory.rollups import brands_of, column_values
+from project.server.models import Brand, Inventory, Location, Product, \
+    Transfer, ValuationRollup
+
+
+################
+#### config ####
+################
+
+PERIODS = ('month', 'year')
+DIMENSIONS = {
+    'brand': Brand,
+    'location': Location,
+}
+MEASURES = ('spend', 'value')
+FETCH_SIZE = 10000
+
+# The columns a cigar's contribution depends on. Only cigars with both a
+# purchase date and price are valued.
+VALUED = ('product', 'location', 'purchase_date', 'purchase_price')
+# Index of each dimension in the recompute's arrays.
+CODES = ('brand', 'location')
+# Stands in for NULL keys in the recompute's arrays.
+MISSING = -1
+
+valuations = ValuationRollup.__table__
+cigars = Inventory.__table__
+products = Product.__table__
+transfers = Transfer.__table__
+
+
+#################
+#### periods ####
+#################
+
+def period_start(period, when):
+    """The first day of the month or year `when` falls in."""
+    if period == 'year':
+        return datetime.date(when.year, 1, 1)
+    return datetime.date(when.year, when.month, 1)
+
+
+def _next(period, start):
+    if period == 'year':
+        return datetime.date(start.year + 1, 1, 1)
+    if start.month == 12:
+        return datetime.date(start.year + 1, 1, 1)
+    return datetime.date(start.year, start.month + 1, 1)
+
+
+def _cents(amount):
+    return int((decimal.Decimal(amount) * 100).to_integral_value())
+
+
+def _money(cents):
+    return decimal.Decimal(int(cents)).scaleb(-2)
+
+
+#################
+#### updates ####
+#################
+
+def add(deltas, dimension, key, when, spend=0, purchases=0, value=0):
+    """Adds a change in the month of `when` to `deltas`, a dict of
+    `(dimension, key, month)` to `[spend, purchases, value]`."""
+    totals = deltas.setdefault((dimension, key, period_start('month', when)),
+                               [0, 0, 0])
+    totals[0] += spend
+    totals[1] += purchases
+    totals[2] += value
+
+
+def add_cigar(deltas, sign, brand, location, purchased, price, moves=()):
+    """Adds (`sign` 1) or takes away (-1) everything one cigar contributes:
+    its purchase, and its value moving along `moves`, its transfers as
+    `(when, from, to)` in order. Cigars without a purchase date and price
+    contribute nothing."""
+    if purchased is None or price is None:
+        return
+    price = sign * decimal.Decimal(str(price))
+    # Held where its first transfer took it from, else where it is.
+    first = moves[0][1] if moves else location
+    add(deltas, 'brand', brand, purchased, price, sign, price)
+    add(deltas, 'location', first, purchased, price, sign, price)
+    for when, source, target in moves:
+        add(deltas, 'location', source, when, value=-price)
+        add(deltas, 'location', target, when, value=price)
+
+
+def apply_deltas(connection, deltas):
+    """Adds `deltas` to the month and year rollup rows; one UPDATE per row,
+    plus an INSERT for new ones."""
+    rows = {}
+    for (dimension, key, month), changes in deltas.items():
+        for period in PERIODS:
+            totals = rows.setdefault(
+                (period, dimension, key, period_start(period, month)),
+                [0, 0, 0])
+            for n, change in enumerate(changes):
+                totals[n] += change
+    for (period, dimension, key, start), (spend, purchases, value) in \
+            sorted(rows.items(), key=str):
+        if not (spend or purchases or value):
+            continue
+        if key is None:
+            matches_key = valuations.c.key.is_(None)
+        else:
+            matches_key = valuations.c.key == key
+        where = and_(valuations.c.period == period,
+                     valuations.c.dimension == dimension,
+                     valuations.c.start == start, matches_key)
+        result = connection.execute(
+            valuations.update().where(where).values(
+                spend=valuations.c.spend + spend,
+                purchases=valuations.c.purchases + purchases,
+                value=valuations.c.value + value)
+        )
+        if not result.rowcount:
+            connection.execute(valuations.insert().values(
+                period=period, dimension=dimension, key=key, start=start,
+                spend=spend, purchases=purchases, value=value))
+
+
+def _moves(session, cigar):
+    with session.no_autoflush:
+        return session.query(Transfer.moved_on, Transfer.from_location,
+                             Transfer.to_location) \
+            .filter(Transfer.cigar == cigar) \
+            .order_by(Transfer.moved_on, Transfer.id).all()
+
+
+def _collect_product(session, deltas, target):
+    history = inspect(target).attrs.brand.history
+    with session.no_autoflush:
+        bought = session.query(Inventory.purchase_date,
+                               Inventory.purchase_price) \
+            .filter(Inventory.product == target.id) \
+            .filter(Inventory.purchase_date.isnot(None)) \
+            .filter(Inventory.purchase_price.isnot(None)).all()
+    for purchased, price in bought:
+        for brand in history.deleted or ():
+            add(deltas, 'brand', brand, purchased, -price, -1, -price)
+        for brand in history.added or ():
+            add(deltas, 'brand', brand, purchased, price, 1, price)
+
+
+def _collect_cigar(session, deltas, brands, target, old, new):
+    """Takes away what the cigar contributed as `old` and adds what it
+    does as `new`; either is None for an insert or a delete."""
+    moves = []
+    if old is not None:
+        product, location, purchased, price = old
+        moves = _moves(session, inspect(target).identity[0])
+        add_cigar(deltas, -1, brands.get(product), location, purchased,
+                  price, moves)
+    if new is not None:
+        product, location, purchased, price = new
+        if old is not None and old[1] != location:
+            # `transfers._log_moves` logs the move as of now.
+            moves = moves + [(datetime.datetime.now(), old[1], location)]
+        add_cigar(deltas, 1, brands.get(product), location, purchased,
+                  price, moves)
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def _collect(session, flush_context, instances):
+    changes = []
+    for target in session.new:
+        if isinstance(target, Inventory):
+            changes.append(
+                (target, None, column_values(session, target, True, VALUED)))
+    for target in session.deleted:
+        if isinstance(target, Inventory):
+            changes.append(
+                (target, column_values(session, target, False, VALUED), None))
+    moved_products = []
+    for target in session.dirty:
+        if isinstance(target, Inventory) and session.is_modified(target):
+            old = column_values(session, target, False, VALUED)
+            new = column_values(session, target, True, VALUED)
+            if old != new:
+                changes.append((target, old, new))
+        elif isinstance(target, Product) and \
+                inspect(target).attrs.brand.history.has_changes():
+            moved_products.append(target)
+    if not changes and not moved_products:
+        return
+
+    brands = brands_of(session, [values[0] for _, old, new in changes
+                                 for values in (old, new) if values])
+    deltas = session.info.setdefault('valuation_deltas', {})
+    for target, old, new in changes:
+        _collect_cigar(session, deltas, brands, target, old, new)
+    for target in moved_products:
+        _collect_product(session, deltas, target)
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _apply(session, flush_context):
+    deltas = session.info.pop('valuation_deltas', None)
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+###################
+#### recompute ####
+###################
+
+def _fetch(connection, query, convert):
+    """Converts the rows of `query`, `FETCH_SIZE` at a time, to columns."""
+    result = connection.execute(query)
+    columns = [[] for _ in convert]
+    while True:
+        rows = result.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for values, parse, column in zip(zip(*rows), convert, columns):
+            column.extend(parse(value) for value in values)
+    return [np.array(column, dtype=np.int64) for column in columns]
+
+
+def _key(value):
+    return MISSING if value is None else value
+
+
+def _month(when):
+    return when.year * 12 + when.month - 1
+
+
+def _aggregate(dimensions, keys, buckets, columns):
+    """Sums each of `columns` per distinct `(dimension, key, bucket)`."""
+    order = np.lexsort((buckets, keys, dimensions))
+    dimensions, keys, buckets = \
+        dimensions[order], keys[order], buckets[order]
+    changed = (dimensions[1:] != dimensions[:-1]) | \
+        (keys[1:] != keys[:-1]) | (buckets[1:] != buckets[:-1])
+    starts = np.flatnonzero(np.concatenate([[True], changed]))
+    return (dimensions[starts], keys[starts], buckets[starts],
+            [np.add.reduceat(column[order], starts) for column in columns])
+
+
+def rebuild(connection):
+    """Recomputes every valuation rollup from `cigars` and `transfers`.
+
+    Both are read once; the month and year totals are then a sort and a
+    segmented sum over arrays of every purchase and move, however many
+    cigars there are. Returns the number of rollup rows written.
+    """
+    connection.execute(valuations.delete())
+    valued = and_(cigars.c.purchase_date.isnot(None),
+                  cigars.c.purchase_price.isnot(None))
+    ids, brands, locations, months, cents = _fetch(
+        connection,
+        select([cigars.c.id, products.c.brand, cigars.c.location,
+                cigars.c.purchase_date, cigars.c.purchase_price])
+        .select_from(cigars.outerjoin(
+            products, products.c.id == cigars.c.product))
+        .where(valued).order_by(cigars.c.id),
+        (int, _key, _key, _month, _cents))
+    if not len(ids):
+        return 0
+    moved, sources, targets, moved_in = _fetch(
+        connection,
+        select([transfers.c.cigar, transfers.c['from'], transfers.c.to,
+                transfers.c.moved_on])
+        .select_from(transfers.join(cigars, cigars.c.id == transfers.c.cigar))
+        .where(valued)
+        .order_by(transfers.c.cigar, transfers.c.moved_on, transfers.c.id),
+        (int, _key, _key, _month))
+
+    # A cigar was bought into the location its first move took it from.
+    held = locations.copy()
+    _, first = np.unique(moved, return_index=True)
+    held[np.searchsorted(ids, moved[first])] = sources[first]
+    value = cents[np.searchsorted(ids, moved)]
+
+    count, moves = len(ids), len(moved)
+    dimensions = np.repeat([0, 1, 1, 1], [count, count, moves, moves])
+    keys = np.concatenate([brands, held, sources, targets])
+    buckets = np.concatenate([months, months, moved_in, moved_in])
+    none = np.zeros(2 * moves, dtype=np.int64)
+    columns = (np.concatenate([cents, cents, none]),
+               np.concatenate([np.ones(2 * count, dtype=np.int64), none]),
+               np.concatenate([cents, cents, -value, value]))
+
+    rows = []
+    for period, divisor in (('month', 1), ('year', 12)):
+        groups, group_keys, starts, sums = _aggregate(
+            dimensions, keys, buckets // divisor, columns)
+        for dimension, key, bucket, spend, purchases, change in zip(
+                groups, group_keys, starts, *sums):
+            if not (spend or purchases or change):
+                continue
+            if period == 'year':
+                start = datetime.date(int(bucket), 1, 1)
+            else:
+                start = datetime.date(int(bucket) // 12,
+                                      int(bucket) % 12 + 1, 1)
+            rows.append({
+                'period': period,
+                'dimension': CODES[dimension],
+                'key': None if key == MISSING else int(key),
+                'start': start,
+                'spend': _money(spend),
+                'purchases': int(purchases),
+                'value': _money(change),
+            })
+    connection.execute(valuations.insert(), rows)
+    return len(rows)
+
+
+##############
+#### read ####
+##############
+
+def _names(dimension, keys):
+    model = DIMENSIONS[dimension]
+    keys = [key for key in keys if key is not None]
+    if not keys:
+        return {}
+    return dict(db.session.query(model.id, model.name)
+                .filter(model.id.in_(keys)).all())
+
+
+def _periods(period, first, last):
+    starts = []
+    while first <= last:
+        starts.append(first)
+        first = _next(period, first)
+    return starts
+
+
+def series(measure, dimension, period='month', start=None, end=None):
+    """Spend, or the purchase value held at the end of each period, per
+    key of `dimension` from `start` to `end` (dates, inclusive), read
+    from the rollups alone.
+
+    Returns one dict per key, with `periods` in date order and the
+    range's `total` spend or closing value; largest first.
+    """
+    query = db.session.query(
+        ValuationRollup.key, ValuationRollup.start, ValuationRollup.spend,
+        ValuationRollup.purchases, ValuationRollup.value) \
+        .filter(ValuationRollup.period == period) \
+        .filter(ValuationRollup.dimension == dimension)
+    first = period_start(period, start) if start else None
+    last = period_start(period, end) if end else None
+    if last is not None:
+        query = query.filter(ValuationRollup.start <= last)
+
+    if measure == 'spend':
+        if first is not None:
+            query = query.filter(ValuationRollup.start >= first)
+        periods, spent = {}, {}
+        for key, begins, spend, purchases, _ in query.filter(
+                ValuationRollup.purchases != 0).order_by(
+                ValuationRollup.start):
+            periods.setdefault(key, []).append({
+                'start': begins.isoformat(),
+                'spend': float(spend),
+                'purchases': purchases,
+            })
+            spent[key] = spent.get(key, 0) + spend
+        rows = [{'id': key, 'periods': periods[key],
+                 'total': float(spent[key])} for key in periods]
+    else:
+        # Everything before the range is the opening balance.
+        held = {}
+        if first is not None:
+            held = dict(db.session.query(
+                ValuationRollup.key, func.sum(ValuationRollup.value))
+                .filter(ValuationRollup.period == period)
+                .filter(ValuationRollup.dimension == dimension)
+                .filter(ValuationRollup.start < first)
+                .group_by(ValuationRollup.key).all())
+            query = query.filter(ValuationRollup.start >= first)
+        changes = dict(((key, begins), value)
+                       for key, begins, _, _, value in query)
+        starts = [begins for _, begins in changes]
+        first = first or min(starts, default=None)
+        last = last or max(starts, default=first)
+        rows = []
+        for key in set(held) | set(key for key, _ in changes):
+            balance = held.get(key) or 0
+            periods = []
+            for begins in _periods(period, first, last):
+                balance += changes.get((key, begins), 0)
+                periods.append({'start': begins.isoformat(),
+                                'value': float(balance)})
+            if any(p['value'] for p in periods):
+                rows.append({'id': key, 'periods': periods,
+                             'total': float(balance)})
+
+    names = _names(dimension, [row['id'] for row in rows])
+    for row in rows:
+        row['name'] = names.get(row['id'])
+    rows.sort(key=lambda row: (-row['total'], row['id'] is None,
+                               row['id'] or 0))
+    return rows
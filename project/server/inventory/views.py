@@ -0,0 +1,156 @@
+# project/server/inventory/views.py
+
+
+#################
+#### imports ####
+#################
+
+import datetime
+
+from flask import Blueprint, jsonify, request
+from flask_login import login_required
+
+from project.server import db
+from project.server.inventory import lookup, rollups, smoking, transfers, \
+    valuation
+from project.server.inventory.lookup import find_cigar
+
+
+################
+#### config ####
+################
+
+inventory_blueprint = Blueprint('inventory', __name__,)
+
+
+@inventory_blueprint.record
+def configure(state):
+    lookup.configure(state.app)
+
+
+#################
+#### helpers ####
+#################
+
+def parse_when(value):
+    """Parses `YYYY-MM-DD` or `YYYY-MM-DDTHH:MM:SS`; None is now."""
+    if not value:
+        return datetime.datetime.now()
+    for format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+    return None
+
+
+def session_error(data):
+    """Returns why `data` isn't a session that can be recorded, or None:
+    it has to be an object whose `hashes`, if given, is a list of strings,
+    `ratings` an object of objects and `date` a string."""
+    if not isinstance(data, dict):
+        return 'Expected a JSON object.'
+    hashes = data.get('hashes', [])
+    if not isinstance(hashes, list) or \
+            not all(isinstance(hash, str) for hash in hashes):
+        return 'hashes must be a list of strings.'
+    ratings = data.get('ratings', {})
+    if ratings is not None and (
+            not isinstance(ratings, dict) or
+            not all(isinstance(fields, dict) for fields in ratings.values())):
+        return 'ratings must be an object of objects.'
+    date = data.get('date')
+    if date is not None and not isinstance(date, str):
+        return 'date must be a string.'
+    return None
+
+
+def parse_bound(value, end=False):
+    """Parses `YYYY`, `YYYY-MM` or `YYYY-MM-DD` as a date; with `end` a
+    bare year means its last day. None for no value; ValueError if it
+    doesn't parse."""
+    if not value:
+        return None
+    for format in ('%Y-%m-%d', '%Y-%m', '%Y'):
+        try:
+            day = datetime.datetime.strptime(value, format).date()
+        except ValueError:
+            continue
+        if end and format == '%Y':
+            day = day.replace(month=12, day=31)
+        return day
+    raise ValueError('Invalid date {!r}.'.format(value))
+
+
+################
+#### routes ####
+################
+
+@inventory_blueprint.route('/cigar/<hash>')
+def cigar(hash):
+    record = find_cigar(hash)
+    if record is None:
+        return jsonify(error='Unknown cigar.', hash=hash), 404
+    return jsonify(record)
+
+
+@inventory_blueprint.route('/inventory/rollups/<dimension>')
+def inventory_rollups(dimension):
+    if dimension not in rollups.DIMENSIONS:
+        return jsonify(error='Unknown dimension.', dimension=dimension), 404
+    rows = rollups.counts(dimension)
+    return jsonify(dimension=dimension, rows=rows,
+                   total=sum(row['count'] for row in rows),
+                   value=sum(row['value'] for row in rows))
+
+
+@inventory_blueprint.route('/inventory/valuation/<measure>/<dimension>')
+def inventory_valuation(measure, dimension):
+    if measure not in valuation.MEASURES or \
+            dimension not in valuation.DIMENSIONS:
+        return jsonify(error='Unknown measure or dimension.',
+                       measure=measure, dimension=dimension), 404
+    period = request.args.get('period', 'month')
+    if period not in valuation.PERIODS:
+        return jsonify(error='Unknown period.', period=period), 400
+    try:
+        start = parse_bound(request.args.get('from'))
+        end = parse_bound(request.args.get('to'), end=True)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    rows = valuation.series(measure, dimension, period, start, end)
+    return jsonify(measure=measure, dimension=dimension, period=period,
+                   rows=rows, total=sum(row['total'] for row in rows))
+
+
+@inventory_blueprint.route('/inventory/locations/<int:location>')
+def location_history(location):
+    when = parse_when(request.args.get('at'))
+    if when is None:
+        return jsonify(error='Invalid date.', at=request.args['at']), 400
+    hashes = transfers.cigars_at(location, when)
+    return jsonify(location=location, at=when.isoformat(), cigars=hashes,
+                   count=len(hashes))
+
+
+@inventory_blueprint.route('/sessions', methods=['POST'])
+@login_required
+def record_session():
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    error = session_error(data)
+    if error is not None:
+        return jsonify(error=error), 400
+    date = parse_when(data.get('date'))
+    if date is None:
+        return jsonify(error='Invalid date.', date=data['date']), 400
+    try:
+        result = smoking.record_session(data.get('hashes', []), date,
+                                        data.get('ratings'))
+    except smoking.UnknownCigars as e:
+        return jsonify(error=str(e), hashes=e.hashes), 400
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    db.session.commit()
+    return jsonify(result._asdict()), 201
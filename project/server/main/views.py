@@ -7,6 +7,8 @@
 
 from flask import render_template, Blueprint
 
+from project.server import page_cache
+
 
 ################
 #### config ####
@@ -21,10 +23,12 @@ main_blueprint = Blueprint('main', __name__,)
 
 
 @main_blueprint.route('/')
+@page_cache.cached()
 def home():
     return render_template('main/home.html')
 
 
 @main_blueprint.route("/about/")
+@page_cache.cached()
 def about():
     return render_template("main/about.html")
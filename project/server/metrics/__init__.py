@@ -0,0 +1 @@
+# project/server/metrics/__init__.py
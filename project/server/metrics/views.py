@@ -0,0 +1,155 @@
+# project/server/metrics/views.py
+
+
+#################
+#### imports ####
+#################
+
+import hmac
+
+from flask import Blueprint, Response, abort, current_app, request
+from flask_login import current_user
+
+from project.server.instrumentation import PREFIX
+from project.server.inventory import lookup
+
+
+################
+#### config ####
+################
+
+metrics_blueprint = Blueprint('metrics', __name__,)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+#################
+#### helpers ####
+#################
+
+def _allowed():
+    """Admins, addresses in `METRICS_ALLOW` and scrapers sending
+    `Authorization: Bearer <METRICS_TOKEN>` may read the metrics."""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and hmac.compare_digest(
+            request.headers.get('Authorization', '').encode('utf-8'),
+            'Bearer {}'.format(token).encode('utf-8')):
+        return True
+    if request.remote_addr in current_app.config.get('METRICS_ALLOW', ()):
+        return True
+    return bool(getattr(current_user, 'admin', False))
+
+
+def _metric(name, kind, help, samples):
+    """Formats one metric family. Each sample is `(suffix, value)`, the
+    suffix being a label set such as `{cache="user"}`, `_sum`, or empty."""
+    name = PREFIX + name
+    lines = ['# HELP {} {}'.format(name, help),
+             '# TYPE {} {}'.format(name, kind)]
+    for labels, value in samples:
+        lines.append('{}{} {}'.format(name, labels, value))
+    return lines
+
+
+def hashing_metrics():
+    metrics = current_app.extensions['password_hasher'].metrics
+    lines = []
+    for kind in ('hash', 'check'):
+        summary = metrics.latency[kind]
+        lines.extend(_metric(
+            'bcrypt_{}_seconds'.format(kind), 'summary',
+            'Time bcrypt spent per {}.'.format(kind),
+            [('_sum', summary.total), ('_count', summary.count)]))
+    lines.extend(_metric(
+        'bcrypt_queue_wait_seconds', 'summary',
+        'Time calls waited for a free bcrypt worker.',
+        [('_sum', metrics.queue_wait.total),
+         ('_count', metrics.queue_wait.count)]))
+    lines.extend(_metric('bcrypt_in_flight', 'gauge',
+                         'Hashes queued or running.',
+                         [('', metrics.in_flight)]))
+    lines.extend(_metric('bcrypt_rejected_total', 'counter',
+                         'Hashes refused because the queue was full.',
+                         [('', metrics.rejected)]))
+    lines.extend(_metric('bcrypt_timed_out_total', 'counter',
+                         'Hashes given up on after BCRYPT_TIMEOUT.',
+                         [('', metrics.timed_out)]))
+    lines.extend(_metric('bcrypt_rehashed_total', 'counter',
+                         'Passwords re-hashed at a new cost on login.',
+                         [('', metrics.rehashed)]))
+    return lines
+
+
+def cache_metrics():
+    caches = (('user', current_app.extensions['user_cache']),
+              ('cigar_lookup', lookup.cache),
+              ('page', current_app.extensions['page_cache'].backend))
+    lines = _metric('cache_hits_total', 'counter', 'Cache hits.',
+                    [('{{cache="{}"}}'.format(name), cache.hits)
+                     for name, cache in caches])
+    lines.extend(_metric('cache_misses_total', 'counter', 'Cache misses.',
+                         [('{{cache="{}"}}'.format(name), cache.misses)
+                          for name, cache in caches]))
+    return lines
+
+
+def database_metrics():
+    router = current_app.extensions['router']
+    engines = sorted(router.engines())
+    for name, engine in engines:
+        router.pool_stats(name)
+    pools = sorted(router.pools.items())
+    lines = _metric('db_pool_checkouts_total', 'counter',
+                    'Connections checked out of the pool.',
+                    [('{{pool="{}"}}'.format(name), stats.checkouts)
+                     for name, stats in pools])
+    lines.extend(_metric('db_pool_timeouts_total', 'counter',
+                         'Checkouts that gave up waiting for a connection.',
+                         [('{{pool="{}"}}'.format(name), stats.timeouts)
+                          for name, stats in pools]))
+    samples = []
+    for name, stats in pools:
+        for bound, count in stats.wait.cumulative():
+            samples.append(('_bucket{{pool="{}",le="{}"}}'.format(
+                name, '+Inf' if bound == float('inf') else bound), count))
+        samples.append(('_sum{{pool="{}"}}'.format(name), stats.wait.sum))
+        samples.append(('_count{{pool="{}"}}'.format(name),
+                        stats.wait.count))
+    lines.extend(_metric('db_pool_wait_seconds', 'histogram',
+                         'Time spent getting a connection from the pool.',
+                         samples))
+    gauges = [(name, engine.pool) for name, engine in engines
+              if hasattr(engine.pool, 'checkedout')]
+    lines.extend(_metric('db_pool_checked_out', 'gauge',
+                         'Connections in use.',
+                         [('{{pool="{}"}}'.format(name), pool.checkedout())
+                          for name, pool in gauges]))
+    lines.extend(_metric('db_pool_size', 'gauge',
+                         'Connections the pool keeps open.',
+                         [('{{pool="{}"}}'.format(name), pool.size())
+                          for name, pool in gauges]))
+    lines.extend(_metric('db_sessions_routed_total', 'counter',
+                         'Sessions by the engine their reads went to.',
+                         [('{{target="{}"}}'.format(name), count)
+                          for name, count in sorted(router.routed.items())]))
+    lines.extend(_metric('db_replica_lag_seconds', 'gauge',
+                         'Replication lag at the last check; NaN if the '
+                         'replica could not be reached.',
+                         [('{{replica="{}"}}'.format(replica.name),
+                           'NaN' if replica.lag is None else replica.lag)
+                          for replica in router.replicas]))
+    return lines
+
+
+################
+#### routes ####
+################
+
+@metrics_blueprint.route('/metrics')
+def metrics():
+    if not _allowed():
+        abort(403)
+    instrumentation = current_app.extensions['instrumentation']
+    lines = instrumentation.render() + hashing_metrics() + \
+        cache_metrics() + database_metrics()
+    return Response('\n'.join(lines) + '\n', content_type=CONTENT_TYPE)
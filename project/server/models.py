@@ -3,7 +3,8 @@
 
 import datetime
 
-from project.server import app, db, bcrypt
+from project.server import db, hasher
+from project.server.sqltypes import HexBinary
 
 
 class User(db.Model):
@@ -18,9 +19,7 @@ class User(db.Model):
 
     def __init__(self, email, password, admin=False):
         self.email = email
-        self.password = bcrypt.generate_password_hash(
-            password, app.config.get('BCRYPT_LOG_ROUNDS')
-        )
+        self.password = hasher.hash_password(password)
         self.registered_on = datetime.datetime.now()
         self.admin = admin
 
@@ -45,6 +44,8 @@ class Brand(db.Model):
     __tablename__ = "brands"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(64))
+    # The sync counter when the row last changed; see `versioning`.
+    change = db.Column(db.Integer, index=True)
 
     products = db.relationship('Product', backref='brands', lazy='dynamic')
 
@@ -57,7 +58,8 @@ class Product(db.Model):
     __tablename__ = "products"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(64))
-    brand = db.Column(db.Integer, db.ForeignKey('brands.id'))
+    brand = db.Column(db.Integer, db.ForeignKey('brands.id'), index=True)
+    change = db.Column(db.Integer, index=True)
 
     inventory = db.relationship('Inventory', backref='products', lazy='dynamic')
 
@@ -70,6 +72,7 @@ class Size(db.Model):
     __tablename__ = "sizes"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(64))
+    change = db.Column(db.Integer, index=True)
 
     inventory = db.relationship('Inventory', backref='sizes', lazy='dynamic')
 
@@ -81,6 +84,7 @@ class Location(db.Model):
     __tablename__ = "locations"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(64))
+    change = db.Column(db.Integer, index=True)
 
     inventory = db.relationship('Inventory', backref='locations', lazy='dynamic')
 
@@ -91,9 +95,228 @@ class Location(db.Model):
 class Inventory(db.Model):
 
     __tablename__ = "cigars"
-    
+    __table_args__ = (
+        db.Index('ix_cigars_location_product', 'location', 'product'),
+        db.Index('ix_cigars_product_size', 'product', 'size'),
+    )
+
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    hash = db.Column(db.String(64))
+    hash = db.Column(HexBinary(20), unique=True, index=True)
     product = db.Column(db.Integer, db.ForeignKey('products.id'))
-    size = db.Column(db.Integer, db.ForeignKey('sizes.id'))
+    size = db.Column(db.Integer, db.ForeignKey('sizes.id'), index=True)
+    purchase_date = db.Column(db.DateTime, index=True)
+    purchase_price = db.Column(db.Numeric(10, 2))
     location = db.Column(db.Integer, db.ForeignKey('locations.id'))
+    change = db.Column(db.Integer, index=True)
+
+    ratings = db.relationship('Rating', backref='cigars', lazy='dynamic')
+    transfers = db.relationship('Transfer', backref='cigars', lazy='dynamic')
+
+
+class Rating(db.Model):
+
+    __tablename__ = "ratings"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    cigar = db.Column(db.Integer, db.ForeignKey('cigars.id'), index=True)
+    session = db.Column(db.Integer)
+    app_notes = db.Column(db.Text)
+    app_score = db.Column(db.Integer)
+    smoke_notes = db.Column(db.Text)
+    smoke_score = db.Column(db.Integer)
+    taste_notes = db.Column(db.Text)
+    taste_score = db.Column(db.Integer)
+    overall_notes = db.Column(db.Text)
+    overall_score = db.Column(db.Integer)
+    change = db.Column(db.Integer, index=True)
+
+
+class Transfer(db.Model):
+
+    __tablename__ = "transfers"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    cigar = db.Column(db.Integer, db.ForeignKey('cigars.id'), index=True)
+    from_location = db.Column('from', db.Integer,
+                              db.ForeignKey('locations.id'))
+    to_location = db.Column('to', db.Integer, db.ForeignKey('locations.id'))
+    moved_on = db.Column(db.DateTime, nullable=False, index=True,
+                         default=datetime.datetime.now,
+                         server_default=db.func.current_timestamp())
+
+
+class LocationSnapshot(db.Model):
+
+    __tablename__ = "location_snapshots"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # The last transfer folded into the snapshot, and when it happened.
+    transfer = db.Column(db.Integer, nullable=False, index=True)
+    taken_on = db.Column(db.DateTime, nullable=False, index=True)
+
+    entries = db.relationship('LocationSnapshotEntry', backref='snapshots',
+                              lazy='dynamic')
+
+
+class LocationSnapshotEntry(db.Model):
+
+    __tablename__ = "location_snapshot_entries"
+    __table_args__ = (
+        db.Index('ix_location_snapshot_entries_snapshot_cigar',
+                 'snapshot', 'cigar'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    snapshot = db.Column(db.Integer, db.ForeignKey('location_snapshots.id'),
+                         nullable=False)
+    cigar = db.Column(db.Integer, nullable=False)
+    location = db.Column(db.Integer)
+
+
+class SmokingSession(db.Model):
+
+    __tablename__ = "sessions"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    date = db.Column(db.DateTime, nullable=False,
+                     default=datetime.datetime.now)
+
+    inventory = db.relationship('SessionInventory', backref='sessions',
+                                lazy='dynamic')
+
+
+class SessionInventory(db.Model):
+
+    __tablename__ = "session_inventory"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    session = db.Column(db.Integer, db.ForeignKey('sessions.id'), index=True)
+    cigar = db.Column(db.Integer, db.ForeignKey('cigars.id'), index=True)
+
+
+class InventoryRollup(db.Model):
+
+    __tablename__ = "inventory_rollups"
+    __table_args__ = (
+        db.UniqueConstraint('dimension', 'key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    dimension = db.Column(db.String(16), nullable=False)
+    key = db.Column(db.Integer)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    # Total purchase price of the cigars counted; unpriced ones add 0.
+    value = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+
+class ValuationRollup(db.Model):
+
+    __tablename__ = "valuation_rollups"
+    __table_args__ = (
+        db.UniqueConstraint('period', 'dimension', 'start', 'key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    period = db.Column(db.String(8), nullable=False)
+    dimension = db.Column(db.String(16), nullable=False)
+    key = db.Column(db.Integer)
+    # First day of the month or year.
+    start = db.Column(db.Date, nullable=False)
+    spend = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    purchases = db.Column(db.Integer, nullable=False, default=0)
+    # Net change in the purchase value of the cigars held.
+    value = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+
+class ProductVector(db.Model):
+    """A rated product's features as of the last recommendation refresh:
+    its mean scores, brand and most rated size."""
+
+    __tablename__ = "product_vectors"
+
+    product = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    brand = db.Column(db.Integer)
+    size = db.Column(db.Integer)
+    app_score = db.Column(db.Float)
+    smoke_score = db.Column(db.Float)
+    taste_score = db.Column(db.Float)
+    overall_score = db.Column(db.Float)
+    ratings = db.Column(db.Integer, nullable=False)
+    # Distance to the last neighbour kept, NULL if fewer were kept.
+    farthest = db.Column(db.Float)
+
+
+class SimilarProduct(db.Model):
+
+    __tablename__ = "similar_products"
+    __table_args__ = (
+        db.Index('ix_similar_products_product_rank', 'product', 'rank',
+                 unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    product = db.Column(db.Integer, nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+    similar = db.Column(db.Integer, nullable=False, index=True)
+    distance = db.Column(db.Float, nullable=False)
+
+
+class SimilarPending(db.Model):
+    """A product whose ratings, brand or rated sizes changed since the
+    last recommendation refresh; NULL after a bulk load, for every
+    product. Rows are only ever added, so writers never conflict."""
+
+    __tablename__ = "similar_pending"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    product = db.Column(db.Integer)
+
+
+class TableVersion(db.Model):
+
+    __tablename__ = "table_versions"
+
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SyncDelete(db.Model):
+    """A row deleted from a synced table, kept for clients to catch up
+    on."""
+
+    __tablename__ = "sync_deletes"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    table = db.Column(db.String(64), nullable=False)
+    row = db.Column(db.Integer, nullable=False)
+    change = db.Column(db.Integer, index=True)
+
+
+class ImportJob(db.Model):
+
+    __tablename__ = "import_jobs"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    table = db.Column(db.String(64), nullable=False)
+    path = db.Column(db.String(255), nullable=False)
+    filename = db.Column(db.String(255))
+    user = db.Column(db.Integer, db.ForeignKey('users.id'))
+    status = db.Column(db.String(16), nullable=False, index=True,
+                       default='queued')
+    chunk_size = db.Column(db.Integer, nullable=False)
+    # Rows in the file, known once the worker has validated it.
+    total = db.Column(db.Integer)
+    # Committed progress; a resumed job skips this many chunks.
+    chunks = db.Column(db.Integer, nullable=False, default=0)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    # Times claimed; see `IMPORT_MAX_ATTEMPTS`.
+    attempts = db.Column(db.Integer, nullable=False, default=0,
+                         server_default='0')
+    ignored = db.Column(db.Text)
+    error = db.Column(db.Text)
+    worker = db.Column(db.String(64))
+    created_on = db.Column(db.DateTime, nullable=False,
+                           default=datetime.datetime.now)
+    started_on = db.Column(db.DateTime)
+    heartbeat = db.Column(db.DateTime)
+    finished_on = db.Column(db.DateTime)
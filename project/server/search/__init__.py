@@ -0,0 +1 @@
+# project/server/search/__init__.py
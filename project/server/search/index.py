@@ -0,0 +1,272 @@
+# project/server/search/index.py
+
+
+#################
+#### imports ####
+#################
+
+import bisect
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict, namedtuple
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from project.server import db
+from project.server.models import Brand, Product
+
+
+################
+#### config ####
+################
+
+KINDS = {
+    Brand: 'brand',
+    Product: 'product',
+}
+
+# `session.info` key of the changes to apply on commit.
+CHANGES = 'search_index_changes'
+
+# Share of the query's trigrams a name needs for a fuzzy match.
+TRIGRAM_THRESHOLD = 0.4
+
+
+Entry = namedtuple('Entry', 'kind id name folded tokens brand')
+
+
+#################
+#### helpers ####
+#################
+
+def fold(text):
+    """Lower-cases `text` and strips its accents, so `Alcántara` and
+    `alcantara` index and match alike."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(
+        c for c in decomposed if not unicodedata.combining(c)
+    ).lower().strip()
+
+
+def tokenize(folded):
+    return [token for token in folded.replace('-', ' ').split() if token]
+
+
+def trigrams(folded):
+    padded = '  {} '.format(folded)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+###############
+#### index ####
+###############
+
+class SearchIndex(object):
+    """An in-memory prefix and trigram index over brand and product names.
+
+    Prefix lookups bisect a sorted token list; typos and infix matches
+    fall back to trigram overlap. Entries are added and removed one at a
+    time, so model changes never need a full rebuild.
+    """
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self.built_at = None
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._entries = {}
+        self._tokens = []
+        self._trigrams = defaultdict(set)
+
+    def build(self):
+        brands = db.session.query(Brand.id, Brand.name).all()
+        products = db.session.query(
+            Product.id, Product.name, Product.brand).all()
+        with self._lock:
+            self._clear()
+            # One sort for the whole token list; `insort` per token is
+            # quadratic in the number of tokens.
+            tokens = []
+            for id, name in brands:
+                tokens.extend(self._enter(
+                    Entry('brand', id, name, fold(name), (), None)))
+            for id, name, brand in products:
+                tokens.extend(self._enter(
+                    Entry('product', id, name, fold(name), (), brand)))
+            tokens.sort()
+            self._tokens = tokens
+            self.built_at = time.time()
+
+    def _stale(self):
+        if self.built_at is None:
+            return True
+        return self.max_age and time.time() - self.built_at > self.max_age
+
+    def _enter(self, entry):
+        """Stores `entry` and its trigrams; returns the `(token, key)`
+        pairs for the token list, which the caller adds."""
+        key = (entry.kind, entry.id)
+        tokens = tuple(sorted(set(tokenize(entry.folded))))
+        self._entries[key] = entry._replace(tokens=tokens)
+        for trigram in trigrams(entry.folded):
+            self._trigrams[trigram].add(key)
+        return [(token, key) for token in tokens]
+
+    def _add(self, entry):
+        self._remove((entry.kind, entry.id))
+        for pair in self._enter(entry):
+            bisect.insort(self._tokens, pair)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for token in entry.tokens:
+            position = bisect.bisect_left(self._tokens, (token, key))
+            if position < len(self._tokens) and \
+                    self._tokens[position] == (token, key):
+                del self._tokens[position]
+        for trigram in trigrams(entry.folded):
+            keys = self._trigrams.get(trigram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._trigrams[trigram]
+
+    def update(self, kind, id, name, brand=None):
+        with self._lock:
+            if self.built_at is not None:
+                self._add(Entry(kind, id, name, fold(name), (), brand))
+
+    def remove(self, kind, id):
+        with self._lock:
+            self._remove((kind, id))
+
+    def _prefixed(self, token):
+        position = bisect.bisect_left(self._tokens, (token,))
+        while position < len(self._tokens):
+            found, key = self._tokens[position]
+            if not found.startswith(token):
+                break
+            yield key
+            position += 1
+
+    def _by_prefix(self, tokens):
+        """Keys whose names have a word starting with every query token."""
+        matches = None
+        for token in sorted(tokens, key=len, reverse=True):
+            keys = set(self._prefixed(token))
+            matches = keys if matches is None else matches & keys
+            if not matches:
+                break
+        return matches or set()
+
+    def _by_trigram(self, folded):
+        wanted = trigrams(folded)
+        shared = Counter()
+        for trigram in wanted:
+            shared.update(self._trigrams.get(trigram, ()))
+        needed = TRIGRAM_THRESHOLD * len(wanted)
+        return dict((key, n) for key, n in shared.items() if n >= needed)
+
+    def search(self, query, limit=10):
+        """Returns up to `limit` brands and products matching `query`,
+        best match first."""
+        folded = fold(query)
+        tokens = tokenize(folded)
+        if not tokens:
+            return []
+        with self._lock:
+            # Checked again under the lock, so threads that found it stale
+            # together build it once.
+            if self._stale():
+                self.build()
+            ranked = {}
+            for key in self._by_prefix(tokens):
+                entry = self._entries[key]
+                if entry.folded == folded:
+                    rank = 0
+                elif entry.folded.startswith(folded):
+                    rank = 1
+                else:
+                    rank = 2
+                ranked[key] = (rank, 0, len(entry.folded), entry.folded)
+            if len(ranked) < limit and len(folded) >= 3:
+                for key, shared in self._by_trigram(folded).items():
+                    if key not in ranked:
+                        entry = self._entries[key]
+                        ranked[key] = (3, -shared, len(entry.folded),
+                                       entry.folded)
+            best = sorted(ranked, key=ranked.get)[:limit]
+            return [self._result(self._entries[key]) for key in best]
+
+    def _result(self, entry):
+        result = {'type': entry.kind, 'id': entry.id, 'name': entry.name}
+        if entry.kind == 'product':
+            brand = self._entries.get(('brand', entry.brand))
+            result['brand'] = brand and {'id': brand.id, 'name': brand.name}
+        return result
+
+    def __len__(self):
+        return len(self._entries)
+
+
+index = SearchIndex()
+
+
+#####################
+#### maintenance ####
+#####################
+
+def _changes(session):
+    """The index changes `session` applies once it commits."""
+    return session.info.setdefault(CHANGES, [])
+
+
+def _pending(target):
+    session = object_session(target)
+    if session is None:
+        return []
+    return _changes(session)
+
+
+def mark_removed(session, model, ids):
+    """Removes the rows of `model` with `ids` from the index once
+    `session` commits, for deletes that bypass the ORM."""
+    _changes(session).extend(
+        (KINDS[model], id, None, None) for id in sorted(ids))
+
+
+@event.listens_for(Brand, 'after_insert')
+@event.listens_for(Brand, 'after_update')
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+def _changed(mapper, connection, target):
+    brand = target.brand if isinstance(target, Product) else None
+    _pending(target).append((KINDS[mapper.class_], target.id, target.name,
+                             brand))
+
+
+@event.listens_for(Brand, 'after_delete')
+@event.listens_for(Product, 'after_delete')
+def _deleted(mapper, connection, target):
+    _pending(target).append((KINDS[mapper.class_], target.id, None, None))
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _apply(session):
+    for kind, id, name, brand in session.info.pop(CHANGES, ()):
+        if name is None:
+            index.remove(kind, id)
+        else:
+            index.update(kind, id, name, brand)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _forget(session):
+    session.info.pop(CHANGES, None)
@@ -0,0 +1,227 @@
+# project/server/search/notes.py
+
+
+#################
+#### imports ####
+#################
+
+import html
+import re
+
+from sqlalchemy import DDL, Float, Integer, String, event, select, text
+from sqlalchemy.sql import column
+
+from project.server import db
+from project.server.models import Brand, Inventory, Product, Rating
+
+
+################
+#### config ####
+################
+
+# Each notes column with its PostgreSQL weight and SQLite bm25 weight;
+# the overall verdict counts most, first impressions least.
+NOTES = (
+    ('app_notes', 'D', 0.1),
+    ('smoke_notes', 'C', 0.2),
+    ('taste_notes', 'B', 0.4),
+    ('overall_notes', 'A', 1.0),
+)
+NAMES = ', '.join(name for name, _, _ in NOTES)
+
+TEXT_SEARCH_CONFIG = 'english'
+# The FTS5 table (SQLite) and tsvector column (PostgreSQL).
+FTS_TABLE = 'rating_notes'
+SEARCH_COLUMN = 'notes_search'
+
+# Query words used, at most; the rest are ignored.
+MAX_TERMS = 8
+SNIPPET_WORDS = 16
+# Marks matches in snippets until the text around them is escaped.
+START, STOP = '\x02', '\x03'
+
+ratings = Rating.__table__
+cigars = Inventory.__table__
+products = Product.__table__
+brands = Brand.__table__
+
+
+#############
+#### DDL ####
+#############
+
+def _fts_row(prefix):
+    return ', '.join('{}.{}'.format(prefix, name) for name, _, _ in NOTES)
+
+
+# An external content FTS5 table over `ratings`, kept in step by triggers
+# so bulk loads and raw SQL are indexed too.
+SQLITE_CREATE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {table} USING fts5({names}, "
+    "content='ratings', content_rowid='id', "
+    "tokenize='porter unicode61')".format(table=FTS_TABLE, names=NAMES),
+    "CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON ratings "
+    "BEGIN INSERT INTO {table} (rowid, {names}) VALUES (new.id, {new}); "
+    "END".format(table=FTS_TABLE, names=NAMES, new=_fts_row('new')),
+    "CREATE TRIGGER IF NOT EXISTS {table}_delete AFTER DELETE ON ratings "
+    "BEGIN INSERT INTO {table} ({table}, rowid, {names}) "
+    "VALUES ('delete', old.id, {old}); END".format(
+        table=FTS_TABLE, names=NAMES, old=_fts_row('old')),
+    "CREATE TRIGGER IF NOT EXISTS {table}_update AFTER UPDATE OF id, "
+    "{names} ON ratings BEGIN INSERT INTO {table} ({table}, rowid, {names}) "
+    "VALUES ('delete', old.id, {old}); INSERT INTO {table} (rowid, {names}) "
+    "VALUES (new.id, {new}); END".format(
+        table=FTS_TABLE, names=NAMES, old=_fts_row('old'),
+        new=_fts_row('new')),
+)
+SQLITE_DROP = (
+    'DROP TABLE IF EXISTS {}'.format(FTS_TABLE),
+)
+
+# A weighted tsvector column with a GIN index, filled by a trigger.
+POSTGRESQL_CREATE = (
+    'ALTER TABLE ratings ADD COLUMN {} tsvector'.format(SEARCH_COLUMN),
+    'CREATE INDEX ix_ratings_{0} ON ratings USING gin ({0})'.format(
+        SEARCH_COLUMN),
+    "CREATE OR REPLACE FUNCTION ratings_{column}() RETURNS trigger AS $$ "
+    "BEGIN NEW.{column} := {vector}; RETURN NEW; END "
+    "$$ LANGUAGE plpgsql".format(
+        column=SEARCH_COLUMN,
+        vector=' || '.join(
+            "setweight(to_tsvector('{}', coalesce(NEW.{}, '')), '{}')"
+            .format(TEXT_SEARCH_CONFIG, name, weight)
+            for name, weight, _ in NOTES)),
+    'CREATE TRIGGER ratings_{column} BEFORE INSERT OR UPDATE OF {names} '
+    'ON ratings FOR EACH ROW EXECUTE PROCEDURE ratings_{column}()'.format(
+        column=SEARCH_COLUMN, names=NAMES),
+)
+POSTGRESQL_DROP = (
+    'DROP FUNCTION IF EXISTS ratings_{}() CASCADE'.format(SEARCH_COLUMN),
+)
+
+for statement in SQLITE_CREATE:
+    event.listen(ratings, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+for statement in SQLITE_DROP:
+    event.listen(ratings, 'before_drop',
+                 DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRESQL_CREATE:
+    # `%` is a bind marker to psycopg2.
+    event.listen(ratings, 'after_create',
+                 DDL(statement.replace('%', '%%'))
+                 .execute_if(dialect='postgresql'))
+for statement in POSTGRESQL_DROP:
+    event.listen(ratings, 'after_drop',
+                 DDL(statement).execute_if(dialect='postgresql'))
+
+
+def is_search_object(name):
+    """True for the tables and columns that back the search rather than a
+    model, which autogenerated migrations should leave alone."""
+    return name == SEARCH_COLUMN or name == FTS_TABLE or \
+        name.startswith(FTS_TABLE + '_')
+
+
+def rebuild(connection):
+    """Reindexes every rating, for databases filled before the triggers
+    existed."""
+    if connection.dialect.name == 'sqlite':
+        connection.execute(
+            "INSERT INTO {0} ({0}) VALUES ('rebuild')".format(FTS_TABLE))
+    elif connection.dialect.name == 'postgresql':
+        # Fires the trigger for every row.
+        connection.execute('UPDATE ratings SET app_notes = app_notes')
+
+
+#################
+#### queries ####
+#################
+
+def terms(query):
+    """The words of `query`, lower-cased; punctuation and search syntax
+    are dropped so any input is a valid query."""
+    return re.findall(r'\w+', query.lower(), re.UNICODE)[:MAX_TERMS]
+
+
+def _sqlite_matches(words):
+    # Every word, as a prefix: `pepper` finds "peppery". Ordering by the
+    # built-in `rank` lets FTS5 make snippets for the rows returned only.
+    weights = ', '.join(str(weight) for _, _, weight in NOTES)
+    return text(
+        "SELECT rowid AS id, -rank AS rank, "
+        "snippet({table}, -1, :start, :stop, '…', {words}) AS snippet "
+        "FROM {table} WHERE {table} MATCH :query "
+        "AND rank MATCH 'bm25({weights})' "
+        "ORDER BY {table}.rank LIMIT :limit".format(
+            table=FTS_TABLE, weights=weights, words=SNIPPET_WORDS)
+    ).bindparams(query=' '.join('"{}"*'.format(word) for word in words),
+                 start=START, stop=STOP)
+
+
+def _postgresql_matches(words):
+    # Ranked and cut to `limit` first, so only the rows returned get a
+    # headline.
+    return text(
+        "SELECT id, rank, ts_headline('{config}', concat_ws(' … ', {names}), "
+        "query, :options) AS snippet FROM ("
+        "SELECT ratings.id, ts_rank(ratings.{column}, query) AS rank, "
+        "{names}, query FROM ratings, to_tsquery('{config}', :query) query "
+        "WHERE ratings.{column} @@ query "
+        "ORDER BY rank DESC, ratings.id LIMIT :limit) AS ranked".format(
+            config=TEXT_SEARCH_CONFIG, names=NAMES, column=SEARCH_COLUMN)
+    ).bindparams(
+        query=' & '.join('{}:*'.format(word) for word in words),
+        options='StartSel={}, StopSel={}, MaxWords={}, MinWords=5'.format(
+            START, STOP, SNIPPET_WORDS))
+
+
+MATCHES = {
+    'sqlite': _sqlite_matches,
+    'postgresql': _postgresql_matches,
+}
+
+
+def _highlight(snippet):
+    return html.escape(snippet or '').replace(START, '<mark>') \
+        .replace(STOP, '</mark>')
+
+
+def search(query, limit=20):
+    """Ratings whose notes match every word of `query`, best first, each
+    with its cigar, product and brand and an HTML snippet with the
+    matches in `<mark>`."""
+    words = terms(query)
+    if not words:
+        return []
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in MATCHES:
+        raise ValueError(
+            'Notes search needs SQLite or PostgreSQL, not {}.'.format(
+                dialect))
+    matches = MATCHES[dialect](words).bindparams(limit=limit).columns(
+        column('id', Integer), column('rank', Float),
+        column('snippet', String)).alias('matches')
+    rows = db.session.execute(
+        select([matches.c.id, matches.c.rank, matches.c.snippet,
+                ratings.c.overall_score, cigars.c.id, cigars.c.hash,
+                products.c.id, products.c.name, brands.c.id, brands.c.name])
+        .select_from(
+            matches.join(ratings, ratings.c.id == matches.c.id)
+            .outerjoin(cigars, cigars.c.id == ratings.c.cigar)
+            .outerjoin(products, products.c.id == cigars.c.product)
+            .outerjoin(brands, brands.c.id == products.c.brand))
+        .order_by(matches.c.rank.desc(), matches.c.id)
+    ).fetchall()
+
+    def named(id, name):
+        return None if id is None else {'id': id, 'name': name}
+
+    return [{
+        'rating': row[0],
+        'rank': row[1],
+        'snippet': _highlight(row[2]),
+        'overall_score': row[3],
+        'cigar': None if row[4] is None else {'id': row[4], 'hash': row[5]},
+        'product': named(row[6], row[7]),
+        'brand': named(row[8], row[9]),
+    } for row in rows]
@@ -0,0 +1,43 @@
+# project/server/search/views.py
+
+
+#################
+#### imports ####
+#################
+
+from flask import Blueprint, jsonify, request
+
+from project.server.search import notes
+from project.server.search.index import index
+
+
+################
+#### config ####
+################
+
+search_blueprint = Blueprint('search', __name__,)
+
+MAX_LIMIT = 50
+
+
+@search_blueprint.record
+def configure(state):
+    index.max_age = state.app.config.get('SEARCH_INDEX_MAX_AGE')
+
+
+################
+#### routes ####
+################
+
+@search_blueprint.route('/search/autocomplete')
+def autocomplete():
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 10, type=int), MAX_LIMIT))
+    return jsonify(query=query, results=index.search(query, limit))
+
+
+@search_blueprint.route('/search/notes')
+def search_notes():
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 20, type=int), MAX_LIMIT))
+    return jsonify(query=query, results=notes.search(query, limit))
@@ -0,0 +1,64 @@
+# project/server/sqltypes.py
+
+
+#################
+#### imports ####
+#################
+
+import binascii
+
+from sqlalchemy import types
+
+
+###############
+#### types ####
+###############
+
+def is_hex(value, length=None):
+    """True if `value` is an even-length hex string of at most `length`
+    bytes."""
+    if not isinstance(value, str) or len(value) % 2:
+        return False
+    if length is not None and len(value) > 2 * length:
+        return False
+    try:
+        binascii.unhexlify(value)
+    except (binascii.Error, ValueError):
+        return False
+    return True
+
+
+class HexBinary(types.TypeDecorator):
+    """Stores a hex digest as raw bytes, half the size of the text.
+
+    Accepts hex strings (any case, surrounding whitespace ignored) or
+    bytes and always returns lower-case hex, so code above the database
+    keeps dealing in hex. Anything else raises ValueError before a query
+    is sent.
+    """
+
+    impl = types.LargeBinary
+
+    def __init__(self, length=20):
+        super(HexBinary, self).__init__(length)
+        self.length = length
+
+    def to_bytes(self, value):
+        if value is None or isinstance(value, bytes):
+            return value
+        value = value.strip().lower()
+        if not is_hex(value, self.length):
+            raise ValueError('{!r} is not a hex digest of at most {} '
+                             'bytes.'.format(value, self.length))
+        return binascii.unhexlify(value)
+
+    def process_bind_param(self, value, dialect):
+        return self.to_bytes(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return binascii.hexlify(value).decode('ascii')
+
+    def copy(self, **kw):
+        return HexBinary(self.length)
@@ -0,0 +1 @@
+# project/server/sync/__init__.py
@@ -0,0 +1,359 @@
+# project/server/sync/snapshot.py
+
+
+#################
+#### imports ####
+#################
+
+import binascii
+import bisect
+import datetime
+import glob
+import json
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+from sqlalchemy import LargeBinary, select, type_coerce, types
+
+from project.server import db, versioning
+from project.server.search.index import fold
+from project.server.sqltypes import HexBinary
+
+
+################
+#### config ####
+################
+
+# A snapshot file is the header below (magic, format and where the JSON
+# table of contents starts; it runs to the end of the file), then the
+# sections the contents point to as `[offset, size]`, each an array
+# starting on an 8 byte boundary. Every number is little-endian.
+MAGIC = b'CIGARSNP'
+FORMAT = 1
+HEADER = struct.Struct('<8sIQ')
+ALIGN = 8
+
+# Tables whose folded names are indexed for prefix lookups.
+NAMED = ('brands', 'products', 'sizes', 'locations')
+EPOCH = datetime.datetime(1970, 1, 1)
+FILENAME = 'snapshot-{:010d}.bin'
+FILENAME_PATTERN = re.compile(r'snapshot-(\d+)\.bin$')
+
+
+#################
+#### helpers ####
+#################
+
+def _kind(column):
+    column_type = column.type
+    if isinstance(column_type, HexBinary):
+        return 'bytes'
+    if isinstance(column_type, types.Boolean):
+        return 'bool'
+    if isinstance(column_type, types.Integer):
+        return 'int'
+    if isinstance(column_type, (types.Numeric, types.Float)):
+        return 'float'
+    if isinstance(column_type, (types.DateTime, types.Date)):
+        return 'timestamp'
+    return 'text'
+
+
+def _microseconds(value):
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + \
+        delta.microseconds
+
+
+class _Writer(object):
+
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.position = 0
+
+    def section(self, data):
+        """Writes `data` on the next boundary; returns `[offset, size]`."""
+        if isinstance(data, np.ndarray):
+            data = data.tobytes()
+        padding = -self.position % ALIGN
+        self.outfile.write(b'\0' * padding)
+        offset = self.position + padding
+        self.outfile.write(data)
+        self.position = offset + len(data)
+        return [offset, len(data)]
+
+    def text(self, values):
+        """Writes strings as their UTF-8 joined end to end plus the
+        offsets between them, `len(values) + 1` of them."""
+        encoded = [value.encode('utf-8') for value in values]
+        ends = np.cumsum([0] + [len(value) for value in encoded])
+        dtype = '<u4' if ends[-1] < 2 ** 32 else '<u8'
+        return {'offsets': self.section(ends.astype(dtype)),
+                'offsets_dtype': dtype,
+                'data': self.section(b''.join(encoded))}
+
+    def column(self, column, values):
+        kind = _kind(column)
+        nulls = np.array([value is None for value in values], dtype='u1')
+        entry = {'name': column.name, 'kind': kind}
+        if nulls.any():
+            entry['nulls'] = self.section(nulls)
+        if kind == 'text':
+            entry.update(self.text(['' if value is None else str(value)
+                                    for value in values]))
+            return entry
+        if kind == 'bytes':
+            dtype = 'S{}'.format(column.type.length)
+            array = np.array([b'' if value is None else bytes(value)
+                              for value in values], dtype=dtype)
+        elif kind == 'float':
+            dtype = '<f8'
+            array = np.array([np.nan if value is None else float(value)
+                              for value in values], dtype=dtype)
+        elif kind == 'timestamp':
+            dtype = '<i8'
+            array = np.array([0 if value is None else _microseconds(value)
+                              for value in values], dtype=dtype)
+        else:
+            array = np.array([0 if value is None else int(value)
+                              for value in values], dtype='<i8')
+            dtype = '<i8'
+            if kind == 'bool':
+                dtype = 'u1'
+            elif not len(array) or (array.min() >= -2 ** 31 and
+                                    array.max() < 2 ** 31):
+                dtype = '<i4'
+            array = array.astype(dtype)
+        entry['dtype'] = dtype
+        entry['values'] = self.section(array)
+        return entry
+
+
+###############
+#### write ####
+###############
+
+def _read_table(connection, table):
+    columns = versioning.columns(table)
+    # Hashes come back as bytes rather than hex.
+    selected = [type_coerce(column, LargeBinary).label(column.name)
+                if isinstance(column.type, HexBinary) else column
+                for column in columns]
+    rows = connection.execute(
+        select(selected).order_by(table.c.id)).fetchall()
+    return columns, [[row[n] for row in rows] for n in range(len(columns))]
+
+
+def write(path, connection):
+    """Writes every synced table to a snapshot at `path`, with a sorted
+    index of cigar hashes and of the folded names of `NAMED` tables.
+
+    Returns the sync counter it is current to. The counter is read before
+    the rows, so rows changed while they are read are sent again by the
+    next `/sync`; clients apply changes by id, so that is harmless.
+    """
+    version = versioning.counter(connection, versioning.SYNC)
+    contents = {
+        'format': FORMAT,
+        'version': version,
+        'created': datetime.datetime.utcnow().isoformat(),
+        'tables': {},
+        'indexes': {},
+    }
+    with open(path + '.tmp', 'wb') as outfile:
+        outfile.write(HEADER.pack(MAGIC, FORMAT, 0))
+        writer = _Writer(outfile)
+        writer.position = HEADER.size
+        for name in versioning.SYNCED:
+            table = db.metadata.tables[name]
+            columns, values = _read_table(connection, table)
+            values = dict(zip([column.name for column in columns], values))
+            contents['tables'][name] = {
+                'rows': len(values['id']),
+                'columns': [writer.column(column, values[column.name])
+                            for column in columns],
+            }
+            if name == 'cigars':
+                hashes = np.array(
+                    [b'' if value is None else bytes(value)
+                     for value in values['hash']],
+                    dtype='S{}'.format(table.c.hash.type.length))
+                order = np.argsort(hashes, kind='mergesort')
+                contents['indexes']['cigars.hash'] = {
+                    'keys': writer.section(hashes[order]),
+                    'dtype': hashes.dtype.str,
+                    'rows': writer.section(order.astype('<u4')),
+                }
+            if name in NAMED:
+                names = [fold(value) for value in values['name']]
+                order = sorted(range(len(names)), key=names.__getitem__)
+                index = writer.text([names[n] for n in order])
+                index['rows'] = writer.section(np.array(order, dtype='<u4'))
+                contents['indexes'][name + '.name'] = index
+        encoded = json.dumps(contents, sort_keys=True).encode('utf-8')
+        # The contents go last; the header says where.
+        location = writer.section(encoded)
+        outfile.seek(0)
+        outfile.write(HEADER.pack(MAGIC, FORMAT, location[0]))
+    os.rename(path + '.tmp', path)
+    return version
+
+
+def latest(directory):
+    """The path and version of the newest snapshot in `directory`, or
+    `(None, None)`."""
+    found = []
+    for path in glob.glob(os.path.join(directory, 'snapshot-*.bin')):
+        match = FILENAME_PATTERN.search(path)
+        if match:
+            found.append((int(match.group(1)), path))
+    if not found:
+        return None, None
+    version, path = max(found)
+    return path, version
+
+
+def build(directory, connection, keep=2):
+    """Writes a snapshot into `directory` unless the newest one there is
+    current, then removes all but the `keep` newest. Returns its path and
+    version."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path, version = latest(directory)
+    if path is None or version < versioning.counter(connection,
+                                                  versioning.SYNC):
+        partial = os.path.join(directory,
+                               '.snapshot-{}.partial'.format(os.getpid()))
+        version = write(partial, connection)
+        path = os.path.join(directory, FILENAME.format(version))
+        os.rename(partial, path)
+    paths = sorted(glob.glob(os.path.join(directory, 'snapshot-*.bin')))
+    for old in paths[:-keep] if keep else []:
+        if old != path:
+            os.remove(old)
+    return path, version
+
+
+##############
+#### read ####
+##############
+
+class Snapshot(object):
+    """A snapshot file mapped into memory; arrays are views of the file,
+    so opening one costs nothing until it is read."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as infile:
+            self.map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, offset = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != FORMAT:
+            raise ValueError('{} is not a version {} snapshot.'.format(
+                path, FORMAT))
+        self.contents = json.loads(self.map[offset:].decode('utf-8'))
+        self.version = self.contents['version']
+        self.tables = self.contents['tables']
+
+    def close(self):
+        self.map.close()
+
+    def _array(self, section, dtype):
+        offset, size = section
+        return np.frombuffer(self.map, dtype=dtype,
+                             count=size // np.dtype(dtype).itemsize,
+                             offset=offset)
+
+    def _text(self, entry, position):
+        ends = self._array(entry['offsets'], entry['offsets_dtype'])
+        start = entry['data'][0]
+        return self.map[start + int(ends[position]):
+                        start + int(ends[position + 1])].decode('utf-8')
+
+    def _entry(self, table, name):
+        for entry in self.tables[table]['columns']:
+            if entry['name'] == name:
+                return entry
+        raise KeyError(name)
+
+    def column(self, table, name):
+        """The values of a fixed width column as an array."""
+        entry = self._entry(table, name)
+        return self._array(entry['values'], entry['dtype'])
+
+    def value(self, table, name, position):
+        entry = self._entry(table, name)
+        if 'nulls' in entry and \
+                self._array(entry['nulls'], 'u1')[position]:
+            return None
+        if entry['kind'] == 'text':
+            return self._text(entry, position)
+        value = self._array(entry['values'], entry['dtype'])[position]
+        if entry['kind'] == 'bytes':
+            # NumPy drops trailing zero bytes.
+            width = np.dtype(entry['dtype']).itemsize
+            return binascii.hexlify(
+                bytes(value).ljust(width, b'\0')).decode('ascii')
+        if entry['kind'] == 'timestamp':
+            return EPOCH + datetime.timedelta(microseconds=int(value))
+        if entry['kind'] == 'bool':
+            return bool(value)
+        return value.item()
+
+    def row(self, table, position):
+        return dict((entry['name'], self.value(table, entry['name'],
+                                               position))
+                    for entry in self.tables[table]['columns'])
+
+    def rows(self, table):
+        return [self.row(table, position)
+                for position in range(self.tables[table]['rows'])]
+
+    def position(self, table, id):
+        """The position of row `id`; rows are stored in id order."""
+        ids = self.column(table, 'id')
+        position = int(np.searchsorted(ids, id))
+        if position < len(ids) and ids[position] == id:
+            return position
+        return None
+
+    def find_cigar(self, hash):
+        """The cigar with hex digest `hash`, or None."""
+        index = self.contents['indexes']['cigars.hash']
+        keys = self._array(index['keys'], index['dtype'])
+        key = np.array(bytes.fromhex(hash), dtype=index['dtype'])
+        position = int(np.searchsorted(keys, key))
+        if position == len(keys) or keys[position] != key:
+            return None
+        return self.row('cigars',
+                        int(self._array(index['rows'], '<u4')[position]))
+
+    def find_names(self, table, prefix):
+        """The rows of `table` whose folded name starts with `prefix`."""
+        index = self.contents['indexes'][table + '.name']
+        rows = self._array(index['rows'], '<u4')
+        names = _Names(self, index, len(rows))
+        prefix = fold(prefix)
+        position = bisect.bisect_left(names, prefix)
+        found = []
+        while position < len(rows) and \
+                names[position].startswith(prefix):
+            found.append(self.row(table, int(rows[position])))
+            position += 1
+        return found
+
+
+class _Names(object):
+    # A sorted text index as a sequence `bisect` can search in place.
+
+    def __init__(self, snapshot, entry, length):
+        self.snapshot, self.entry, self.length = snapshot, entry, length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, position):
+        return self.snapshot._text(self.entry, position)
@@ -0,0 +1,93 @@
+# project/server/sync/views.py
+
+
+#################
+#### imports ####
+#################
+
+import os
+
+from flask import Blueprint, Response, current_app, jsonify, request, \
+    send_file, url_for
+from sqlalchemy import select
+
+from project.server import db, versioning
+from project.server.api.views import dumps
+from project.server.sync import snapshot
+
+
+################
+#### config ####
+################
+
+sync_blueprint = Blueprint('sync', __name__,)
+
+
+#################
+#### helpers ####
+#################
+
+def changes(connection, since):
+    """The rows of each synced table changed after the sync counter
+    `since`, and the ids deleted since, oldest change first."""
+    tables = {}
+    for name in versioning.SYNCED:
+        table = db.metadata.tables[name]
+        columns = versioning.columns(table)
+        rows = connection.execute(
+            select(columns).where(table.c.change > since)
+            .order_by(table.c.change, table.c.id)).fetchall()
+        if rows:
+            tables[name] = {'columns': [column.name for column in columns],
+                            'rows': [list(row) for row in rows]}
+    deleted = {}
+    gone = versioning.deletes
+    for name, row in connection.execute(
+            select([gone.c.table, gone.c.row]).where(gone.c.change > since)
+            .order_by(gone.c.change, gone.c.id)):
+        deleted.setdefault(name, []).append(row)
+    return tables, deleted
+
+
+################
+#### routes ####
+################
+
+@sync_blueprint.route('/sync')
+def sync():
+    """Without `since`, the newest snapshot file; with it, what changed
+    after that sync counter, to apply by id in table order."""
+    connection = db.session.connection()
+    reset = versioning.counter(connection, versioning.SYNC_RESET)
+    since = request.args.get('since')
+    if since is None:
+        directory = current_app.config['SNAPSHOT_DIR']
+        path, version = snapshot.latest(directory)
+        # An old snapshot is fine, `/sync?since=` brings it up to date,
+        # unless the tables were replaced after it.
+        if path is None or version < reset:
+            path, version = snapshot.build(
+                directory, connection, current_app.config['SNAPSHOT_KEEP'])
+        response = send_file(
+            os.path.abspath(path), mimetype='application/octet-stream',
+            as_attachment=True, attachment_filename=os.path.basename(path),
+            conditional=True)
+        response.headers['X-Sync-Version'] = str(version)
+        return response
+
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify(error='Invalid version.'), 400
+    version = versioning.counter(connection, versioning.SYNC)
+    if since > version:
+        return jsonify(error='Unknown version.', version=version), 400
+    if since < reset:
+        return jsonify(error='Too old to catch up; download a snapshot.',
+                       snapshot=url_for('sync.sync')), 410
+    tables, deleted = changes(connection, since)
+    response = Response(dumps({'since': since, 'version': version,
+                               'tables': tables, 'deleted': deleted}),
+                        mimetype='application/json')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
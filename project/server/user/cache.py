@@ -0,0 +1,195 @@
+# project/server/user/cache.py
+
+
+#################
+#### imports ####
+#################
+
+import datetime
+import json
+import threading
+from collections import namedtuple
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from project.server.cache import LRUCache
+from project.server.models import User
+
+
+##################
+#### snapshot ####
+##################
+
+class UserSnapshot(namedtuple('UserSnapshot',
+                              'id email admin registered_on')):
+    """A detached, read-only copy of a `User` for `current_user`.
+
+    It carries no password hash and never touches the database, so it is
+    safe to share between requests and threads.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.email, user.admin, user.registered_on)
+
+    def is_authenticated(self):
+        return True
+
+    def is_active(self):
+        return True
+
+    def is_anonymous(self):
+        return False
+
+    def get_id(self):
+        return self.id
+
+    def to_json(self):
+        return json.dumps([self.id, self.email, self.admin,
+                           self.registered_on.isoformat()])
+
+    @classmethod
+    def from_json(cls, data):
+        id, email, admin, registered_on = json.loads(data)
+        return cls(id, email, admin, datetime.datetime.strptime(
+            registered_on, '%Y-%m-%dT%H:%M:%S.%f'
+            if '.' in registered_on else '%Y-%m-%dT%H:%M:%S'))
+
+    def __repr__(self):
+        return '<User {0}>'.format(self.email)
+
+
+##################
+#### backends ####
+##################
+
+class LocalBackend(object):
+    """Per-process LRU with a TTL."""
+
+    def __init__(self, maxsize, ttl):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, user_id):
+        return self._cache.get(user_id)
+
+    def set(self, snapshot):
+        self._cache.set(snapshot.id, snapshot)
+
+    def delete(self, user_id):
+        self._cache.delete(user_id)
+
+    def clear(self):
+        self._cache.clear()
+
+
+class RedisBackend(object):
+    """Shared by every worker, so an invalidation is seen everywhere."""
+
+    prefix = 'cigardb:user:'
+
+    def __init__(self, url, ttl):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                'USER_CACHE_REDIS_URL is set but redis is not installed.')
+        self._client = redis.StrictRedis.from_url(url)
+        self._ttl = ttl
+
+    def get(self, user_id):
+        data = self._client.get(self.prefix + str(user_id))
+        if data is None:
+            return None
+        return UserSnapshot.from_json(data.decode('utf-8'))
+
+    def set(self, snapshot):
+        self._client.setex(self.prefix + str(snapshot.id), self._ttl,
+                           snapshot.to_json())
+
+    def delete(self, user_id):
+        self._client.delete(self.prefix + str(user_id))
+
+    def clear(self):
+        keys = list(self._client.scan_iter(self.prefix + '*'))
+        if keys:
+            self._client.delete(*keys)
+
+
+###############
+#### cache ####
+###############
+
+class UserCache(object):
+    """Caches `load_user` results as `UserSnapshot`s.
+
+    Entries are dropped after commit whenever a `User` row is updated or
+    deleted, including through the admin, and expire after
+    `USER_CACHE_TTL` seconds in any case.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._stale_key = 'stale_user_ids:{}'.format(id(self))
+        event.listen(User, 'after_update', self._changed)
+        event.listen(User, 'after_delete', self._changed)
+        event.listen(SignallingSession, 'after_commit', self._evict)
+        event.listen(SignallingSession, 'after_rollback', self._forget)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USER_CACHE_SIZE', 10000)
+        app.config.setdefault('USER_CACHE_TTL', 300)
+        app.config.setdefault('USER_CACHE_REDIS_URL', None)
+        if app.config['USER_CACHE_REDIS_URL']:
+            self.backend = RedisBackend(app.config['USER_CACHE_REDIS_URL'],
+                                        app.config['USER_CACHE_TTL'])
+        else:
+            self.backend = LocalBackend(app.config['USER_CACHE_SIZE'],
+                                        app.config['USER_CACHE_TTL'])
+        app.extensions['user_cache'] = self
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, user_id):
+        snapshot = self.backend.get(user_id)
+        if snapshot is not None:
+            with self._lock:
+                self.hits += 1
+            return snapshot
+        with self._lock:
+            self.misses += 1
+        user = User.query.filter(User.id == user_id).first()
+        if user is None:
+            return None
+        snapshot = UserSnapshot.from_user(user)
+        self.backend.set(snapshot)
+        return snapshot
+
+    def invalidate(self, user_id):
+        self.backend.delete(user_id)
+
+    def clear(self):
+        self.backend.clear()
+
+    def _changed(self, mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault(self._stale_key, set()).add(target.id)
+
+    def _evict(self, session):
+        for user_id in session.info.pop(self._stale_key, ()):
+            self.invalidate(user_id)
+
+    def _forget(self, session):
+        session.info.pop(self._stale_key, None)
@@ -9,7 +9,8 @@ from flask import render_template, Blueprint, url_for, \
     redirect, flash, request
 from flask_login import login_user, logout_user, login_required
 
-from project.server import bcrypt, db
+from project.server import db, hasher
+from project.server.hashing import HashingOverloaded
 from project.server.models import User
 from project.server.user.forms import LoginForm, RegisterForm
 
@@ -20,6 +21,29 @@ from project.server.user.forms import LoginForm, RegisterForm
 user_blueprint = Blueprint('user', __name__,)
 
 
+OVERLOADED_MESSAGE = 'The server is busy. Please try again in a moment.'
+# Top rated products shown with recommendations on the members page.
+FAVOURITES = 3
+SUGGESTIONS = 5
+
+
+#################
+#### helpers ####
+#################
+
+def rehash_if_needed(user, password):
+    """Re-hashes `password` when the configured bcrypt cost has changed
+    since `user` last logged in."""
+    if not hasher.needs_rehash(user.password):
+        return
+    try:
+        user.password = hasher.hash_password(password)
+    except HashingOverloaded:
+        return
+    db.session.commit()
+    hasher.metrics.rehashed += 1
+
+
 ################
 #### routes ####
 ################
@@ -28,10 +52,14 @@ user_blueprint = Blueprint('user', __name__,)
 def register():
     form = RegisterForm(request.form)
     if form.validate_on_submit():
-        user = User(
-            email=form.email.data,
-            password=form.password.data
-        )
+        try:
+            user = User(
+                email=form.email.data,
+                password=form.password.data
+            )
+        except HashingOverloaded:
+            flash(OVERLOADED_MESSAGE, 'danger')
+            return render_template('user/register.html', form=form), 503
         db.session.add(user)
         db.session.commit()
 
@@ -48,8 +76,14 @@ def login():
     form = LoginForm(request.form)
     if form.validate_on_submit():
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(
-                user.password, request.form['password']):
+        try:
+            valid = user and hasher.check_password(
+                user.password, request.form['password'])
+        except HashingOverloaded:
+            flash(OVERLOADED_MESSAGE, 'danger')
+            return render_template('user/login.html', form=form), 503
+        if valid:
+            rehash_if_needed(user, request.form['password'])
             login_user(user)
             flash('You are logged in. Welcome!', 'success')
             return redirect(url_for('user.members'))
@@ -70,4 +104,11 @@ def logout():
 @user_blueprint.route('/members')
 @login_required
 def members():
-    return render_template('user/members.html')
+    # The analytics import NumPy, so they load on first use rather than
+    # with the app.
+    from project.server.analytics import ratings, similar
+    favourites = [
+        dict(product, similar=similar.similar_to(product['id'], SUGGESTIONS))
+        for product in ratings.frame().leaderboard('product',
+                                                   limit=FAVOURITES)]
+    return render_template('user/members.html', favourites=favourites)
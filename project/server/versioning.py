@@ -0,0 +1,162 @@
+# project/server/versioning.py
+
+
+#################
+#### imports ####
+#################
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, literal, select
+from sqlalchemy.orm.attributes import set_committed_value
+
+from project.server import db
+from project.server.models import SyncDelete, TableVersion
+
+
+################
+#### config ####
+################
+
+versions = TableVersion.__table__
+deletes = SyncDelete.__table__
+
+# Tables offline clients keep a copy of, parents first. Each row's
+# `change` is the `SYNC` counter of the write that last touched it; a
+# write leaves it NULL and `bump` fills it in before the commit.
+SYNCED = ('brands', 'products', 'sizes', 'locations', 'cigars', 'ratings')
+SYNC = 'sync'
+# The sync counter at the last bulk replace; clients older than it start
+# over from a snapshot.
+SYNC_RESET = 'sync_reset'
+
+
+##################
+#### counters ####
+##################
+
+def _increment(connection, name):
+    result = connection.execute(
+        versions.update().where(versions.c.name == name)
+        .values(version=versions.c.version + 1)
+    )
+    if not result.rowcount:
+        connection.execute(versions.insert().values(name=name, version=1))
+
+
+def counter(connection, name):
+    """Reads the counter `name` on `connection`, 0 if never bumped."""
+    return connection.execute(
+        select([versions.c.version]).where(versions.c.name == name)
+    ).scalar() or 0
+
+
+def counters(connection, names):
+    """Reads the counters `names` on `connection` in one query, as a
+    dict; 0 for those never bumped."""
+    found = dict(connection.execute(
+        select([versions.c.name, versions.c.version])
+        .where(versions.c.name.in_(names))).fetchall())
+    return dict((name, found.get(name, 0)) for name in names)
+
+
+def set_counter(connection, name, value):
+    """Sets the counter `name` on `connection` to `value`."""
+    if not connection.execute(versions.update()
+                              .where(versions.c.name == name)
+                              .values(version=value)).rowcount:
+        connection.execute(versions.insert().values(name=name,
+                                                    version=value))
+
+
+def bump(connection, *names):
+    """Increments the change counter of each table in `names`, and stamps
+    their rows still waiting for a sync counter.
+
+    Writes that bypass the session (bulk loads, set-based updates) call
+    this themselves, leaving `change` NULL on the rows they touch; ORM
+    flushes are counted by the events below. Returns the sync counter the
+    rows were stamped with, if any.
+    """
+    names = set(names)
+    for name in sorted(names):
+        _increment(connection, name)
+    stamped = [name for name in SYNCED + (deletes.name,) if name in names]
+    if stamped:
+        # The counter row stays locked until the commit, so writers to
+        # synced tables commit in counter order and a client that has seen
+        # a counter has seen every change up to it.
+        _increment(connection, SYNC)
+        change = counter(connection, SYNC)
+        for name in stamped:
+            table = db.metadata.tables[name]
+            connection.execute(table.update().where(table.c.change.is_(None))
+                               .values(change=change))
+        return change
+    return None
+
+
+def columns(table):
+    """The columns of `table` other than its sync counter, which is
+    bookkeeping rather than data."""
+    return [column for column in table.columns if column.name != 'change']
+
+
+def record_deletes(connection, table, where):
+    """Records the ids of the rows of `table` matching `where` as deleted,
+    with one INSERT ... SELECT; for deletes that bypass the session, which
+    then `bump` `sync_deletes`."""
+    connection.execute(deletes.insert().from_select(
+        ['table', 'row'],
+        select([literal(table.name, type_=deletes.c.table.type),
+                table.c.id]).where(where)))
+
+
+def reset_sync(connection):
+    """Records that synced tables were replaced wholesale, so clients
+    can't catch up row by row."""
+    _increment(connection, SYNC)
+    set_counter(connection, SYNC_RESET, counter(connection, SYNC))
+
+
+def current(name):
+    """Returns the change counter of table `name`, 0 if never changed."""
+    version = db.session.query(TableVersion.version) \
+        .filter(TableVersion.name == name).scalar()
+    return version or 0
+
+
+def _synced(target):
+    return getattr(target, '__table__', None) is not None and \
+        target.__table__.name in SYNCED
+
+
+@event.listens_for(SignallingSession, 'before_flush')
+def _mark_changes(session, flush_context, instances):
+    for target in session.new:
+        if _synced(target):
+            target.change = None
+    for target in session.dirty:
+        if _synced(target) and \
+                session.is_modified(target, include_collections=False):
+            target.change = None
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _count_changes(session, flush_context):
+    names = set()
+    for target in session.new | session.deleted:
+        names.add(target.__table__.name)
+    for target in session.dirty:
+        if session.is_modified(target, include_collections=False):
+            names.add(target.__table__.name)
+    names.discard(versions.name)
+    gone = [{'table': target.__table__.name, 'row': target.id}
+            for target in session.deleted if _synced(target)]
+    if gone:
+        session.connection().execute(deletes.insert(), gone)
+        names.add(deletes.name)
+    if names:
+        change = bump(session.connection(), *names)
+        for target in session.new | session.dirty:
+            if _synced(target) and target.change is None:
+                set_committed_value(target, 'change', change)
@@ -3,22 +3,65 @@
 
 from flask_testing import TestCase
 
-from project.server import app, db
-from project.server.models import User
+from project.server import create_app, db, page_cache, user_cache
+
+from helpers import begin, create_user, empty_tables, reset_sequences, \
+    rollback
+
+
+app = create_app('project.server.config.TestingConfig')
+
+# Engines whose schema this process has built, by id.
+_built = set()
+
+
+def _build_schema():
+    """Recreates the tables and the fixture user once per process and
+    database."""
+    engine = db.engine
+    if id(engine) in _built:
+        return
+    db.drop_all()
+    db.create_all()
+    with engine.begin() as connection:
+        create_user(connection, 'ad@min.com', 'admin_user')
+    _built.add(id(engine))
 
 
 class BaseTestCase(TestCase):
+    """Runs each test in a transaction that is rolled back afterwards;
+    sessions commit to SAVEPOINTs inside it.
+
+    Tests that need their own connections, and so see only committed
+    data, set `transactional = False`; every table is emptied after them
+    instead.
+    """
+
+    transactional = True
 
     def create_app(self):
-        app.config.from_object('project.server.config.TestingConfig')
         return app
 
     def setUp(self):
-        db.create_all()
-        user = User(email="ad@min.com", password="admin_user")
-        db.session.add(user)
-        db.session.commit()
+        user_cache.clear()
+        # This process's copies only; a new generation would reach other
+        # test workers on the host.
+        page_cache.backend.clear()
+        _build_schema()
+        if not self.transactional:
+            return
+        self._connection = db.engine.connect()
+        self._transaction = begin(self._connection)
+        reset_sequences(self._connection)
+        db.session.remove()
+        db.savepoint_connection = self._connection
 
     def tearDown(self):
         db.session.remove()
-        db.drop_all()
+        if not self.transactional:
+            with db.engine.begin() as connection:
+                empty_tables(connection)
+                create_user(connection, 'ad@min.com', 'admin_user')
+            return
+        db.savepoint_connection = None
+        rollback(self._connection, self._transaction)
@@ -1 +1,71 @@
 # tests/helpers.py
+
+
+import datetime
+import functools
+
+from sqlalchemy import func, select, text
+
+from project.server import db, hasher
+from project.server.models import User
+
+
+@functools.lru_cache()
+def _password_hash(password, rounds):
+    return hasher.hash_password(password)
+
+
+def password_hash(password):
+    """bcrypt hash of `password`, computed once per process and cost."""
+    return _password_hash(password, hasher.rounds)
+
+
+def create_user(connection, email, password, admin=False):
+    """Inserts a user with a cached password hash; returns its id."""
+    users = User.__table__
+    return connection.execute(users.insert().values(
+        email=email, password=password_hash(password),
+        registered_on=datetime.datetime.now(), admin=admin
+    )).inserted_primary_key[0]
+
+
+def begin(connection):
+    """Begins the transaction a test runs in. pysqlite only opens
+    transactions before DML and never around a SAVEPOINT, so on SQLite
+    it is kept out of the way and BEGIN is sent directly."""
+    transaction = connection.begin()
+    if connection.dialect.name == 'sqlite':
+        connection.connection.isolation_level = None
+        connection.execute('BEGIN')
+    return transaction
+
+
+def rollback(connection, transaction):
+    """Undoes everything the test did and returns the connection."""
+    transaction.rollback()
+    if connection.dialect.name == 'sqlite':
+        connection.connection.isolation_level = ''
+    connection.close()
+
+
+def reset_sequences(connection):
+    """Points each id sequence past the current rows. PostgreSQL
+    sequences ignore rollbacks, and tests expect ids from 1."""
+    if connection.dialect.name != 'postgresql':
+        return
+    for table in db.metadata.sorted_tables:
+        if 'id' not in table.c or not table.c.id.autoincrement:
+            continue
+        connection.execute(
+            text("SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+                 ":next, false)"),
+            table=table.name,
+            next=connection.scalar(
+                select([func.coalesce(func.max(table.c.id), 0) + 1])))
+
+
+def empty_tables(connection):
+    """Deletes every row, children first."""
+    for table in reversed(db.metadata.sorted_tables):
+        connection.execute(table.delete())
+    reset_sequences(connection)
@@ -0,0 +1,138 @@
+# project/server/tests/parallel.py
+
+
+import copy
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine.url import make_url
+
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(os.path.dirname(TESTS))
+
+DIVIDER = '-' * 70
+
+
+def modules():
+    """(name, number of tests) for each test module, counted from the
+    source so nothing is imported."""
+    found = []
+    for filename in sorted(os.listdir(TESTS)):
+        if filename.startswith('test') and filename.endswith('.py'):
+            path = os.path.join(TESTS, filename)
+            with open(path, encoding='utf-8') as infile:
+                count = len(re.findall(r'^\s+def test', infile.read(), re.M))
+            found.append((filename[:-3], count))
+    return found
+
+
+def shard(found, workers):
+    """Deals modules, largest first, to whichever worker has the fewest
+    tests so far."""
+    shards = [[] for _ in range(workers)]
+    loads = [0] * workers
+    for name, count in sorted(found, key=lambda module: -module[1]):
+        n = loads.index(min(loads))
+        shards[n].append(name)
+        loads[n] += count
+    return [names for names in shards if names]
+
+
+def worker_url(url, n):
+    """Worker `n`'s database: `<file>-<n>.sqlite` next to a SQLite file,
+    `<database>_<n>` on the same PostgreSQL server."""
+    url = copy.copy(make_url(url))
+    if url.drivername.startswith('sqlite'):
+        if url.database and url.database != ':memory:':
+            root, extension = os.path.splitext(url.database)
+            url.database = '{}-{}{}'.format(root, n, extension)
+    else:
+        url.database = '{}_{}'.format(url.database or 'cigardb_test', n)
+    return url
+
+
+def create_database(url):
+    """Creates a PostgreSQL database unless it exists; SQLite creates
+    its files itself."""
+    if not url.drivername.startswith('postgresql'):
+        return
+    server = copy.copy(url)
+    server.database = 'postgres'
+    engine = create_engine(server, isolation_level='AUTOCOMMIT')
+    try:
+        with engine.connect() as connection:
+            exists = connection.scalar(
+                text('SELECT 1 FROM pg_database WHERE datname = :name'),
+                name=url.database)
+            if not exists:
+                connection.execute(
+                    'CREATE DATABASE "{}"'.format(url.database))
+    finally:
+        engine.dispose()
+
+
+def run(workers, url):
+    """Runs the test modules in `workers` processes, each against its own
+    database derived from `url`. Returns True if every test passed."""
+    started = time.time()
+    running = []
+    for n, names in enumerate(shard(modules(), workers), 1):
+        database = worker_url(url, n)
+        create_database(database)
+        env = dict(os.environ, CIGARDB_URL=str(database))
+        stdout, stderr = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'project.tests.parallel'] + names,
+            cwd=ROOT, env=env, stdout=stdout, stderr=stderr)
+        running.append((process, stdout, stderr))
+
+    totals = {'run': 0, 'failures': 0, 'errors': 0, 'skipped': 0}
+    for process, stdout, stderr in running:
+        process.wait()
+        stderr.seek(0)
+        sys.stderr.write(stderr.read().decode('utf-8', 'replace'))
+        stdout.seek(0)
+        lines = stdout.read().decode('utf-8', 'replace').splitlines()
+        try:
+            result = json.loads(lines[-1])
+        except (IndexError, ValueError):
+            # The worker died before reporting; count that as an error.
+            result = {'errors': 1}
+        for key in totals:
+            totals[key] += result.get(key, 0)
+
+    sys.stderr.write('{}\nRan {} tests in {:.3f}s across {} workers\n\n'
+                     .format(DIVIDER, totals['run'], time.time() - started,
+                             len(running)))
+    problems = ['{}={}'.format(key, totals[key])
+                for key in ('failures', 'errors') if totals[key]]
+    if problems:
+        sys.stderr.write('FAILED ({})\n'.format(', '.join(problems)))
+        return False
+    sys.stderr.write('OK\n')
+    return True
+
+
+def work(names):
+    """A worker: runs the modules `names` and reports the counts as JSON
+    on the last line of stdout."""
+    sys.path.insert(0, TESTS)
+    suite = unittest.defaultTestLoader.loadTestsFromNames(names)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    print(json.dumps({'run': result.testsRun,
+                      'failures': len(result.failures),
+                      'errors': len(result.errors),
+                      'skipped': len(result.skipped)}))
+    return 0 if result.wasSuccessful() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(work(sys.argv[1:]))
@@ -6,48 +6,61 @@ import unittest
 from flask import current_app
 from flask_testing import TestCase
 
-from project.server import app
+from project.server import create_app
 
 
 class TestDevelopmentConfig(TestCase):
 
     def create_app(self):
-        app.config.from_object('project.server.config.DevelopmentConfig')
-        return app
+        return create_app('project.server.config.DevelopmentConfig')
 
     def test_app_is_development(self):
         self.assertFalse(current_app.config['TESTING'])
-        self.assertTrue(app.config['DEBUG'] is True)
-        self.assertTrue(app.config['WTF_CSRF_ENABLED'] is False)
-        self.assertTrue(app.config['DEBUG_TB_ENABLED'] is True)
+        self.assertTrue(current_app.config['DEBUG'] is True)
+        self.assertTrue(current_app.config['WTF_CSRF_ENABLED'] is False)
+        self.assertTrue(current_app.config['DEBUG_TB_ENABLED'] is True)
         self.assertFalse(current_app is None)
 
 
 class TestTestingConfig(TestCase):
 
     def create_app(self):
-        app.config.from_object('project.server.config.TestingConfig')
-        return app
+        return create_app('project.server.config.TestingConfig')
 
     def test_app_is_testing(self):
         self.assertTrue(current_app.config['TESTING'])
-        self.assertTrue(app.config['DEBUG'] is True)
-        self.assertTrue(app.config['BCRYPT_LOG_ROUNDS'] == 4)
-        self.assertTrue(app.config['WTF_CSRF_ENABLED'] is False)
+        self.assertTrue(current_app.config['DEBUG'] is True)
+        self.assertTrue(current_app.config['BCRYPT_LOG_ROUNDS'] == 4)
+        self.assertTrue(current_app.config['WTF_CSRF_ENABLED'] is False)
 
 
 class TestProductionConfig(TestCase):
 
     def create_app(self):
-        app.config.from_object('project.server.config.ProductionConfig')
-        return app
+        return create_app('project.server.config.ProductionConfig')
 
     def test_app_is_production(self):
         self.assertFalse(current_app.config['TESTING'])
-        self.assertTrue(app.config['DEBUG'] is False)
-        self.assertTrue(app.config['DEBUG_TB_ENABLED'] is False)
-        self.assertTrue(app.config['WTF_CSRF_ENABLED'] is True)
-        self.assertTrue(app.config['BCRYPT_LOG_ROUNDS'] == 13)
+        self.assertTrue(current_app.config['DEBUG'] is False)
+        self.assertTrue(current_app.config['DEBUG_TB_ENABLED'] is False)
+        self.assertTrue(current_app.config['WTF_CSRF_ENABLED'] is True)
+        self.assertTrue(current_app.config['BCRYPT_LOG_ROUNDS'] == 13)
+
+
+
+class TestAdminDisabled(TestCase):
+
+    def create_app(self):
+        class Config(object):
+            TESTING = True
+            ADMIN_ENABLED = False
+            DEBUG_TB_ENABLED = False
+            SQLALCHEMY_TRACK_MODIFICATIONS = False
+        return create_app(Config)
+
+    def test_admin_is_not_registered(self):
+        self.assertNotIn('admin', current_app.extensions)
+        self.assertNotIn('admin', current_app.blueprints)
 
 
 if __name__ == '__main__':
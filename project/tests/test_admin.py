@@ -0,0 +1,246 @@
+# project/server/tests/test_admin.py
+
+
+import datetime
+import unittest
+
+from sqlalchemy import event
+
+from base import BaseTestCase
+from project.server import db, versioning
+from project.server.inventory import rollups, transfers, valuation
+from project.server.models import Brand, Inventory, InventoryRollup, \
+    Location, Product, Rating, Size, SyncDelete, Transfer, ValuationRollup
+from project.server.search.index import index
+
+
+class TestInventoryAdmin(BaseTestCase):
+
+    def setUp(self):
+        super(TestInventoryAdmin, self).setUp()
+        db.session.add_all([
+            Brand(id=1, name='Padron'),
+            Product(id=1, name='1964 Anniversary', brand=1),
+            Size(id=1, name='Robusto'),
+            Location(id=1, name='Tupperdor'),
+        ])
+        db.session.add_all([
+            Inventory(hash='{:08x}'.format(n), product=1, size=1, location=1)
+            for n in range(45)
+        ])
+        db.session.commit()
+        admin = self.app.extensions['admin'][0]
+        self.view = [v for v in admin._views
+                     if v.endpoint == 'inventory-admin'][0]
+
+    def count_queries(self, url):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            # The test's own SAVEPOINTs aren't the view's queries.
+            if 'SAVEPOINT' not in statement:
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return response, statements
+
+    def test_list_is_not_n_plus_one(self):
+        # Ensure related names come from the list query itself.
+        response, statements = self.count_queries('/admin/inventory-admin/')
+        self.assert200(response)
+        self.assertIn(b'1964 Anniversary', response.data)
+        self.assertIn(b'Tupperdor', response.data)
+        self.assertLessEqual(len(statements), 3)
+
+    def test_keyset_pages(self):
+        # Ensure pager links carry the key to seek past.
+        response = self.client.get('/admin/inventory-admin/')
+        self.assertIn(b'page=1&amp;after=20', response.data)
+        self.assertNotIn(b'00000014', response.data)
+        response = self.client.get('/admin/inventory-admin/?page=1&after=20')
+        self.assertIn(b'00000014', response.data)
+        self.assertNotIn(b'00000013', response.data)
+        self.assertIn(b'page=2&amp;after=40', response.data)
+        response = self.client.get('/admin/inventory-admin/?page=2&after=40')
+        self.assertIn(b'before=41', response.data)
+        with self.app.test_request_context('/?page=1&before=41'):
+            _, rows = self.view.get_list(1, None, False, None, None,
+                                         page_size=20)
+        self.assertEqual([c.id for c in rows], list(range(21, 41)))
+
+    def test_keys_survive_writes(self):
+        # Ensure deleting rows before a page doesn't shift it.
+        with self.app.test_request_context('/?page=1&after=20'):
+            _, before = self.view.get_list(1, None, False, None, None,
+                                           page_size=20)
+            db.session.delete(Inventory.query.get(3))
+            db.session.commit()
+            _, after = self.view.get_list(1, None, False, None, None,
+                                          page_size=20)
+        self.assertEqual([c.id for c in before], list(range(21, 41)))
+        self.assertEqual([c.id for c in after], list(range(21, 41)))
+
+    def test_page_without_key(self):
+        # Ensure a page number alone never falls back to OFFSET.
+        count, rows = self.view.get_list(2, None, False, None, None,
+                                         page_size=20)
+        self.assertEqual((count, rows), (45, []))
+
+    def test_estimated_count(self):
+        # Ensure large tables skip COUNT(*).
+        self.view.estimate_count_threshold = 10
+        try:
+            db.session.delete(Inventory.query.get(3))
+            db.session.commit()
+            self.assertEqual(self.view.estimated_count(), 45)
+        finally:
+            self.view.estimate_count_threshold = 10000
+
+    def test_search_falls_back(self):
+        # Ensure search still works through the stock query.
+        response = self.client.get('/admin/inventory-admin/?search=0000000a')
+        self.assert200(response)
+        self.assertIn(b'0000000a', response.data)
+
+    def test_search_hash_prefix(self):
+        # Ensure a hex prefix matches through the binary hash index.
+        count, rows = self.view.get_list(0, None, False, '0000002', None)
+        self.assertEqual(count, 13)
+        self.assertEqual(rows[0].hash, '00000020')
+        count, rows = self.view.get_list(0, None, False, 'xyz', None)
+        self.assertEqual((count, rows), (0, []))
+
+
+class TestBulkActions(BaseTestCase):
+
+    def setUp(self):
+        super(TestBulkActions, self).setUp()
+        db.session.add_all([
+            Brand(id=1, name='Padron'),
+            Brand(id=2, name='Tatuaje'),
+            Product(id=1, name='1964 Anniversary', brand=1),
+            Product(id=2, name='Havana VI', brand=2),
+            Size(id=1, name='Robusto'),
+            Size(id=2, name='Toro'),
+            Location(id=1, name='Tupperdor'),
+            Location(id=2, name='Cabinet'),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            Inventory(id=n, hash='{:08x}'.format(n), product=1 + n % 2,
+                      size=1, location=1,
+                      purchase_date=datetime.datetime(2016, 1 + n % 3, 1),
+                      purchase_price='8.00')
+            for n in range(1, 41)
+        ])
+        db.session.commit()
+        db.session.add_all([Rating(id=n, cigar=n, overall_score=20)
+                            for n in range(1, 11)])
+        db.session.commit()
+
+    def act(self, url, action, ids, **values):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            if 'SAVEPOINT' not in statement:
+                statements.append(statement)
+        data = dict(values, action=action, rowid=[str(id) for id in ids])
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.post(url, data=data)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return response, statements
+
+    def derived(self):
+        counts = sorted((row.dimension, row.key or 0, row.count, row.value)
+                        for row in InventoryRollup.query if row.count)
+        values = sorted((row.period, row.dimension, row.key or 0, row.start,
+                         row.spend, row.purchases, row.value)
+                        for row in ValuationRollup.query
+                        if row.spend or row.purchases or row.value)
+        return counts, values
+
+    def assertDerivedInStep(self):
+        kept = self.derived()
+        connection = db.session.connection()
+        rollups.rebuild(connection)
+        valuation.rebuild(connection)
+        self.assertEqual(kept, self.derived())
+
+    def test_move_asks_for_location(self):
+        # Ensure moving asks where to, then logs each transfer.
+        url = '/admin/inventory-admin/action/'
+        response, _ = self.act(url, 'move', [1, 2])
+        self.assert200(response)
+        self.assertIn(b'Cabinet', response.data)
+        self.assertIn(b'name="rowid" value="2"', response.data)
+
+        response, _ = self.act(url, 'move', [1, 2, 3], location=2)
+        self.assertStatus(response, 302)
+        self.assertEqual(Inventory.query.filter_by(location=2).count(), 3)
+        self.assertEqual(Transfer.query.filter_by(to_location=2).count(), 3)
+        self.assertDerivedInStep()
+
+    def test_constant_statements(self):
+        # Ensure statements grow with batches and rollup keys, not rows.
+        url = '/admin/inventory-admin/action/'
+        # The first of each creates the counters it bumps; the next few
+        # cigars span every brand and month.
+        self.act(url, 'resize', [1], size=2)
+        _, few = self.act(url, 'resize', [2, 3, 4, 5, 6, 7], size=2)
+        _, many = self.act(url, 'resize', range(8, 41), size=2)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(Inventory.query.filter_by(size=2).count(), 40)
+        self.act(url, 'delete', [1])
+        _, few = self.act(url, 'delete', [2, 3, 4, 5, 6, 7])
+        _, many = self.act(url, 'delete', range(8, 41))
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(Inventory.query.count(), 0)
+
+    def test_delete_cigars(self):
+        # Ensure deleted cigars leave their ratings and transfers behind.
+        transfers.move_cigars(['{:08x}'.format(n) for n in (1, 4)], 2)
+        db.session.commit()
+        since = versioning.counter(db.session.connection(), versioning.SYNC)
+        response, _ = self.act('/admin/inventory-admin/action/', 'delete',
+                               [1, 2, 3, 99])
+        self.assertStatus(response, 302)
+        self.assertEqual(Inventory.query.count(), 37)
+        self.assertIsNone(Rating.query.get(1).cigar)
+        self.assertEqual(Transfer.query.filter_by(cigar=None).count(), 1)
+        self.assertEqual(
+            sorted(row.row for row in SyncDelete.query
+                   .filter(SyncDelete.change > since)
+                   .filter_by(table='cigars')), [1, 2, 3])
+        self.assertDerivedInStep()
+
+    def test_delete_products(self):
+        # Ensure a deleted product's cigars move to no brand.
+        index.update('product', 2, 'Havana VI', 2)
+        response, _ = self.act('/admin/product-admin/action/', 'delete', [2])
+        self.assertStatus(response, 302)
+        self.assertIsNone(Product.query.get(2))
+        self.assertEqual(Inventory.query.filter_by(product=None).count(), 20)
+        self.assertEqual(rollups.counts('brand'), [
+            {'id': None, 'name': None, 'count': 20, 'value': 160.0},
+            {'id': 1, 'name': 'Padron', 'count': 20, 'value': 160.0}])
+        self.assertNotIn(2, [entry['id'] for entry in index.search('hav')])
+        self.assertDerivedInStep()
+
+    def test_ratings(self):
+        # Ensure ratings can be re-scored and deleted together.
+        url = '/admin/rating-admin/action/'
+        response, _ = self.act(url, 'rerate', range(1, 6), score=25)
+        self.assertStatus(response, 302)
+        self.assertEqual(Rating.query.filter_by(overall_score=25).count(), 5)
+        response, _ = self.act(url, 'delete', range(4, 11))
+        self.assertStatus(response, 302)
+        self.assertEqual([rating.id for rating in Rating.query], [1, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
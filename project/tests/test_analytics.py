@@ -0,0 +1,89 @@
+# project/server/tests/test_analytics.py
+
+
+import unittest
+
+from base import BaseTestCase
+from project.server import db
+from project.server.analytics import ratings
+from project.server.models import Brand, Inventory, Product, Rating, Size
+
+
+class TestRatingAnalytics(BaseTestCase):
+
+    def setUp(self):
+        super(TestRatingAnalytics, self).setUp()
+        db.session.add_all([
+            Brand(id=1, name='Padron'),
+            Brand(id=2, name='Tatuaje'),
+            Product(id=1, name='1964 Anniversary', brand=1),
+            Product(id=2, name='Havana VI', brand=2),
+            Size(id=1, name='Robusto'),
+            Size(id=2, name='Toro'),
+            Inventory(id=1, hash='aa', product=1, size=1),
+            Inventory(id=2, hash='bb', product=1, size=2),
+            Inventory(id=3, hash='cc', product=2, size=1),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            Rating(cigar=1, app_score=15, smoke_score=20, overall_score=25),
+            Rating(cigar=2, app_score=13, smoke_score=18, overall_score=23),
+            Rating(cigar=3, app_score=12, overall_score=20),
+            Rating(cigar=3, app_score=14, overall_score=21),
+        ])
+        db.session.commit()
+
+    def test_summary(self):
+        # Ensure missing scores are left out of the aggregates.
+        summary = ratings.frame().summary()
+        self.assertEqual(summary['app_score']['count'], 4)
+        self.assertEqual(summary['smoke_score']['count'], 2)
+        self.assertEqual(summary['overall_score']['percentiles']['50'], 22.0)
+        self.assertEqual(summary['taste_score'], {'count': 0})
+
+    def test_distribution(self):
+        # Ensure scores are binned by value.
+        self.assertEqual(ratings.frame().distribution('smoke_score'),
+                         [{'score': 18, 'count': 1},
+                          {'score': 20, 'count': 1}])
+
+    def test_leaderboards(self):
+        # Ensure groups are ranked by mean score.
+        brands = ratings.frame().leaderboard('brand')
+        self.assertEqual([(b['name'], b['mean'], b['count']) for b in brands],
+                         [('Padron', 24.0, 2), ('Tatuaje', 20.5, 2)])
+        sizes = ratings.frame().leaderboard('size', min_ratings=2)
+        self.assertEqual([s['name'] for s in sizes], ['Robusto'])
+
+    def test_frame_reloads_on_new_ratings(self):
+        # Ensure the cached frame is kept until ratings change.
+        frame = ratings.frame()
+        self.assertIs(ratings.frame(), frame)
+        db.session.add(Rating(cigar=1, overall_score=10))
+        db.session.commit()
+        self.assertIsNot(ratings.frame(), frame)
+        self.assertEqual(len(ratings.frame()), 5)
+
+    def test_routes(self):
+        # Ensure the analytics are served by the api.
+        response = self.client.get('/api/ratings/leaderboard/brand')
+        self.assertEqual(response.json['rows'][0]['name'], 'Padron')
+        response = self.client.get('/api/ratings/summary')
+        self.assertEqual(response.json['ratings'], 4)
+        self.assert404(self.client.get('/api/ratings/leaderboard/colour'))
+
+    def test_leaderboard_arguments(self):
+        # Ensure odd limits are clamped and don't grow the memo.
+        frame = ratings.frame()
+        for query in ('limit=-1', 'limit=1', 'limit=5&min=-3', 'min=2'):
+            response = self.client.get(
+                '/api/ratings/leaderboard/brand?' + query)
+            self.assertGreaterEqual(len(response.json['rows']), 1)
+        response = self.client.get('/api/ratings/leaderboard/brand?limit=-1')
+        self.assertEqual([row['name'] for row in response.json['rows']],
+                         ['Padron'])
+        self.assertEqual(len(frame._results), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# project/server/tests/test_api.py
+
+
+import json
+import unittest
+
+from base import BaseTestCase
+from project.server import db, versioning
+from project.server.models import Brand
+
+
+class TestApiBlueprint(BaseTestCase):
+
+    def setUp(self):
+        super(TestApiBlueprint, self).setUp()
+        db.session.add_all([Brand(name='Brand {}'.format(n))
+                            for n in range(5)])
+        db.session.commit()
+
+    def get_json(self, url, **kwargs):
+        response = self.client.get(url, **kwargs)
+        return response, json.loads(response.data.decode('utf-8'))
+
+    def test_list_pages_with_cursor(self):
+        # Ensure cursors walk the table without gaps or repeats.
+        response, page = self.get_json('/api/brands?limit=2')
+        self.assert200(response)
+        names = [row['name'] for row in page['data']]
+        while page['next']:
+            _, page = self.get_json(
+                '/api/brands?limit=2&cursor=' + page['next'])
+            names.extend(row['name'] for row in page['data'])
+        self.assertEqual(names, ['Brand {}'.format(n) for n in range(5)])
+
+    def test_fields_projection(self):
+        # Ensure only the requested columns are returned.
+        _, page = self.get_json('/api/brands?fields=name&limit=1')
+        self.assertEqual(page['data'], [{'name': 'Brand 0'}])
+        response, _ = self.get_json('/api/brands?fields=colour')
+        self.assert400(response)
+
+    def test_conditional_get(self):
+        # Ensure unchanged tables answer 304 until they change.
+        response = self.client.get('/api/brands')
+        etag = response.headers['ETag']
+        response = self.client.get(
+            '/api/brands', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        db.session.add(Brand(name='Oliva'))
+        db.session.commit()
+        response = self.client.get(
+            '/api/brands', headers={'If-None-Match': etag})
+        self.assert200(response)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_version_counter(self):
+        # Ensure flushes bump the counter of the changed table.
+        version = versioning.current('brands')
+        Brand.query.get(1).name = 'Padron'
+        db.session.commit()
+        self.assertEqual(versioning.current('brands'), version + 1)
+
+    def test_get_resource(self):
+        # Ensure single rows can be fetched.
+        response, row = self.get_json('/api/brands/2')
+        self.assertEqual(row, {'id': 2, 'name': 'Brand 1'})
+        self.assert404(self.client.get('/api/brands/99'))
+        self.assert404(self.client.get('/api/humidors'))
+
+
+if __name__ == '__main__':
+    unittest.main()
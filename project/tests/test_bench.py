@@ -0,0 +1,87 @@
+# project/server/tests/test_bench.py
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from base import BaseTestCase
+from project.server import bench
+from project.server.models import User
+
+
+class TestBench(BaseTestCase):
+
+    # The benchmark points the session at databases of its own.
+    transactional = False
+
+    def setUp(self):
+        super(TestBench, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super(TestBench, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_generate_is_deterministic(self):
+        # Ensure the same size and seed give the same fixtures.
+        bench.generate(os.path.join(self.directory, 'a'), 100)
+        bench.generate(os.path.join(self.directory, 'b'), 100)
+        for name in ('cigars.csv', 'ratings.csv', 'transfers.csv'):
+            with open(os.path.join(self.directory, 'a', name)) as a, \
+                    open(os.path.join(self.directory, 'b', name)) as b:
+                self.assertEqual(a.read(), b.read())
+        with open(os.path.join(self.directory, 'a', 'cigars.csv')) as f:
+            self.assertEqual(len(f.readlines()), 101)
+
+    def test_percentiles(self):
+        # Ensure percentiles use the nearest rank.
+        summary = bench.summarize([float(n) for n in range(1, 101)])
+        self.assertEqual((summary['p50'], summary['p95'], summary['p99']),
+                         (50.0, 95.0, 99.0))
+
+    def test_compare(self):
+        # Ensure only p95s beyond the tolerance count as regressions.
+        def report(p95):
+            return {'runs': [{'database': 'sqlite', 'size': 10,
+                              'results': {'lookup.cold': {'p95': p95}}}]}
+        self.assertEqual(bench.compare(report(1.2), report(1.0)), [])
+        self.assertEqual(bench.compare(report(1.3), report(1.0)),
+                         [('sqlite', 10, 'lookup.cold', 1.0, 1.3)])
+        self.assertEqual(bench.compare(report(1.3), {}), [])
+
+    def test_run(self):
+        # Ensure a run times every hot path and leaves the app's db alone.
+        url = 'sqlite:///' + os.path.join(self.directory, 'bench.sqlite')
+        report = bench.bench([url, 'postgresql://localhost:1/none'], [50],
+                             samples=5, startup_samples=0)
+        results = report['runs'][0]['results']
+        self.assertGreater(results['load_data']['rows'], 50)
+        for name in ('dump_data', 'load_user.warm', 'lookup.cold',
+                     'rollups.brand', 'admin.inventory_list',
+                     'join.hash_text', 'join.cigar_id'):
+            self.assertIn('p99', results[name])
+        sizes = report['runs'][0]['index_bytes']
+        self.assertGreater(sizes['text']['ix_legacy_cigars_hash'], 0)
+        self.assertGreater(sizes['binary']['ix_cigars_hash'], 0)
+        self.assertEqual(len(report['skipped']), 1)
+        self.assertEqual(User.query.count(), 1)
+
+    def test_startup(self):
+        # Ensure start-up is timed in fresh interpreters.
+        results = bench.startup(samples=1)
+        self.assertEqual(sorted(results), ['startup.cli',
+                                           'startup.create_app',
+                                           'startup.import'])
+        self.assertGreater(results['startup.cli']['p50'], 0)
+
+    def test_refuses_configured_database(self):
+        # Ensure the benchmark never drops the app's own tables.
+        with self.assertRaises(ValueError):
+            with bench.use_database(self.app.config['SQLALCHEMY_DATABASE_URI']):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+# project/server/tests/test_caching.py
+
+
+import gzip
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from flask import render_template_string
+
+from base import BaseTestCase
+from project.server import page_cache
+from project.server.assets import build as assets
+from project.server.assets.build import build, fingerprint
+from project.server.assets.views import asset_url
+from project.server.caching import FileBackend
+
+
+class TestPageCache(BaseTestCase):
+
+    def login(self):
+        return self.client.post(
+            '/login', data=dict(email='ad@min.com', password='admin_user'),
+            follow_redirects=True)
+
+    def test_page_is_cached(self):
+        # Ensure the second anonymous hit is served from the cache.
+        first = self.client.get('/')
+        second = self.client.get('/')
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(second.mimetype, 'text/html')
+
+    def test_query_string_is_ignored(self):
+        # Ensure made-up query strings share the page's one entry.
+        self.client.get('/')
+        response = self.client.get('/?x=1')
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+
+    def test_clear_reaches_other_processes(self):
+        # Ensure a new generation written elsewhere retires cached pages.
+        directory = tempfile.mkdtemp(prefix='cigardb-cache-')
+        stamp, page_cache.stamp = page_cache.stamp, \
+            os.path.join(directory, 'generation')
+        try:
+            page_cache._checked = 0
+            self.client.get('/')
+            self.assertEqual(self.client.get('/').headers['X-Cache'], 'HIT')
+            with open(page_cache.stamp, 'w') as outfile:
+                outfile.write('elsewhere')
+            self.assertEqual(self.client.get('/').headers['X-Cache'], 'HIT')
+            page_cache._checked = 0
+            self.assertEqual(self.client.get('/').headers['X-Cache'], 'MISS')
+        finally:
+            page_cache.stamp, page_cache._checked = stamp, 0
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def test_key_varies_by_login_state(self):
+        # Ensure a logged in visitor doesn't get the anonymous copy.
+        self.client.get('/')
+        with self.client:
+            self.login()
+            response = self.client.get('/')
+            self.assertEqual(response.headers['X-Cache'], 'MISS')
+            self.assertIn(b'Logout', response.data)
+            self.assertNotIn(b'Register/Login', response.data)
+
+    def test_flashes_bypass_cache(self):
+        # Ensure pages showing flashed messages are rendered and not kept.
+        self.client.get('/')
+        with self.client:
+            self.login()
+            response = self.client.get('/logout', follow_redirects=True)
+            self.assertIn(b'You were logged out. Bye!', response.data)
+        response = self.client.get('/')
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertNotIn(b'You were logged out', response.data)
+
+    def test_error_page_is_cached_by_status(self):
+        # Ensure every missing URL shares one cached 404 page.
+        self.client.get('/missing')
+        response = self.client.get('/also-missing')
+        self.assert404(response)
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+
+    def test_fragment_is_cached(self):
+        # Ensure a fragment body renders once per key.
+        template = "{% cache 'test', 1 %}{{ value }}{% endcache %}"
+        with self.app.test_request_context('/'):
+            self.assertEqual(render_template_string(template, value=1), '1')
+            self.assertEqual(render_template_string(template, value=2), '1')
+
+
+class TestFileBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='cigardb-cache-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_round_trip(self):
+        # Ensure values survive a new backend on the same directory.
+        FileBackend(self.directory).set('key', (b'body', 200))
+        backend = FileBackend(self.directory)
+        self.assertEqual(backend.get('key'), (b'body', 200))
+        self.assertIsNone(backend.get('other'))
+        self.assertEqual((backend.hits, backend.misses), (1, 1))
+
+    def test_expiry(self):
+        # Ensure expired entries are misses.
+        backend = FileBackend(self.directory, ttl=0.01)
+        backend.set('key', 'value')
+        time.sleep(0.02)
+        self.assertIsNone(backend.get('key'))
+
+    def test_clear(self):
+        # Ensure clear empties the directory of entries.
+        backend = FileBackend(self.directory)
+        backend.set('key', 'value')
+        backend.clear()
+        self.assertIsNone(backend.get('key'))
+
+
+class TestAssets(BaseTestCase):
+
+    def setUp(self):
+        super(TestAssets, self).setUp()
+        self.dist = tempfile.mkdtemp(prefix='cigardb-assets-')
+        self.previous = self.app.config['ASSETS_DIST']
+        self.app.config['ASSETS_DIST'] = self.dist
+        self.manifest = build(self.app.static_folder, self.dist,
+                              self.app.config['ASSETS'])
+
+    def tearDown(self):
+        super(TestAssets, self).tearDown()
+        self.app.config['ASSETS_DIST'] = self.previous
+        shutil.rmtree(self.dist, ignore_errors=True)
+
+    def test_build(self):
+        # Ensure assets are fingerprinted and precompressed.
+        css = self.manifest['main.css']
+        with open(os.path.join(self.app.static_folder, 'main.css'),
+                  'rb') as infile:
+            data = infile.read()
+        self.assertEqual(css, fingerprint('main.css', data))
+        with gzip.open(os.path.join(self.dist, css + '.gz')) as infile:
+            self.assertEqual(infile.read(), data)
+
+    def test_pages_link_fingerprinted_assets(self):
+        # Ensure templates point at the built names.
+        response = self.client.get('/')
+        self.assertIn('/assets/{}'.format(self.manifest['main.js'])
+                      .encode('ascii'), response.data)
+
+    def test_build_by_another_process(self):
+        # Ensure a manifest replaced on disk is picked up without restart.
+        path = os.path.join(self.dist, 'manifest.json')
+        with open(path + '.new', 'w') as outfile:
+            outfile.write('{"main.js": "main.0123456789ab.js"}')
+        os.replace(path + '.new', path)
+        with self.app.test_request_context('/'):
+            self.assertEqual(asset_url('main.js'), '/assets/' +
+                             self.manifest['main.js'])
+            checked, version, found = assets._manifests[self.dist]
+            assets._manifests[self.dist] = (0, version, found)
+            self.assertEqual(asset_url('main.js'),
+                             '/assets/main.0123456789ab.js')
+
+    def test_served_gzipped_and_immutable(self):
+        # Ensure built assets are sent precompressed with long-lived caching.
+        response = self.client.get(
+            '/assets/' + self.manifest['main.css'],
+            headers={'Accept-Encoding': 'gzip'})
+        self.assert200(response)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+
+    def test_served_plain(self):
+        # Ensure clients without gzip get the original bytes.
+        response = self.client.get('/assets/' + self.manifest['main.js'])
+        self.assert200(response)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn(b'Sanity Check', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
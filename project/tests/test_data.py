@@ -0,0 +1,148 @@
+# project/server/tests/test_data.py
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from base import BaseTestCase
+from project.server import db
+from project.server.data import dumper, loader
+from project.server.models import Brand, Inventory, Product, Rating
+
+
+class TestLoader(BaseTestCase):
+
+    # The loader and dumper use connections of their own.
+    transactional = False
+
+    def setUp(self):
+        super(TestLoader, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestLoader, self).tearDown()
+
+    def write(self, name, text):
+        with open(os.path.join(self.directory, name), 'w') as outfile:
+            outfile.write(text)
+
+    def test_normalize_header(self):
+        # Ensure CSV headers map onto column names.
+        self.assertEqual(loader.normalize_header('Purchase Price'),
+                         'purchase_price')
+        self.assertEqual(loader.normalize_header('Hash'), 'hash')
+
+    def test_load_directory(self):
+        # Ensure fixtures load in foreign-key order and in chunks.
+        self.write('cigars.csv', (
+            'id,Hash,Product,Size,Purchase Date,Purchase Price,Location\n'
+            '1,088ec60b,1,,2016-09-23 00:00:00.000000,6.99,\n'
+            '2,cdffc40f,1,,2016-09-23 00:00:00.000000,7.79,\n'
+            '3,8797b639,1,,2016-09-23 00:00:00.000000,7.29,\n'
+        ))
+        self.write('products.csv', 'id,name,brand\n1,Nica Puro,1\n')
+        self.write('brands.csv', 'id,name\n1,Drew Estate\n')
+        self.write('unknown.csv', 'id\n1\n')
+
+        results, skipped = loader.load_directory(
+            self.directory, chunk_size=2)
+
+        self.assertEqual([r.table for r in results],
+                         ['brands', 'products', 'cigars'])
+        self.assertEqual(results[-1].rows, 3)
+        self.assertEqual(skipped, ['unknown'])
+        self.assertEqual(Brand.query.count(), 1)
+        self.assertEqual(Product.query.get(1).brand, 1)
+        self.assertEqual(Inventory.query.get(2).hash, 'cdffc40f')
+
+    def test_hash_references(self):
+        # Ensure older files that name cigars by hash load as ids.
+        self.write('cigars.csv', 'id,hash\n7,088EC60B\n8,cdffc40f\n')
+        self.write('ratings.csv', 'id,hash,overall_score\n1,cdffc40f,20\n')
+        loader.load_directory(self.directory)
+        self.assertEqual(Rating.query.one().cigar, 8)
+
+        self.write('ratings.csv', 'id,hash\n2,8797b639\n')
+        with self.assertRaises(ValueError) as context:
+            loader.load_directory(self.directory, only=['ratings'])
+        self.assertIn('8797b639', str(context.exception))
+
+    def test_replace(self):
+        # Ensure --replace empties the table before loading.
+        self.write('brands.csv', 'id,name\n1,Drew Estate\n')
+        loader.load_directory(self.directory)
+        loader.load_directory(self.directory, replace=True)
+        self.assertEqual(db.session.query(Brand).count(), 1)
+
+    def test_bad_value_reports_line(self):
+        # Ensure conversion errors name the file and line.
+        self.write('brands.csv', 'id,name\nabc,Drew Estate\n')
+        with self.assertRaises(ValueError) as context:
+            loader.load_directory(self.directory)
+        self.assertIn('brands.csv:2', str(context.exception))
+
+
+class TestDumper(BaseTestCase):
+
+    # The loader and dumper use connections of their own.
+    transactional = False
+
+    def setUp(self):
+        super(TestDumper, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        db.session.add_all([Brand(name='Padron'), Brand(name='Tatuaje')])
+        db.session.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestDumper, self).tearDown()
+
+    def read(self, path):
+        with loader.open_csv(path) as infile:
+            return infile.read().splitlines()
+
+    def test_dump_table(self):
+        # Ensure a table is streamed to CSV in small batches.
+        result = dumper.dump_table(
+            db.engine, 'brands', self.directory, fetch_size=1)
+        self.assertEqual(result.rows, 2)
+        self.assertEqual(result.mark, 2)
+        self.assertEqual(self.read(result.path),
+                         ['id,name', '1,Padron', '2,Tatuaje'])
+
+    def test_dump_gzip(self):
+        # Ensure gzip output can be read back by the loader.
+        result = dumper.dump_table(
+            db.engine, 'brands', self.directory, compress=True)
+        self.assertTrue(result.path.endswith('brands.csv.gz'))
+        self.assertEqual(len(self.read(result.path)), 3)
+
+    def test_dump_database_incremental(self):
+        # Ensure incremental dumps only export rows above the mark.
+        dumper.dump_database(self.directory, only=['brands', 'users'])
+        db.session.add(Brand(name='Oliva'))
+        db.session.commit()
+
+        results = dumper.dump_database(
+            self.directory, incremental=True, only=['brands', 'users'])
+        by_table = dict((r.table, r) for r in results)
+        self.assertEqual(by_table['brands'].rows, 1)
+        self.assertEqual(self.read(by_table['brands'].path),
+                         ['id,name', '3,Oliva'])
+        self.assertIsNone(by_table['users'].path)
+        self.assertEqual(dumper.read_state(self.directory),
+                         {'brands': 3, 'users': 1})
+
+    def test_dump_database_skips_search_index(self):
+        # Ensure the notes search tables are left out of a full dump.
+        tables = [r.table for r in dumper.dump_database(self.directory)]
+        self.assertIn('ratings', tables)
+        self.assertFalse([name for name in tables
+                          if name.startswith('rating_notes')])
+
+
+if __name__ == '__main__':
+    unittest.main()
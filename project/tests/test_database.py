@@ -0,0 +1,140 @@
+# project/server/tests/test_database.py
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, exc
+
+from base import BaseTestCase
+from project.server import create_app, db
+from project.server.config import TestingConfig
+from project.server.database import LAG_QUERIES, PINNED, PoolStats, \
+    Replica, TimedQueuePool
+from project.server.models import Location
+
+
+replica_directory = tempfile.mkdtemp(prefix='cigardb-replica-')
+replica_url = 'sqlite:///' + os.path.join(replica_directory, 'replica.sqlite')
+
+
+class ReplicaConfig(TestingConfig):
+    SQLALCHEMY_REPLICA_URIS = [replica_url]
+    REPLICA_CHECK_INTERVAL = 0
+
+
+app = create_app(ReplicaConfig)
+
+
+class TestRouting(BaseTestCase):
+
+    def create_app(self):
+        return app
+
+    def setUp(self):
+        super(TestRouting, self).setUp()
+        self.router = self.app.extensions['router']
+        self.replica = create_engine(replica_url)
+        db.metadata.create_all(self.replica)
+        self.replica.execute(Location.__table__.insert().values(
+            name='Replica'))
+        db.session.add(Location(name='Primary'))
+        db.session.commit()
+        db.session.remove()
+
+    def tearDown(self):
+        super(TestRouting, self).tearDown()
+        db.metadata.drop_all(self.replica)
+        self.replica.dispose()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(replica_directory, ignore_errors=True)
+
+    def names(self):
+        return [location.name for location in Location.query.all()]
+
+    def test_reads_go_to_replica(self):
+        # Ensure plain queries are answered by the replica.
+        routed = self.router.routed['replica_0']
+        self.assertEqual(self.names(), ['Replica'])
+        self.assertEqual(self.router.routed['replica_0'], routed + 1)
+
+    def test_write_pins_primary(self):
+        # Ensure reads after a commit in the same session see the write.
+        db.session.add(Location(name='Humidor'))
+        db.session.commit()
+        self.assertTrue(db.session.info[PINNED])
+        self.assertEqual(self.names(), ['Primary', 'Humidor'])
+
+    def test_locking_read_uses_primary(self):
+        # Ensure SELECT ... FOR UPDATE goes to the primary.
+        locations = Location.query.with_for_update().all()
+        self.assertEqual([location.name for location in locations],
+                         ['Primary'])
+
+    def test_lagging_replica_falls_back(self):
+        # Ensure a replica further behind than REPLICA_MAX_LAG is skipped.
+        LAG_QUERIES['sqlite'] = 'SELECT 60'
+        try:
+            self.assertEqual(self.names(), ['Primary'])
+        finally:
+            del LAG_QUERIES['sqlite']
+        self.assertEqual(self.router.replicas[0].lag, 60)
+
+    def test_unreachable_replica_falls_back(self):
+        # Ensure a replica that can't be reached is skipped.
+        missing = os.path.join(replica_directory, 'missing', 'x.sqlite')
+        replica = self.router.replicas[0]
+        self.router.replicas[0] = Replica('replica_0', 'sqlite:///' + missing)
+        try:
+            self.assertEqual(self.names(), ['Primary'])
+            self.assertFalse(self.router.replicas[0].healthy)
+        finally:
+            self.router.replicas[0] = replica
+
+    def test_metrics(self):
+        # Ensure pool and routing figures are exposed.
+        self.names()
+        response = self.client.get(
+            '/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'})
+        self.assertIn(b'cigardb_db_pool_checkouts_total{pool="primary"}',
+                      response.data)
+        self.assertIn(b'cigardb_db_sessions_routed_total{target="replica_0"}',
+                      response.data)
+        self.assertIn(b'cigardb_db_replica_lag_seconds{replica="replica_0"} 0',
+                      response.data)
+
+
+class TestPool(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(
+            'sqlite://', poolclass=TimedQueuePool, pool_size=1,
+            max_overflow=0, pool_timeout=0.01)
+        self.stats = self.engine.pool.stats = PoolStats('test')
+
+    def test_checkouts_are_timed(self):
+        # Ensure each checkout is counted with its wait, across dispose().
+        self.engine.execute('SELECT 1')
+        self.engine.dispose()
+        self.engine.execute('SELECT 1')
+        self.assertEqual(self.stats.checkouts, 2)
+        self.assertEqual(self.stats.wait.count, 2)
+        self.assertIs(self.engine.pool.stats, self.stats)
+
+    def test_timeouts_are_counted(self):
+        # Ensure a checkout that gives up is counted.
+        connection = self.engine.connect()
+        try:
+            with self.assertRaises(exc.TimeoutError):
+                self.engine.connect()
+        finally:
+            connection.close()
+        self.assertEqual(self.stats.timeouts, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
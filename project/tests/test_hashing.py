@@ -0,0 +1,83 @@
+# project/server/tests/test_hashing.py
+
+
+import time
+import unittest
+
+from base import BaseTestCase
+from project.server import hasher
+from project.server.hashing import HashingOverloaded, PasswordHasher
+from project.server.models import User
+
+
+class TestPasswordHasher(BaseTestCase):
+
+    def test_hash_and_check(self):
+        # Ensure hashes verify and record metrics.
+        checks = hasher.metrics.latency['check'].count
+        pw_hash = hasher.hash_password('cohiba')
+        self.assertTrue(hasher.check_password(pw_hash, 'cohiba'))
+        self.assertFalse(hasher.check_password(pw_hash, 'montecristo'))
+        self.assertEqual(hasher.metrics.latency['check'].count, checks + 2)
+
+    def test_process_pool(self):
+        # Ensure hashing works through the worker processes.
+        pool_hasher = PasswordHasher()
+        self.app.config['BCRYPT_POOL_SIZE'] = 1
+        try:
+            pw_hash = pool_hasher.hash_password('cohiba')
+            self.assertTrue(pool_hasher.check_password(pw_hash, 'cohiba'))
+        finally:
+            self.app.config['BCRYPT_POOL_SIZE'] = 0
+        self.assertEqual(pool_hasher.metrics.queue_wait.count, 2)
+
+    def test_overload_rejects(self):
+        # Ensure calls beyond the queue depth fail fast.
+        busy_hasher = PasswordHasher()
+        self.app.config['BCRYPT_QUEUE_DEPTH'] = 1
+        try:
+            busy_hasher._acquire()
+            with self.assertRaises(HashingOverloaded):
+                busy_hasher.hash_password('cohiba')
+        finally:
+            self.app.config['BCRYPT_QUEUE_DEPTH'] = 16
+        self.assertEqual(busy_hasher.metrics.rejected, 1)
+
+    def test_timeout_overloads(self):
+        # Ensure a slow hash is refused and keeps its slot until it ends.
+        slow_hasher = PasswordHasher()
+        self.app.config.update(BCRYPT_POOL_SIZE=1, BCRYPT_TIMEOUT=0.01,
+                               BCRYPT_LOG_ROUNDS=12)
+        try:
+            with self.assertRaises(HashingOverloaded):
+                slow_hasher.hash_password('cohiba')
+            self.assertEqual(slow_hasher.metrics.in_flight, 1)
+            deadline = time.time() + 10
+            while slow_hasher.metrics.in_flight and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            self.app.config.update(BCRYPT_POOL_SIZE=0, BCRYPT_TIMEOUT=10,
+                                   BCRYPT_LOG_ROUNDS=4)
+        self.assertEqual(slow_hasher.metrics.in_flight, 0)
+        self.assertEqual(slow_hasher.metrics.timed_out, 1)
+
+    def test_needs_rehash(self):
+        # Ensure the stored cost is compared with the configured one.
+        self.assertFalse(hasher.needs_rehash(hasher.hash_password('x')))
+        self.assertTrue(hasher.needs_rehash('$2b$13$' + 'a' * 53))
+
+    def test_rehash_on_login(self):
+        # Ensure logging in upgrades a hash made with an old cost.
+        self.app.config['BCRYPT_LOG_ROUNDS'] = 5
+        try:
+            self.client.post('/login', data=dict(
+                email='ad@min.com', password='admin_user'
+            ), follow_redirects=True)
+            user = User.query.filter_by(email='ad@min.com').first()
+            self.assertTrue(user.password.startswith('$2b$05$'))
+        finally:
+            self.app.config['BCRYPT_LOG_ROUNDS'] = 4
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,223 @@
+# project/server/tests/test_imports.py
+
+
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from base import BaseTestCase
+from helpers import create_user
+from project.server import db
+from project.server.imports import jobs
+from project.server.models import Brand, ImportJob, Inventory, Product, \
+    Rating, SimilarPending, SimilarProduct
+
+
+BRANDS = b'id,Name\n1,Padron\n2,Fuente\n3,Oliva\n4,Tatuaje\n5,Illusione\n'
+
+
+class TestImports(BaseTestCase):
+
+    # Workers claim and run jobs on connections of their own.
+    transactional = False
+
+    def setUp(self):
+        super(TestImports, self).setUp()
+        self.directory = tempfile.mkdtemp(prefix='cigardb-imports-')
+        self.previous = dict(
+            (key, self.app.config[key])
+            for key in ('IMPORT_DIR', 'IMPORT_CHUNK_SIZE'))
+        self.app.config['IMPORT_DIR'] = self.directory
+        self.app.config['IMPORT_CHUNK_SIZE'] = 2
+
+    def tearDown(self):
+        super(TestImports, self).tearDown()
+        self.app.config.update(self.previous)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def login(self, email='ad@min.com', password='admin_user'):
+        self.client.post('/login', data=dict(email=email, password=password))
+
+    def upload(self, data=BRANDS, table='brands', filename='brands.csv'):
+        return self.client.post(
+            '/imports', data={'file': (io.BytesIO(data), filename),
+                              'table': table},
+            content_type='multipart/form-data')
+
+    def job(self, job_id):
+        db.session.expire_all()
+        return ImportJob.query.get(job_id)
+
+    def test_upload_queues(self):
+        # Ensure an upload is stored and queued, not imported.
+        self.login()
+        response = self.upload()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json['status'], jobs.QUEUED)
+        self.assertTrue(response.headers['Location'].endswith(
+            '/imports/{}'.format(response.json['id'])))
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        self.assertEqual(Brand.query.count(), 0)
+
+    def test_upload_requires_login(self):
+        # Ensure anonymous users can't upload.
+        response = self.upload()
+        self.assertNotEqual(response.status_code, 202)
+        self.assertEqual(ImportJob.query.count(), 0)
+
+    def test_upload_rejects_unknown_table(self):
+        # Ensure only configured tables can be imported into.
+        self.login()
+        response = self.upload(table='users')
+        self.assert400(response)
+        self.assertIn('users', response.json['error'])
+
+    def test_worker_imports_in_chunks(self):
+        # Ensure the worker imports the file and reports progress.
+        self.login()
+        job_id = self.upload().json['id']
+        self.assertEqual(jobs.work(once=True), 1)
+        response = self.client.get('/imports/{}'.format(job_id))
+        self.assertEqual(response.json['status'], jobs.DONE)
+        self.assertEqual(response.json['rows'], 5)
+        self.assertEqual(response.json['total'], 5)
+        self.assertEqual(response.json['percent'], 100.0)
+        self.assertEqual(self.job(job_id).chunks, 3)
+        self.assertEqual(Brand.query.count(), 5)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_resume_after_crash(self):
+        # Ensure a stalled job is taken over and resumes after its last
+        # committed chunk.
+        self.login()
+        job_id = self.upload().json['id']
+        with db.engine.begin() as connection:
+            jobs.claim(connection, 'crashed')
+        db.session.add_all([Brand(id=1, name='Padron'),
+                            Brand(id=2, name='Fuente')])
+        long_ago = datetime.datetime.now() - datetime.timedelta(hours=1)
+        db.session.query(ImportJob).filter_by(id=job_id).update(dict(
+            total=5, chunks=1, rows=2, heartbeat=long_ago))
+        db.session.commit()
+        self.assertEqual(jobs.work(once=True), 1)
+        job = self.job(job_id)
+        self.assertEqual((job.status, job.rows), (jobs.DONE, 5))
+        self.assertNotEqual(job.worker, 'crashed')
+        self.assertEqual(sorted(brand.name for brand in Brand.query),
+                         ['Fuente', 'Illusione', 'Oliva', 'Padron',
+                          'Tatuaje'])
+
+    def test_running_job_is_not_claimed_twice(self):
+        # Ensure a job with a live worker isn't claimed by another.
+        self.login()
+        self.upload()
+        with db.engine.begin() as connection:
+            self.assertIsNotNone(jobs.claim(connection, 'first'))
+            self.assertIsNone(jobs.claim(connection, 'second'))
+
+    def test_lost_job_writes_nothing(self):
+        # Ensure a worker stops once another has taken its job over.
+        self.login()
+        job_id = self.upload().json['id']
+        with db.engine.begin() as connection:
+            jobs.claim(connection, 'first')
+        db.session.query(ImportJob).filter_by(id=job_id).update(dict(
+            worker='second'))
+        db.session.commit()
+        with self.assertRaises(jobs.JobLost):
+            jobs.run(job_id, 'first')
+        self.assertEqual(Brand.query.count(), 0)
+
+    def test_unexpected_errors_are_retried_then_failed(self):
+        # Ensure a job that keeps crashing fails without stopping the
+        # worker.
+        self.login()
+        missing = self.job(self.upload().json['id'])
+        os.remove(missing.path)
+        good = self.upload().json['id']
+        with self.assertLogs('cigardb.imports', 'ERROR') as logs:
+            self.assertEqual(jobs.work(once=True), 4)
+        self.assertEqual(len(logs.records), 3)
+        job = self.job(missing.id)
+        self.assertEqual((job.status, job.attempts), (jobs.FAILED, 3))
+        self.assertIn('FileNotFoundError', job.error)
+        self.assertEqual(self.job(good).status, jobs.DONE)
+
+    def test_idle_worker_refreshes_recommendations(self):
+        # Ensure rating writes are left queued for the worker to refresh.
+        db.session.add_all([Brand(id=1, name='Padron'),
+                            Product(id=1, name='1964', brand=1),
+                            Product(id=2, name='1926', brand=1)])
+        db.session.commit()
+        db.session.add_all([Inventory(id=1, hash='aa', product=1),
+                            Inventory(id=2, hash='bb', product=2)])
+        db.session.commit()
+        db.session.add_all([Rating(cigar=1, overall_score=20),
+                            Rating(cigar=2, overall_score=22)])
+        db.session.commit()
+        self.assertEqual(SimilarProduct.query.count(), 0)
+        self.assertEqual(jobs.work(once=True), 0)
+        self.assertEqual(SimilarProduct.query.count(), 2)
+        self.assertEqual(SimilarPending.query.count(), 0)
+
+    def test_abandoned_job_is_given_up(self):
+        # Ensure a job whose workers keep dying isn't claimed forever.
+        self.login()
+        job_id = self.upload().json['id']
+        long_ago = datetime.datetime.now() - datetime.timedelta(hours=1)
+        db.session.query(ImportJob).filter_by(id=job_id).update(dict(
+            status=jobs.RUNNING, attempts=3, heartbeat=long_ago))
+        db.session.commit()
+        with db.engine.begin() as connection:
+            self.assertIsNone(jobs.claim(connection, 'next'))
+        self.assertEqual(self.job(job_id).status, jobs.FAILED)
+
+    def test_validation_heartbeats(self):
+        # Ensure validating a long file keeps the job's heartbeat fresh.
+        self.login()
+        job_id = self.upload().json['id']
+        with db.engine.begin() as connection:
+            jobs.claim(connection, 'first')
+        long_ago = datetime.datetime.now() - datetime.timedelta(hours=1)
+        db.session.query(ImportJob).filter_by(id=job_id).update(dict(
+            heartbeat=long_ago))
+        db.session.commit()
+        validate, seen = jobs.validate, []
+
+        def validated(*args):
+            result = validate(*args)
+            seen.append(self.job(job_id).heartbeat)
+            return result
+        jobs.validate = validated
+        try:
+            jobs.run(job_id, 'first')
+        finally:
+            jobs.validate = validate
+        self.assertGreater(seen[0], long_ago)
+
+    def test_bad_row_fails_before_writing(self):
+        # Ensure a row that doesn't convert fails the job with its line.
+        self.login()
+        job_id = self.upload(BRANDS + b'six,Bad\n').json['id']
+        jobs.work(once=True)
+        response = self.client.get('/imports/{}'.format(job_id))
+        self.assertEqual(response.json['status'], jobs.FAILED)
+        self.assertIn(':7:', response.json['error'])
+        self.assertEqual(Brand.query.count(), 0)
+
+    def test_other_users_job_is_hidden(self):
+        # Ensure users only see their own imports.
+        self.login()
+        job_id = self.upload().json['id']
+        self.client.get('/logout')
+        with db.engine.begin() as connection:
+            create_user(connection, 'other@min.com', 'other_user')
+        self.login('other@min.com', 'other_user')
+        self.assert404(self.client.get('/imports/{}'.format(job_id)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+# project/server/tests/test_instrumentation.py
+
+
+import unittest
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from base import BaseTestCase
+from project.server import db, instrumentation
+from project.server.instrumentation import measure_overhead, \
+    normalize_sql, parse_metrics, top_rows
+from project.server.models import User
+
+
+class TestInstrumentation(BaseTestCase):
+
+    def setUp(self):
+        super(TestInstrumentation, self).setUp()
+        instrumentation.reset()
+
+    def tearDown(self):
+        instrumentation.threshold = self.app.config['SLOW_QUERY_THRESHOLD']
+        super(TestInstrumentation, self).tearDown()
+
+    def metrics(self):
+        response = self.client.get(
+            '/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'})
+        self.assert200(response)
+        return parse_metrics(response.data.decode('utf-8'))
+
+    def test_normalize_sql(self):
+        # Ensure literals, parameters and IN lists are folded.
+        self.assertEqual(
+            normalize_sql("SELECT * FROM cigars\n WHERE hash IN (?, ?, ?) "
+                          "AND location = 2 AND name = 'it''s'"),
+            'SELECT * FROM cigars WHERE hash IN (...) AND location = ? '
+            'AND name = ?')
+        self.assertEqual(
+            normalize_sql('SELECT id FROM users WHERE id = %(id_1)s'),
+            'SELECT id FROM users WHERE id = ?')
+
+    def test_request_metrics(self):
+        # Ensure latency, queries and template time are recorded.
+        self.client.get('/')
+        # A WSGI server closes the response once it has been sent.
+        self.client.get('/api/brands').close()
+        samples = self.metrics()
+        count = samples['cigardb_request_duration_seconds_count',
+                        (('endpoint', 'main.home'),)]
+        self.assertEqual(count, 1)
+        self.assertGreater(samples['cigardb_request_queries_sum',
+                                   (('endpoint', 'api.list_resource'),)], 0)
+        self.assertGreater(samples['cigardb_request_phase_seconds_total',
+                                   (('endpoint', 'main.home'),
+                                    ('phase', 'template'))], 0)
+        self.assertIn(('cigardb_cache_hits_total', (('cache', 'user'),)),
+                      samples)
+
+    def test_streamed_responses(self):
+        # Ensure a streamed body's queries are counted once it is sent.
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(Engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.get('/api/brands')
+            self.assertNotIn('X-Statement-Count', response.headers)
+            response.data
+            response.close()
+        finally:
+            event.remove(Engine, 'before_cursor_execute', record)
+        samples = self.metrics()
+        self.assertEqual(samples['cigardb_request_queries_sum',
+                                 (('endpoint', 'api.list_resource'),)],
+                         len(statements))
+
+    def test_metrics_access(self):
+        # Ensure only admins, allowed addresses and the token get metrics.
+        self.app.config.update(METRICS_ALLOW=(), METRICS_TOKEN='s3cret')
+        try:
+            self.assert403(self.client.get(
+                '/metrics', environ_base={'REMOTE_ADDR': '127.0.0.1'}))
+            self.assert403(self.client.get(
+                '/metrics', headers={'Authorization': 'Bearer wrong'}))
+            self.assert200(self.client.get(
+                '/metrics', headers={'Authorization': 'Bearer s3cret'}))
+            with self.client:
+                self.client.post('/login', data=dict(
+                    email='ad@min.com', password='admin_user'))
+                self.assert403(self.client.get('/metrics'))
+                User.query.filter_by(email='ad@min.com').one().admin = True
+                db.session.commit()
+                self.assert200(self.client.get('/metrics'))
+        finally:
+            self.app.config.update(METRICS_ALLOW=('127.0.0.1',),
+                                   METRICS_TOKEN=None)
+
+    def test_bcrypt_time(self):
+        # Ensure time spent hashing passwords is attributed to the request.
+        self.client.post('/login', data=dict(
+            email='ad@min.com', password='admin_user'))
+        samples = self.metrics()
+        self.assertGreater(samples['cigardb_request_phase_seconds_total',
+                                   (('endpoint', 'user.login'),
+                                    ('phase', 'bcrypt'))], 0)
+
+    def test_slow_query_log(self):
+        # Ensure slow queries are logged as normalized SQL.
+        instrumentation.threshold = 0
+        self.client.get('/cigar/088ec60b')
+        entry = instrumentation.slow_queries[-1]
+        self.assertEqual(entry['endpoint'], 'inventory.cigar')
+        self.assertNotIn('088ec60b', entry['sql'])
+        self.assertGreater(instrumentation.slow_query_count, 0)
+
+    def test_top_rows(self):
+        # Ensure rates and shares are computed between two scrapes.
+        before = self.metrics()
+        for _ in range(4):
+            self.client.get('/api/brands').close()
+        rows = top_rows(before, self.metrics(), 2.0)
+        row = [r for r in rows if r['endpoint'] == 'api.list_resource'][0]
+        self.assertEqual(row['rate'], 2.0)
+        self.assertLessEqual(row['db'], 1.0)
+        self.assertGreater(row['queries'], 0)
+
+    def test_overhead(self):
+        # Ensure the hooks stay cheap.
+        self.assertLess(measure_overhead(self.app, 2000), 50e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+# project/server/tests/test_inventory.py
+
+
+import unittest
+
+from sqlalchemy.exc import StatementError
+
+from base import BaseTestCase
+from project.server import db
+from project.server.inventory import lookup, rollups
+from project.server.models import Brand, Inventory, Location, Product, Size
+
+
+class TestCigarLookup(BaseTestCase):
+
+    def setUp(self):
+        super(TestCigarLookup, self).setUp()
+        lookup.cache.clear()
+        db.session.add_all([
+            Brand(id=1, name='Padron'),
+            Product(id=1, name='1964 Anniversary', brand=1),
+            Size(id=1, name='Robusto'),
+            Location(id=1, name='Tupperdor'),
+            Location(id=2, name='Smoked'),
+            Inventory(hash='088ec60b', product=1, size=1, location=1),
+        ])
+        db.session.commit()
+
+    def test_cigar_route(self):
+        # Ensure a hash resolves to the denormalized record.
+        response = self.client.get('/cigar/088EC60B')
+        self.assert200(response)
+        self.assertEqual(response.json['brand'], {'id': 1, 'name': 'Padron'})
+        self.assertEqual(response.json['location']['name'], 'Tupperdor')
+
+    def test_unknown_cigar(self):
+        # Ensure unknown hashes 404 and are negatively cached.
+        response = self.client.get('/cigar/deadbeef')
+        self.assert404(response)
+        self.assertIs(lookup.cache.get('deadbeef'), lookup.MISSING)
+
+    def test_hash_is_binary(self):
+        # Ensure hashes are stored as bytes and read back as hex.
+        self.assertEqual(db.session.execute(
+            'SELECT length(hash) FROM cigars').scalar(), 4)
+        self.assertEqual(Inventory.query.filter_by(hash='088EC60B').one()
+                         .hash, '088ec60b')
+        db.session.add(Inventory(hash='not hex'))
+        with self.assertRaises(StatementError):
+            db.session.commit()
+        db.session.rollback()
+
+    def test_invalid_hash(self):
+        # Ensure strings that can't be a hash are unknown without a query.
+        self.assertIsNone(lookup.find_cigar('088ec60'))
+        self.assert404(self.client.get('/cigar/not-a-hash'))
+        self.assertIsNone(lookup.cache.get('not-a-hash'))
+
+    def test_cache_hit(self):
+        # Ensure repeated lookups are served from the cache.
+        lookup.find_cigar('088ec60b')
+        hits = lookup.cache.hits
+        lookup.find_cigar('088ec60b')
+        self.assertEqual(lookup.cache.hits, hits + 1)
+
+    def test_insert_evicts_negative_entry(self):
+        # Ensure a new cigar replaces a cached miss.
+        self.assertIsNone(lookup.find_cigar('cdffc40f'))
+        db.session.add(Inventory(hash='cdffc40f', product=1, location=1))
+        db.session.commit()
+        self.assertEqual(lookup.find_cigar('cdffc40f')['hash'], 'cdffc40f')
+
+    def test_move_evicts_record(self):
+        # Ensure a location change is visible on the next lookup.
+        lookup.find_cigar('088ec60b')
+        Inventory.query.filter_by(hash='088ec60b').one().location = 2
+        db.session.commit()
+        self.assertEqual(
+            lookup.find_cigar('088ec60b')['location']['name'], 'Smoked')
+
+    def test_move_evicts_expired_record(self):
+        # Ensure a cigar moved while expired is evicted by its row's hash.
+        response = self.client.get('/cigar/088ec60b')
+        self.assertEqual(response.json['location']['name'], 'Tupperdor')
+        cigar = Inventory.query.filter_by(hash='088ec60b').one()
+        db.session.expire(cigar, ['hash', 'location'])
+        cigar.location = 2
+        db.session.commit()
+        response = self.client.get('/cigar/088ec60b')
+        self.assertEqual(response.json['location']['name'], 'Smoked')
+
+    def test_rehash_evicts_old_hash(self):
+        # Ensure a hash set without loading the old one evicts both.
+        lookup.find_cigar('088ec60b')
+        self.assertIsNone(lookup.find_cigar('cdffc40f'))
+        cigar = Inventory.query.filter_by(hash='088ec60b').one()
+        db.session.expire(cigar, ['hash'])
+        cigar.hash = 'cdffc40f'
+        db.session.commit()
+        self.assert404(self.client.get('/cigar/088ec60b'))
+        self.assert200(self.client.get('/cigar/cdffc40f'))
+
+
+class TestRollups(BaseTestCase):
+
+    def setUp(self):
+        super(TestRollups, self).setUp()
+        db.session.add_all([
+            Brand(id=1, name='Padron'),
+            Brand(id=2, name='Tatuaje'),
+            Product(id=1, name='1964 Anniversary', brand=1),
+            Product(id=2, name='Havana VI', brand=2),
+            Size(id=1, name='Robusto'),
+            Size(id=2, name='Toro'),
+            Location(id=1, name='Tupperdor'),
+            Location(id=2, name='Smoked'),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            Inventory(hash='aa', product=1, size=1, location=1),
+            Inventory(hash='bb', product=1, size=1, location=1),
+            Inventory(hash='cc', product=2, size=1, location=1),
+        ])
+        db.session.commit()
+
+    def counts(self, dimension):
+        return dict((row['name'], row['count'])
+                    for row in rollups.counts(dimension))
+
+    def test_insert(self):
+        # Ensure inserts are counted per location, brand and size.
+        self.assertEqual(self.counts('location'), {'Tupperdor': 3})
+        self.assertEqual(self.counts('brand'), {'Padron': 2, 'Tatuaje': 1})
+        self.assertEqual(self.counts('size'), {'Robusto': 3})
+
+    def test_move_and_delete(self):
+        # Ensure location changes and deletes adjust the counts.
+        db.session.expire_all()
+        Inventory.query.filter_by(hash='aa').one().location = 2
+        db.session.delete(Inventory.query.filter_by(hash='cc').one())
+        db.session.commit()
+        self.assertEqual(self.counts('location'),
+                         {'Tupperdor': 1, 'Smoked': 1})
+        self.assertEqual(self.counts('brand'), {'Padron': 2})
+
+    def test_product_changes_brand(self):
+        # Ensure moving a product to another brand moves its cigars.
+        Product.query.get(1).brand = 2
+        db.session.commit()
+        self.assertEqual(self.counts('brand'), {'Tatuaje': 3})
+
+    def test_values(self):
+        # Ensure the purchase value follows the cigars like the counts.
+        db.session.expire_all()
+        for hash, price in (('aa', '8.50'), ('bb', '12.00'), ('cc', '9.25')):
+            Inventory.query.filter_by(hash=hash).one().purchase_price = price
+        db.session.commit()
+        Inventory.query.filter_by(hash='aa').one().size = 2
+        Inventory.query.filter_by(hash='aa').one().location = 2
+        Product.query.get(2).brand = 1
+        db.session.delete(Inventory.query.filter_by(hash='bb').one())
+        db.session.commit()
+        values = dict(((dimension, row['name']), row['value'])
+                      for dimension in sorted(rollups.DIMENSIONS)
+                      for row in rollups.counts(dimension))
+        self.assertEqual(values, {
+            ('brand', 'Padron'): 17.75,
+            ('location', 'Tupperdor'): 9.25, ('location', 'Smoked'): 8.5,
+            ('size', 'Robusto'): 9.25, ('size', 'Toro'): 8.5})
+        rollups.rebuild(db.session.connection())
+        rebuilt = dict(((dimension, row['name']), row['value'])
+                       for dimension in sorted(rollups.DIMENSIONS)
+                       for row in rollups.counts(dimension))
+        self.assertEqual(rebuilt, values)
+        response = self.client.get('/inventory/rollups/size')
+        self.assertEqual(response.json['value'], 17.75)
+
+    def test_rebuild(self):
+        # Ensure a rebuild recomputes the same counts.
+        before = self.counts('brand')
+        rollups.rebuild(db.session.connection())
+        db.session.commit()
+        self.assertEqual(self.counts('brand'), before)
+
+    def test_rollups_route(self):
+        # Ensure the API reads the rollups.
+        response = self.client.get('/inventory/rollups/brand')
+        self.assert200(response)
+        self.assertEqual(response.json['total'], 3)
+        self.assert404(self.client.get('/inventory/rollups/color'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+# project/server/tests/test_parallel.py
+
+
+import unittest
+
+from base import BaseTestCase
+from helpers import password_hash
+from parallel import shard, worker_url
+from project.server import db
+from project.server.models import Brand, User
+
+
+class TestHarness(BaseTestCase):
+
+    def test_commits_stay_in_the_test(self):
+        # Ensure commits are visible to the test but not to other
+        # connections.
+        db.session.add(Brand(name='Isolated'))
+        db.session.commit()
+        db.session.rollback()
+        self.assertEqual(Brand.query.filter_by(name='Isolated').count(), 1)
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.scalar(
+                Brand.__table__.count().where(Brand.name == 'Isolated')), 0)
+
+    def test_fixture_user(self):
+        # Ensure the fixture user exists with a cached hash.
+        user = User.query.filter_by(email='ad@min.com').one()
+        self.assertEqual(user.id, 1)
+        self.assertEqual(user.password, password_hash('admin_user'))
+        cached = password_hash('admin_user')
+        self.assertIs(password_hash('admin_user'), cached)
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_shard_balances_tests(self):
+        # Ensure modules are spread by their number of tests.
+        found = [('a', 10), ('b', 6), ('c', 5), ('d', 1)]
+        self.assertEqual(shard(found, 2), [['a', 'd'], ['b', 'c']])
+        self.assertEqual(shard(found[:1], 3), [['a']])
+
+    def test_worker_url(self):
+        # Ensure every worker gets a database of its own.
+        self.assertEqual(str(worker_url('sqlite:////tmp/t.sqlite', 2)),
+                         'sqlite:////tmp/t-2.sqlite')
+        self.assertEqual(str(worker_url('sqlite://', 2)), 'sqlite://')
+        self.assertEqual(
+            str(worker_url('postgresql://u:p@localhost/cigardb', 3)),
+            'postgresql://u:p@localhost/cigardb_3')
+
+
+if __name__ == '__main__':
+    unittest.main()
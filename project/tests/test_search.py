@@ -0,0 +1,91 @@
+# project/server/tests/test_search.py
+
+
+import unittest
+
+from base import BaseTestCase
+from project.server import db
+from project.server.models import Brand, Product
+from project.server.search.index import SearchIndex, fold, index
+
+
+class TestSearchIndex(BaseTestCase):
+
+    def setUp(self):
+        super(TestSearchIndex, self).setUp()
+        db.session.add_all([
+            Brand(id=1, name='Alcántara'),
+            Brand(id=2, name='Padron'),
+            Brand(id=3, name='Padilla'),
+            Product(id=1, name='1964 Anniversary', brand=2),
+            Product(id=2, name='Family Reserve', brand=2),
+        ])
+        db.session.commit()
+        index.build()
+
+    def names(self, query, **kwargs):
+        return [result['name'] for result in index.search(query, **kwargs)]
+
+    def test_fold(self):
+        # Ensure accents and case are folded away.
+        self.assertEqual(fold(u'Alcántara'), 'alcantara')
+
+    def test_prefix(self):
+        # Ensure prefixes match any word, shortest name first.
+        self.assertEqual(self.names('pad'), ['Padron', 'Padilla'])
+        self.assertEqual(self.names('anniv'), ['1964 Anniversary'])
+        self.assertEqual(self.names('alcan'), [u'Alcántara'])
+
+    def test_trigram_fallback(self):
+        # Ensure misspellings still find a match.
+        self.assertIn('Family Reserve', self.names('famly reserve'))
+
+    def test_product_carries_brand(self):
+        # Ensure product results name their brand.
+        result = index.search('family')[0]
+        self.assertEqual(result['brand'], {'id': 2, 'name': 'Padron'})
+
+    def test_incremental_updates(self):
+        # Ensure committed changes reach the index without a rebuild.
+        built_at = index.built_at
+        db.session.add(Brand(id=4, name='Tatuaje'))
+        Brand.query.get(3).name = 'Oliva'
+        db.session.delete(Product.query.get(1))
+        db.session.commit()
+        self.assertEqual(self.names('tat'), ['Tatuaje'])
+        self.assertNotIn('Padilla', self.names('padi'))
+        self.assertEqual(self.names('anniv'), [])
+        self.assertEqual(index.built_at, built_at)
+
+    def test_build_matches_incremental(self):
+        # Ensure a rebuild sorts tokens the way incremental adds keep them.
+        db.session.add(Product(id=3, name='Serie 1926', brand=2))
+        db.session.commit()
+        incremental = list(index._tokens)
+        index.build()
+        self.assertEqual(index._tokens, incremental)
+        self.assertEqual(index._tokens, sorted(index._tokens))
+
+    def test_builds_lazily(self):
+        # Ensure a fresh index loads itself on first search.
+        fresh = SearchIndex()
+        self.assertEqual(len(fresh), 0)
+        self.assertEqual(fresh.search('padron')[0]['name'], 'Padron')
+
+    def test_autocomplete_route(self):
+        # Ensure the endpoint returns ranked results.
+        response = self.client.get('/search/autocomplete?q=Padr&limit=1')
+        self.assert200(response)
+        self.assertEqual(response.json['results'][0]['name'], 'Padron')
+        self.assertEqual(len(response.json['results']), 1)
+
+    def test_autocomplete_limit_is_clamped(self):
+        # Ensure a zero or negative limit still returns the best match.
+        for limit in (0, -3):
+            response = self.client.get(
+                '/search/autocomplete?q=Padr&limit={}'.format(limit))
+            self.assertEqual(len(response.json['results']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# project/server/tests/test_search_notes.py
+
+
+import unittest
+
+from base import BaseTestCase
+from project.server import db
+from project.server.models import Brand, Inventory, Product, Rating
+from project.server.search import notes
+
+
+class TestNotesSearch(BaseTestCase):
+
+    def setUp(self):
+        super(TestNotesSearch, self).setUp()
+        db.session.add_all([
+            Brand(id=1, name='Padron'),
+            Product(id=1, name='1964 Anniversary', brand=1),
+            Inventory(id=1, hash='aa', product=1),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            Rating(id=1, cigar=1, taste_notes='Peppery with some cedar.',
+                   overall_score=20),
+            Rating(id=2, overall_notes='Pepper <b>bomb</b>, then cedar.',
+                   overall_score=25),
+            Rating(id=3, app_notes='Oily wrapper, pepper on the cold draw.'),
+        ])
+        db.session.commit()
+
+    def ids(self, query):
+        return [result['rating'] for result in notes.search(query)]
+
+    def test_terms(self):
+        # Ensure search syntax and punctuation are dropped.
+        self.assertEqual(notes.terms('"Pepper" OR ce*dar-'),
+                         ['pepper', 'or', 'ce', 'dar'])
+        self.assertEqual(notes.search('*"()'), [])
+
+    def test_ranked_by_field(self):
+        # Ensure stems and prefixes match, overall notes ranking first.
+        self.assertEqual(self.ids('pepper'), [2, 1, 3])
+        self.assertEqual(self.ids('pepp cedar'), [2, 1])
+        self.assertEqual(self.ids('tobacco'), [])
+
+    def test_result(self):
+        # Ensure results carry the cigar, product, brand and a snippet.
+        first, second = notes.search('cedar')
+        self.assertEqual(first['snippet'],
+                         'Pepper &lt;b&gt;bomb&lt;/b&gt;, then '
+                         '<mark>cedar</mark>.')
+        self.assertIsNone(first['brand'])
+        self.assertEqual(second['cigar'], {'id': 1, 'hash': 'aa'})
+        self.assertEqual(second['product'],
+                         {'id': 1, 'name': '1964 Anniversary'})
+        self.assertEqual(second['brand'], {'id': 1, 'name': 'Padron'})
+        self.assertEqual(second['overall_score'], 20)
+
+    def test_triggers(self):
+        # Ensure edits and deletes reach the index.
+        Rating.query.get(1).taste_notes = 'Leather and earth.'
+        db.session.delete(Rating.query.get(2))
+        db.session.commit()
+        self.assertEqual(self.ids('pepper'), [3])
+        self.assertEqual(self.ids('leather'), [1])
+        notes.rebuild(db.session.connection())
+        self.assertEqual(self.ids('earth'), [1])
+
+    def test_notes_route(self):
+        # Ensure the route serves ranked matches up to the limit.
+        response = self.client.get('/search/notes?q=pepper&limit=2')
+        self.assert200(response)
+        self.assertEqual(response.json['query'], 'pepper')
+        self.assertEqual(
+            [result['rating'] for result in response.json['results']],
+            [2, 1])
+
+    def test_notes_limit_is_clamped(self):
+        # Ensure a zero or negative limit still returns the best match.
+        for limit in (0, -3):
+            response = self.client.get(
+                '/search/notes?q=pepper&limit={}'.format(limit))
+            self.assert200(response)
+            self.assertEqual(
+                [result['rating'] for result in response.json['results']],
+                [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+# project/server/tests/test_similar.py
+
+
+import random
+import unittest
+
+import numpy as np
+from sqlalchemy import event
+
+from base import BaseTestCase
+from project.server import db, versioning
+from project.server.analytics import ratings, similar
+from project.server.inventory import bulk
+from project.server.models import Brand, Inventory, Location, Product, \
+    Rating, SimilarPending, SimilarProduct, Size
+
+
+class TestSimilarProducts(BaseTestCase):
+
+    def setUp(self):
+        super(TestSimilarProducts, self).setUp()
+        # Versions repeat across rolled back tests.
+        ratings._cache['key'] = None
+        similar.cache.clear()
+        db.session.add_all([
+            Brand(id=1, name='Padron'),
+            Brand(id=2, name='Tatuaje'),
+            Location(id=1, name='Humidor'),
+            Size(id=1, name='Robusto'),
+            Size(id=2, name='Toro'),
+            Product(id=1, name='1964 Anniversary', brand=1),
+            Product(id=2, name='1926 Serie', brand=1),
+            Product(id=3, name='Havana VI', brand=2),
+            Product(id=4, name='Black Label', brand=2),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            Inventory(id=1, hash='aa', product=1, size=1),
+            Inventory(id=2, hash='bb', product=1, size=2),
+            Inventory(id=3, hash='cc', product=2, size=1),
+            Inventory(id=4, hash='dd', product=3, size=1),
+            Inventory(id=5, hash='ee', product=4, size=2),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            Rating(cigar=1, app_score=20, smoke_score=20, taste_score=20,
+                   overall_score=22),
+            Rating(cigar=1, app_score=22, smoke_score=20, taste_score=22,
+                   overall_score=24),
+            Rating(cigar=3, app_score=21, smoke_score=19, taste_score=21,
+                   overall_score=23),
+            Rating(cigar=4, app_score=20, smoke_score=21, taste_score=21,
+                   overall_score=22),
+            Rating(cigar=5, app_score=10, overall_score=12),
+        ])
+        db.session.commit()
+        similar.refresh(db.session.connection())
+        db.session.commit()
+
+    def queued(self):
+        return sorted(row.product for row in SimilarPending.query)
+
+    def record(self, call, *args):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            if 'SAVEPOINT' not in statement:
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            result = call(*args)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return result, statements
+
+    def lists(self):
+        found = {}
+        for row in SimilarProduct.query.order_by(SimilarProduct.product,
+                                                 SimilarProduct.rank):
+            found.setdefault(row.product, []).append(
+                (row.similar, round(row.distance, 6)))
+        return found
+
+    def test_features(self):
+        # Ensure vectors hold mean scores, the brand and the main size.
+        features = similar.Features.from_frame(ratings.frame())
+        self.assertEqual(features.ids.tolist(), [1, 2, 3, 4])
+        self.assertEqual(features.means[0].tolist(), [21, 20, 21, 23])
+        self.assertEqual(features.brands.tolist(), [1, 1, 2, 2])
+        self.assertEqual(features.sizes.tolist(), [1, 1, 1, 2])
+        self.assertEqual(features.counts.tolist(), [2, 1, 1, 1])
+        self.assertTrue(np.isnan(features.means[3][1]))
+
+    def test_nearest(self):
+        # Ensure brand and size count alongside the scores.
+        self.assertEqual(
+            similar.refresh(db.session.connection(), full=True), 4)
+        self.assertEqual([product['id'] for product in
+                          similar.similar_to(1)], [2, 3, 4])
+        first = similar.similar_to(1)[0]
+        self.assertEqual(first['name'], '1926 Serie')
+        self.assertEqual(first['brand'], {'id': 1, 'name': 'Padron'})
+        self.assertAlmostEqual(first['distance'], 0.04)
+        self.assertEqual([product['id'] for product in
+                          similar.similar_to(4, limit=2)], [3, 2])
+        self.assertEqual(similar.similar_to(99), [])
+
+    def test_served_from_cache(self):
+        # Ensure a cached list costs only the version read.
+        similar.similar_to(1)
+        found, statements = self.record(similar.similar_to, 1)
+        self.assertEqual(len(found), 3)
+        self.assertEqual(len(statements), 1)
+
+    def test_refresh_from_queued_ratings(self):
+        # Ensure new ratings are queued on commit and picked up by the
+        # refresh, which reads only the queued products' ratings.
+        self.assertEqual(self.queued(), [])
+        db.session.add_all([
+            Rating(cigar=3, app_score=10, overall_score=12),
+            Rating(cigar=3, app_score=10, overall_score=12),
+            Rating(cigar=3, app_score=10, overall_score=12),
+        ])
+        db.session.commit()
+        self.assertEqual(self.queued(), [2])
+        self.assertEqual(similar.similar_to(4)[0]['id'], 3)
+        _, statements = self.record(similar.refresh,
+                                          db.session.connection())
+        db.session.commit()
+        self.assertEqual(self.queued(), [])
+        loads = [statement for statement in statements
+                 if statement.lstrip().startswith('SELECT ratings.')]
+        self.assertEqual(len(loads), 1)
+        self.assertIn(' IN (', loads[0])
+        self.assertEqual(similar.similar_to(4)[0]['id'], 2)
+
+    def test_reads_never_refresh(self):
+        # Ensure a read with products queued neither recomputes nor
+        # writes.
+        db.session.add(Rating(cigar=4, app_score=5, overall_score=5))
+        db.session.commit()
+        version = versioning.current('similar_products')
+        found, statements = self.record(similar.similar_to, 1)
+        self.assertEqual(len(found), 3)
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(all(statement.lstrip().startswith('SELECT')
+                            for statement in statements))
+        self.assertEqual(versioning.current('similar_products'), version)
+        self.assertEqual(self.queued(), [3])
+
+    def test_only_what_ratings_see_is_queued(self):
+        # Ensure moves, prices, names and new products queue nothing;
+        # rated sizes, scores and brands do.
+        cigar = Inventory.query.get(1)
+        cigar.location = 1
+        cigar.purchase_price = 12
+        Product.query.get(1).name = '1964 Anniversary Maduro'
+        db.session.add(Product(id=5, name='Reserva', brand=2))
+        db.session.commit()
+        bulk.move([2, 3], 1)
+        bulk.resize([2], 1)
+        db.session.commit()
+        self.assertEqual(self.queued(), [])
+        bulk.resize([5], 1)
+        db.session.commit()
+        self.assertEqual(self.queued(), [4])
+        Rating.query.filter_by(cigar=4).one().smoke_score = 10
+        Product.query.get(2).brand = 2
+        db.session.commit()
+        self.assertEqual(self.queued(), [2, 3, 4])
+
+    def test_moved_ratings_queue_both_products(self):
+        # Ensure a cigar changing product queues the one it leaves.
+        Inventory.query.get(4).product = 1
+        db.session.commit()
+        self.assertEqual(self.queued(), [1, 3])
+        similar.refresh(db.session.connection())
+        self.assertNotIn(3, self.lists())
+        self.assertEqual(similar.refresh(db.session.connection()), 0)
+
+    def test_incremental_matches_full(self):
+        # Ensure patched lists are the ones a full rebuild gives.
+        rng = random.Random(1)
+        db.session.add_all([
+            Product(id=n, name='Product {}'.format(n), brand=1 + n % 2)
+            for n in range(5, 61)])
+        db.session.commit()
+        db.session.add_all([
+            Inventory(id=n, hash='{:04x}'.format(n), product=n,
+                      size=1 + n % 2) for n in range(6, 61)])
+        db.session.commit()
+
+        def rate(cigar):
+            return Rating(cigar=cigar, app_score=rng.randint(5, 25),
+                          smoke_score=rng.randint(5, 25),
+                          overall_score=rng.randint(5, 25))
+        db.session.add_all([rate(n) for n in range(6, 61)])
+        db.session.commit()
+        similar.refresh(db.session.connection(), full=True)
+
+        db.session.add_all([rate(n) for n in (6, 20, 33)])
+        db.session.delete(Rating.query.filter_by(cigar=5).one())
+        db.session.commit()
+        written = similar.refresh(db.session.connection())
+        self.assertLess(written, 59)
+        patched = self.lists()
+        similar.refresh(db.session.connection(), full=True)
+        self.assertEqual(patched, self.lists())
+        self.assertNotIn(4, patched)
+
+    def test_route_and_members_page(self):
+        # Ensure recommendations are served by the api and members page.
+        response = self.client.get('/api/products/1/similar?limit=1')
+        self.assert200(response)
+        self.assertEqual([product['id'] for product in
+                          response.json['similar']], [2])
+        with self.client:
+            self.client.post('/login', data=dict(email='ad@min.com',
+                                                 password='admin_user'))
+            response = self.client.get('/members')
+        self.assertIn(b'If you liked 1964 Anniversary', response.data)
+        self.assertIn(b'1926 Serie', response.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# project/server/tests/test_smoking.py
+
+
+import datetime
+import json
+import unittest
+
+from base import BaseTestCase
+from project.server import db
+from project.server.inventory import rollups, smoking
+from project.server.models import Inventory, Location, Rating, \
+    SessionInventory, SmokingSession, Transfer
+
+
+class TestSmokingSessions(BaseTestCase):
+
+    def setUp(self):
+        super(TestSmokingSessions, self).setUp()
+        db.session.add_all([
+            Location(id=1, name='Smoked'),
+            Location(id=2, name='Tupperdor'),
+        ])
+        db.session.commit()
+        db.session.add_all(
+            [Inventory(hash='cc{:02d}'.format(n), location=2)
+             for n in range(40)])
+        db.session.commit()
+
+    def login(self):
+        self.client.post('/login', data=dict(
+            email='ad@min.com', password='admin_user'))
+
+    def post(self, data):
+        return self.client.post('/sessions', data=json.dumps(data),
+                                content_type='application/json')
+
+    def test_record_session(self):
+        # Ensure one call links, relocates and rates every cigar.
+        result = smoking.record_session(
+            ['cc00', 'CC01'], datetime.datetime(2016, 9, 23),
+            ratings={'cc01': {'overall_score': 25, 'taste_notes': 'Cedar'}})
+        db.session.commit()
+        self.assertEqual(result.cigars, 2)
+        self.assertEqual(result.ratings, 1)
+        session = SmokingSession.query.one()
+        self.assertEqual(session.id, result.session)
+        self.assertEqual(
+            sorted(row.hash for row in db.session.query(Inventory.hash)
+                   .join(SessionInventory,
+                         SessionInventory.cigar == Inventory.id)
+                   .filter(SessionInventory.session == session.id)),
+            ['cc00', 'cc01'])
+        self.assertEqual(Inventory.query.filter_by(location=1).count(), 2)
+        self.assertEqual(Transfer.query.count(), 2)
+        rating = Rating.query.one()
+        self.assertEqual(
+            (rating.cigars.hash, rating.session, rating.overall_score),
+            ('cc01', session.id, 25))
+        counts = dict((row['name'], row['count'])
+                      for row in rollups.counts('location'))
+        self.assertEqual(counts, {'Smoked': 2, 'Tupperdor': 38})
+
+    def test_unknown_cigars_write_nothing(self):
+        # Ensure unknown hashes are rejected before any write.
+        with self.assertRaises(smoking.UnknownCigars) as context:
+            smoking.record_session(['cc00', 'nope'])
+        self.assertEqual(context.exception.hashes, ['nope'])
+        db.session.rollback()
+        self.assertEqual(SmokingSession.query.count(), 0)
+        self.assertEqual(SessionInventory.query.count(), 0)
+
+    def test_statement_count_is_constant(self):
+        # Ensure the round trips don't grow with the session size.
+        self.login()
+        small = self.post({'hashes': ['cc00']})
+        self.assertEqual(small.status_code, 201)
+        large = self.post({
+            'hashes': ['cc{:02d}'.format(n) for n in range(1, 40)],
+            'ratings': {'cc02': {'overall_score': 20}},
+        })
+        self.assertEqual(large.status_code, 201)
+        self.assertEqual(large.json['cigars'], 39)
+        self.assertLessEqual(int(large.headers['X-Statement-Count']),
+                             int(small.headers['X-Statement-Count']) + 2)
+
+    def test_route_requires_login(self):
+        # Ensure anonymous users can't record sessions.
+        response = self.post({'hashes': ['cc00']})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(SmokingSession.query.count(), 0)
+
+    def test_route_rejects_unknown_cigars(self):
+        # Ensure unknown hashes are reported back.
+        self.login()
+        response = self.post({'hashes': ['cc00', 'nope']})
+        self.assert400(response)
+        self.assertEqual(response.json['hashes'], ['nope'])
+
+    def test_route_rejects_malformed_bodies(self):
+        # Ensure bodies of the wrong shape are a 400, not a 500.
+        self.login()
+        for data in (['cc00'], {'hashes': 'cc00'}, {'hashes': [1]},
+                     {'ratings': ['cc00']}, {'ratings': {'cc00': 5}},
+                     {'hashes': ['cc00'], 'date': 20160923}):
+            response = self.post(data)
+            self.assert400(response)
+            self.assertIn('error', response.json)
+        self.assertEqual(SmokingSession.query.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# project/server/tests/test_sync.py
+
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import current_app
+
+from base import BaseTestCase
+from project.server import db, versioning
+from project.server.inventory import transfers
+from project.server.models import Brand, Inventory, Location, Product, Rating
+from project.server.sync import snapshot
+
+# Ends in a zero byte, which NumPy would drop.
+HASH = '00' * 19 + 'a0'
+
+
+class TestSync(BaseTestCase):
+
+    def setUp(self):
+        super(TestSync, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        current_app.config['SNAPSHOT_DIR'] = self.directory
+        db.session.add_all([
+            Brand(id=1, name=u'Padrón'),
+            Brand(id=2, name='Tatuaje'),
+            Product(id=1, name='1964 Anniversary', brand=1),
+            Location(id=1, name='Humidor'),
+            Location(id=2, name='Travel case'),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            Inventory(id=1, hash=HASH, product=1, location=1,
+                      purchase_date=datetime.datetime(2016, 3, 1, 12, 30),
+                      purchase_price='9.50'),
+            Inventory(id=2, hash='ff' * 20, product=1),
+            Rating(id=1, cigar=1, taste_notes='Cedar', overall_score=20),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(TestSync, self).tearDown()
+
+    def version(self):
+        return versioning.counter(db.session.connection(), versioning.SYNC)
+
+    def delta(self, since):
+        response = self.client.get('/sync?since={}'.format(since))
+        self.assert200(response)
+        return response.json
+
+    def test_snapshot(self):
+        # Ensure a snapshot holds every row with its lookups.
+        path, version = snapshot.build(self.directory,
+                                       db.session.connection())
+        self.assertEqual(version, self.version())
+        loaded = snapshot.Snapshot(path)
+        try:
+            self.assertEqual(loaded.version, version)
+            self.assertEqual(loaded.rows('brands'), [
+                {'id': 1, 'name': u'Padrón'}, {'id': 2, 'name': 'Tatuaje'}])
+            self.assertEqual(loaded.find_cigar(HASH), {
+                'id': 1, 'hash': HASH, 'product': 1, 'size': None,
+                'location': 1, 'purchase_price': 9.5,
+                'purchase_date': datetime.datetime(2016, 3, 1, 12, 30)})
+            self.assertIsNone(loaded.find_cigar('ab' * 20))
+            self.assertEqual(loaded.row('cigars', loaded.position(
+                'cigars', 2))['location'], None)
+            self.assertEqual([row['id'] for row in
+                              loaded.find_names('brands', 'pad')], [1])
+            self.assertEqual(loaded.rows('ratings')[0]['taste_notes'],
+                             'Cedar')
+        finally:
+            loaded.close()
+        # Nothing changed, so nothing is written.
+        self.assertEqual(snapshot.build(self.directory,
+                                        db.session.connection()),
+                         (path, version))
+
+    def test_first_sync_downloads_snapshot(self):
+        # Ensure `/sync` serves the snapshot with its version.
+        response = self.client.get('/sync')
+        self.assert200(response)
+        self.assertEqual(response.headers['X-Sync-Version'],
+                         str(self.version()))
+        self.assertTrue(response.data.startswith(snapshot.MAGIC))
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_delta(self):
+        # Ensure edits, set-based moves and deletes are sent once.
+        since = self.version()
+        self.assertEqual(self.delta(since)['tables'], {})
+        Brand.query.get(2).name = 'Tatuaje Cigars'
+        db.session.delete(Rating.query.get(1))
+        db.session.commit()
+        transfers.move_cigars(['ff' * 20], 2)
+        db.session.commit()
+
+        delta = self.delta(since)
+        self.assertEqual(delta['version'], self.version())
+        self.assertEqual(delta['tables']['brands'], {
+            'columns': ['id', 'name'], 'rows': [[2, 'Tatuaje Cigars']]})
+        self.assertEqual(
+            [row[0] for row in delta['tables']['cigars']['rows']], [2])
+        self.assertEqual(delta['deleted'], {'ratings': [1]})
+        self.assertEqual(sorted(delta['tables']), ['brands', 'cigars'])
+        self.assertEqual(self.delta(delta['version'])['tables'], {})
+
+    def test_stale_and_bad_versions(self):
+        # Ensure clients from before a replace start over.
+        since = self.version()
+        self.assert400(self.client.get('/sync?since=later'))
+        self.assert400(self.client.get('/sync?since={}'.format(since + 1)))
+        versioning.reset_sync(db.session.connection())
+        self.assertStatus(self.client.get('/sync?since={}'.format(since)),
+                          410)
+        self.assert200(self.client.get('/sync?since={}'.format(
+            self.version())))
+
+
+if __name__ == '__main__':
+    unittest.main()
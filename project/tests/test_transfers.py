@@ -0,0 +1,171 @@
+# project/server/tests/test_transfers.py
+
+
+import datetime
+import unittest
+
+from sqlalchemy import event
+
+from base import BaseTestCase
+from project.server import db
+from project.server.inventory import lookup, rollups, transfers
+from project.server.models import Inventory, Location, LocationSnapshot, \
+    LocationSnapshotEntry, Transfer
+
+
+def day(n):
+    return datetime.datetime(2016, 9, n)
+
+
+class TestTransfers(BaseTestCase):
+
+    def setUp(self):
+        super(TestTransfers, self).setUp()
+        lookup.cache.clear()
+        db.session.add_all([
+            Location(id=1, name='Smoked'),
+            Location(id=2, name='Tupperdor'),
+            Location(id=3, name='Travel case'),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            Inventory(hash='aa', location=2),
+            Inventory(hash='bb', location=2),
+            Inventory(hash='cc', location=3),
+        ])
+        db.session.commit()
+
+    def test_bulk_move(self):
+        # Ensure a bulk move logs, updates and keeps rollups in step.
+        lookup.find_cigar('aa')
+        self.assertEqual(transfers.move_cigars(['AA', 'bb', 'cc'], 1, day(2)),
+                         3)
+        db.session.commit()
+        self.assertEqual(
+            sorted((transfer.cigars.hash, transfer.from_location)
+                   for transfer in Transfer.query),
+            [('aa', 2), ('bb', 2), ('cc', 3)])
+        self.assertEqual(Inventory.query.filter_by(location=1).count(), 3)
+        self.assertEqual(lookup.find_cigar('aa')['location']['name'],
+                         'Smoked')
+        counts = dict((row['id'], row['count'])
+                      for row in rollups.counts('location'))
+        self.assertEqual(counts, {1: 3})
+        self.assertEqual(transfers.move_cigars(['aa'], 1), 0)
+
+    def test_move_leaves_expired_cigars_unloaded(self):
+        # Ensure a move refreshes loaded cigars without loading expired
+        # ones.
+        loaded = Inventory.query.filter_by(hash='aa').one()
+        expired = Inventory.query.filter_by(hash='bb').one()
+        db.session.expire(expired)
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            transfers.move_cigars(['aa', 'bb'], 1)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertFalse([statement for statement in statements
+                          if 'cigars_hash' in statement])
+        self.assertEqual((loaded.location, expired.location), (1, 1))
+
+    def test_orm_moves_are_logged(self):
+        # Ensure editing a location directly still records a transfer.
+        Inventory.query.filter_by(hash='aa').one().location = 1
+        db.session.commit()
+        transfer = Transfer.query.one()
+        self.assertEqual((transfer.cigars.hash, transfer.from_location,
+                          transfer.to_location), ('aa', 2, 1))
+
+    def test_point_in_time(self):
+        # Ensure history is answered the same with or without snapshots.
+        transfers.move_cigars(['aa'], 1, day(2))
+        transfers.move_cigars(['bb', 'cc'], 1, day(4))
+        db.session.commit()
+
+        def history():
+            return [transfers.cigars_at(2, day(n)) for n in (1, 3, 5)]
+
+        expected = [['aa', 'bb'], ['bb'], []]
+        self.assertEqual(history(), expected)
+        self.assertEqual(transfers.location_of('cc', day(3)), 3)
+        self.assertEqual(transfers.location_of('cc', day(5)), 1)
+
+        connection = db.session.connection()
+        self.assertIsNotNone(transfers.take_snapshot(connection))
+        self.assertIsNone(transfers.take_snapshot(connection))
+        db.session.add(Inventory(hash='dd', location=2))
+        db.session.commit()
+        transfers.move_cigars(['dd'], 3, day(6))
+        db.session.commit()
+        # 'dd' is not in the snapshot; it was in 2 until its first move.
+        self.assertEqual(history(), [['aa', 'bb', 'dd'], ['bb', 'dd'], ['dd']])
+        self.assertEqual(transfers.cigars_at(3, day(7)), ['dd'])
+
+    def test_snapshots_are_kept_apart_from_moves(self):
+        # Ensure moves never snapshot and only the newest are kept.
+        connection = db.session.connection()
+        for n, hash in enumerate(['aa', 'bb', 'cc'], 2):
+            transfers.move_cigars([hash], 1, day(n))
+            self.assertEqual(LocationSnapshot.query.count(), n - 2)
+            transfers.take_snapshot(connection, keep=2)
+        self.assertEqual(
+            [snapshot.transfer for snapshot in
+             LocationSnapshot.query.order_by(LocationSnapshot.id)], [2, 3])
+        self.assertEqual(LocationSnapshotEntry.query.count(), 5)
+
+    def test_backdated_moves(self):
+        # Ensure moves logged out of date order are replayed by date.
+        transfers.move_cigars(['bb'], 1, day(6))
+        transfers.move_cigars(['cc'], 1, day(2))
+        db.session.commit()
+        snapshot = transfers.take_snapshot(db.session.connection())
+        self.assertEqual(LocationSnapshot.query.get(snapshot).taken_on,
+                         day(6))
+        self.assertEqual(transfers.cigars_at(2, day(3)), ['aa', 'bb'])
+
+        transfers.move_cigars(['aa'], 1, day(4))
+        transfers.move_cigars(['bb'], 3, day(7))
+        db.session.commit()
+        transfers.take_snapshot(db.session.connection())
+        transfers.move_cigars(['aa'], 3, day(3))
+        db.session.commit()
+        # By date, 'aa' went to 3 on the 3rd and to 1 on the 4th.
+        self.assertEqual(transfers.location_of('aa', day(7)), 1)
+        self.assertEqual(transfers.locations_at(day(7)),
+                         {'aa': 1, 'bb': 3, 'cc': 1})
+        self.assertEqual(transfers.locations_at(day(3)),
+                         {'aa': 3, 'bb': 2, 'cc': 1})
+        for n in range(1, 9):
+            held = transfers.locations_at(day(n))
+            for location in (1, 2, 3):
+                self.assertEqual(
+                    transfers.cigars_at(location, day(n)),
+                    sorted(hash for hash, at in held.items()
+                           if at == location))
+
+    def test_cigars_bought_later(self):
+        # Ensure cigars bought after the date asked about are left out.
+        db.session.add(Inventory(hash='dd', location=2,
+                                 purchase_date=day(5)))
+        db.session.commit()
+        self.assertEqual(transfers.cigars_at(2, day(3)), ['aa', 'bb'])
+        self.assertEqual(transfers.cigars_at(2, day(6)), ['aa', 'bb', 'dd'])
+        self.assertIsNone(transfers.location_of('dd', day(3)))
+        self.assertEqual(transfers.location_of('dd', day(6)), 2)
+
+    def test_location_route(self):
+        # Ensure the point-in-time query is served.
+        transfers.move_cigars(['aa'], 1, day(2))
+        db.session.commit()
+        response = self.client.get('/inventory/locations/2?at=2016-09-01')
+        self.assertEqual(response.json['cigars'], ['aa', 'bb'])
+        response = self.client.get('/inventory/locations/2?at=yesterday')
+        self.assert400(response)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# project/server/tests/test_user_cache.py
+
+
+import unittest
+
+from flask_login import current_user
+
+from base import BaseTestCase
+from project.server import db, load_user, user_cache
+from project.server.models import User
+from project.server.user.cache import UserSnapshot
+
+
+class TestUserCache(BaseTestCase):
+
+    def test_load_user_caches_snapshot(self):
+        # Ensure the second load is a cache hit returning a snapshot.
+        hits = user_cache.hits
+        first = load_user('1')
+        second = load_user('1')
+        self.assertIsInstance(first, UserSnapshot)
+        self.assertIs(first, second)
+        self.assertEqual(user_cache.hits, hits + 1)
+        self.assertEqual(second.email, 'ad@min.com')
+
+    def test_snapshot_is_immutable(self):
+        # Ensure cached users can't be modified in place.
+        snapshot = load_user('1')
+        with self.assertRaises(AttributeError):
+            snapshot.email = 'other@min.com'
+
+    def test_update_invalidates(self):
+        # Ensure committed edits are seen on the next load.
+        load_user('1')
+        User.query.get(1).email = 'new@min.com'
+        db.session.commit()
+        self.assertEqual(load_user('1').email, 'new@min.com')
+
+    def test_delete_invalidates(self):
+        # Ensure deleted users stop loading.
+        load_user('1')
+        db.session.delete(User.query.get(1))
+        db.session.commit()
+        self.assertIsNone(load_user('1'))
+
+    def test_rollback_keeps_entry(self):
+        # Ensure rolled back edits leave the cache alone.
+        snapshot = load_user('1')
+        User.query.get(1).email = 'new@min.com'
+        db.session.flush()
+        db.session.rollback()
+        self.assertIs(load_user('1'), snapshot)
+
+    def test_current_user_is_snapshot(self):
+        # Ensure requests after login are served from the cache.
+        with self.client:
+            self.client.post('/login', data=dict(
+                email='ad@min.com', password='admin_user'
+            ), follow_redirects=True)
+            self.client.get('/members')
+            self.assertIsInstance(current_user._get_current_object(),
+                                  UserSnapshot)
+            self.assertGreater(user_cache.hit_rate, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
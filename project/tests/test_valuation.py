@@ -0,0 +1,125 @@
+# project/server/tests/test_valuation.py
+
+
+import datetime
+import decimal
+import unittest
+
+from base import BaseTestCase
+from project.server import db
+from project.server.inventory import transfers, valuation
+from project.server.models import Brand, Inventory, Location, Product, \
+    ValuationRollup
+
+
+def day(year, month, day=1):
+    return datetime.datetime(year, month, day)
+
+
+class TestValuation(BaseTestCase):
+
+    def setUp(self):
+        super(TestValuation, self).setUp()
+        db.session.add_all([
+            Brand(id=1, name='Padron'),
+            Brand(id=2, name='Tatuaje'),
+            Product(id=1, name='1964 Anniversary', brand=1),
+            Product(id=2, name='Havana VI', brand=2),
+            Location(id=1, name='Tupperdor'),
+            Location(id=2, name='Humidor'),
+        ])
+        db.session.commit()
+        db.session.add_all([
+            Inventory(hash='aa', product=1, location=1,
+                      purchase_date=day(2015, 3, 10), purchase_price='10.00'),
+            Inventory(hash='bb', product=1, location=1,
+                      purchase_date=day(2015, 11, 2), purchase_price='12.50'),
+            Inventory(hash='cc', product=2, location=2,
+                      purchase_date=day(2016, 2, 20), purchase_price='8.25'),
+            # Without a price it isn't valued.
+            Inventory(hash='dd', product=2, location=1,
+                      purchase_date=day(2016, 2, 20)),
+        ])
+        db.session.commit()
+
+    def totals(self, measure, dimension, period, start=None, end=None):
+        return dict((row['name'], [(p['start'], p[measure])
+                                   for p in row['periods']])
+                    for row in valuation.series(measure, dimension, period,
+                                                start, end))
+
+    def rollup_rows(self):
+        return sorted(
+            (row.period, row.dimension, row.key, row.start, row.spend,
+             row.purchases, row.value)
+            for row in ValuationRollup.query
+            if row.spend or row.purchases or row.value)
+
+    def test_spend_by_brand(self):
+        # Ensure spend is summed per brand and year.
+        self.assertEqual(
+            self.totals('spend', 'brand', 'year', day(2015, 1),
+                        day(2016, 12, 31)),
+            {'Padron': [('2015-01-01', 22.5)],
+             'Tatuaje': [('2016-01-01', 8.25)]})
+        self.assertEqual(
+            self.totals('spend', 'location', 'month', day(2015, 6),
+                        day(2015, 12)),
+            {'Tupperdor': [('2015-11-01', 12.5)]})
+
+    def test_holdings_follow_transfers(self):
+        # Ensure moves shift value between locations from their month.
+        transfers.move_cigars(['aa'], 2, day(2016, 1, 15))
+        db.session.commit()
+        self.assertEqual(
+            self.totals('value', 'location', 'month', day(2015, 12),
+                        day(2016, 2)),
+            {'Tupperdor': [('2015-12-01', 22.5), ('2016-01-01', 12.5),
+                           ('2016-02-01', 12.5)],
+             'Humidor': [('2015-12-01', 0.0), ('2016-01-01', 10.0),
+                         ('2016-02-01', 18.25)]})
+        self.assertEqual(
+            self.totals('value', 'brand', 'year', day(2016, 1)),
+            {'Padron': [('2016-01-01', 22.5)],
+             'Tatuaje': [('2016-01-01', 8.25)]})
+
+    def test_incremental_matches_rebuild(self):
+        # Ensure session edits keep the rollups as a recompute has them.
+        transfers.move_cigars(['aa', 'cc'], 2, day(2016, 4))
+        db.session.commit()
+        db.session.expire_all()
+        bb = Inventory.query.filter_by(hash='bb').one()
+        bb.purchase_price = decimal.Decimal('15.00')
+        bb.location = 2
+        Inventory.query.filter_by(hash='dd').one().purchase_price = 4
+        Product.query.get(2).brand = 1
+        db.session.commit()
+        db.session.delete(Inventory.query.filter_by(hash='cc').one())
+        db.session.commit()
+
+        incremental = self.rollup_rows()
+        self.assertEqual(valuation.rebuild(db.session.connection()),
+                         len(ValuationRollup.query.all()))
+        db.session.commit()
+        self.assertEqual(self.rollup_rows(), incremental)
+        self.assertEqual(
+            self.totals('spend', 'brand', 'year'),
+            {'Padron': [('2015-01-01', 25.0), ('2016-01-01', 4.0)]})
+
+    def test_valuation_route(self):
+        # Ensure the API serves ranges and rejects bad arguments.
+        response = self.client.get(
+            '/inventory/valuation/spend/brand?period=year&from=2015&to=2016')
+        self.assert200(response)
+        self.assertEqual(response.json['total'], 30.75)
+        self.assertEqual([row['name'] for row in response.json['rows']],
+                         ['Padron', 'Tatuaje'])
+        self.assert404(self.client.get('/inventory/valuation/spend/size'))
+        self.assert400(self.client.get(
+            '/inventory/valuation/value/brand?period=week'))
+        self.assert400(self.client.get(
+            '/inventory/valuation/value/brand?from=last-year'))
+
+
+if __name__ == '__main__':
+    unittest.main()